@@ -0,0 +1,421 @@
+"""Benchmarks for the YoFiles scan engine.
+
+Generates deterministic directory trees of a few shapes in a temporary
+directory and times the headless engine on them: the sequential walk
+behind get_folder_size, the full scan scan_folder_thread drives, serving
+a listing from a size tree (what load_from_cache does on a miss) and
+sorting a listing. Results can be saved as JSON and compared with an
+earlier run:
+
+    python benchmark.py --save before.json
+    python benchmark.py --baseline before.json --save after.json
+
+Every shape is built from a seeded random.Random, so the same --seed and
+--scale produce the same tree (names, sizes, links) on every run.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import statistics
+import subprocess
+
+from folder_scanner import (FolderScanner, SizeTreeIndex, DEFAULT_WORKERS, format_size,
+                            sort_items)
+
+SHAPES = ('wide', 'deep', 'tiny', 'sparse', 'links')
+
+BENCHMARKS = ('walk', 'scan', 'listing', 'sort')
+
+DEFAULT_SEED = 1
+
+# Timed runs per benchmark (after one discarded warm-up run)
+DEFAULT_REPEAT = 3
+
+# Rows a listing page shows (folder_size_viewer.ROW_PAGE_SIZE)
+PAGE_ROWS = 1000
+
+# Ratio to the baseline's best time above which a result is flagged
+REGRESSION_THRESHOLD = 1.10
+
+# Syscall model for one directory: openat, fstat, the final empty
+# getdents64 and close, plus one getdents64 per buffer of entries; every
+# entry is then stat()ed once (d_type answers is_dir() for free)
+DIR_SYSCALLS = 4
+GETDENTS_BUFFER = 32768
+DIRENT_BYTES = 32
+
+# Windows paths stop at MAX_PATH (260 characters) unless long paths are
+# enabled system-wide, so the deep shape stays short of it there
+DEEP_PATH_LIMIT = 259 if os.name == 'nt' else None
+
+# Cleanup recursion (shutil.rmtree, and os.walk before Python 3.12) needs
+# one frame per level, so the deep chain stays this far under the limit
+DEEP_RECURSION_MARGIN = 100
+
+# Apparent sizes of the sparse shape's files; NTFS allocates a truncated
+# file unless it is marked sparse, so Windows gets small ones
+SPARSE_SIZES = ((1 << 30, 8 << 30, 64 << 30) if os.name != 'nt'
+                else (16 << 20, 32 << 20, 64 << 20))
+
+
+def _count(base, scale):
+    return max(1, int(base * scale))
+
+
+def _write(path, size, data=None):
+    """Create a file of size bytes: real data if given, else a hole"""
+    with open(path, 'wb') as f:
+        if data is not None:
+            f.write(data[:size])
+        else:
+            f.truncate(size)
+
+
+def build_wide(root, rng, scale):
+    """One flat directory of 100k files (sizes up to 64 KB, as holes)"""
+    for index in range(_count(100000, scale)):
+        _write(os.path.join(root, f"file{index:06d}.{rng.choice(('txt', 'jpg', 'log', 'dat'))}"),
+               rng.randrange(65536))
+
+
+def build_deep(root, rng, scale):
+    """A chain of up to 1000 nested directories with ten small files each
+
+    The chain stays short of the recursion limit, and on Windows it ends
+    where a file path would pass MAX_PATH, so the depth there depends on
+    how long root is.
+    """
+    data = bytes(rng.getrandbits(8) for _ in range(4096))
+    depth_limit = sys.getrecursionlimit() - DEEP_RECURSION_MARGIN
+    if DEEP_PATH_LIMIT is not None:
+        # Two characters per level, three more for the deepest files' names
+        depth_limit = max(1, (DEEP_PATH_LIMIT - len(os.path.abspath(root)) - 3) // 2)
+    path = root
+    for depth in range(min(_count(1000, scale), depth_limit)):
+        path = os.path.join(path, 'd')
+        os.mkdir(path)
+        for index in range(10):
+            _write(os.path.join(path, f"f{index}"), rng.randrange(4096), data)
+
+
+def build_tiny(root, rng, scale):
+    """100k files of up to 512 bytes of real data in 20 x 25 directories"""
+    data = bytes(rng.getrandbits(8) for _ in range(512))
+    per_dir = _count(200, scale)
+    for top in range(20):
+        for sub in range(25):
+            path = os.path.join(root, f"t{top:02d}", f"s{sub:02d}")
+            os.makedirs(path)
+            for index in range(per_dir):
+                _write(os.path.join(path, f"{index}.bin"), rng.randrange(513), data)
+
+
+def build_sparse(root, rng, scale):
+    """A few huge files that are (almost) all holes"""
+    for index in range(8):
+        _write(os.path.join(root, f"disk{index}.img"), rng.choice(SPARSE_SIZES))
+
+
+def build_links(root, rng, scale):
+    """Hard links spread over several directories plus symlink loops
+
+    Where links cannot be made (Windows without the privilege, some
+    filesystems) the shape just has fewer entries.
+    """
+    data = bytes(rng.getrandbits(8) for _ in range(8192))
+    dirs = [os.path.join(root, f"l{index:02d}") for index in range(50)]
+    for path in dirs:
+        os.mkdir(path)
+        try:
+            # The scanner must list these and never follow them
+            os.symlink('..', os.path.join(path, 'parent_loop'))
+            os.symlink('.', os.path.join(path, 'self_loop'))
+            os.symlink('missing', os.path.join(path, 'dangling'))
+        except (OSError, NotImplementedError):
+            pass
+    for index in range(_count(2000, scale)):
+        first = os.path.join(rng.choice(dirs), f"h{index:05d}")
+        _write(first, rng.randrange(8193), data)
+        for other in rng.sample(dirs, 3):
+            try:
+                os.link(first, os.path.join(other, f"h{index:05d}.link"))
+            except (OSError, NotImplementedError):
+                break
+
+
+BUILDERS = {'wide': build_wide, 'deep': build_deep, 'tiny': build_tiny,
+            'sparse': build_sparse, 'links': build_links}
+
+
+def build_tree(root, shape, scale=1.0, seed=DEFAULT_SEED):
+    """Generate one shape below root; the same arguments always give the same tree"""
+    rng = random.Random(f"{seed}:{shape}")
+    os.makedirs(root, exist_ok=True)
+    BUILDERS[shape](root, rng, scale)
+
+
+def remove_tree(root):
+    """Empty root bottom-up without recursion, leaving root itself"""
+    folders = []
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        folders.append(path)
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                else:
+                    os.unlink(entry.path)
+    for path in reversed(folders[1:]):
+        os.rmdir(path)
+
+
+def largest_listing(tree):
+    """Path of the directory with the most entries in a scanned tree"""
+    return max(tree.iter_nodes(),
+               key=lambda item: len(item[1].file_names) + len(item[1].children))[0]
+
+
+def syscall_model(stats):
+    """Estimated syscalls per entry for a scan with scan_stats() stats"""
+    entries = stats['dirs'] + stats['files']
+    if not entries:
+        return None
+    calls = (stats['dirs'] * DIR_SYSCALLS + entries
+             + entries * DIRENT_BYTES // GETDENTS_BUFFER)
+    return round(calls / entries, 2)
+
+
+def strace_syscalls(root):
+    """Syscalls of a sequential walk of root counted by strace -c, or None without strace
+
+    An empty directory is walked the same way first and its count
+    subtracted, which leaves out the interpreter's own startup.
+    """
+    strace = shutil.which('strace')
+    if strace is None:
+        return None
+    code = ("import sys; from folder_scanner import FolderScanner; "
+            "FolderScanner(sys.argv[1], workers=1, keep_files=False).get_folder_size(sys.argv[1])")
+    here = os.path.dirname(os.path.abspath(__file__))
+    counts = []
+    with tempfile.TemporaryDirectory(prefix='yofiles-strace-') as scratch:
+        empty = os.path.join(scratch, 'empty')
+        os.mkdir(empty)
+        output = os.path.join(scratch, 'strace.txt')
+        for target in (empty, root):
+            try:
+                subprocess.run([strace, '-f', '-c', '-o', output, sys.executable, '-c', code,
+                                target], cwd=here, check=True, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+                with open(output, encoding='utf-8') as f:
+                    counts.append(parse_strace_total(f.read()))
+            except (OSError, subprocess.CalledProcessError):
+                return None
+    if None in counts:
+        return None
+    return counts[1] - counts[0]
+
+
+def parse_strace_total(text):
+    """Call count from the 'total' line of an strace -c summary"""
+    for line in text.splitlines():
+        fields = line.split()
+        if fields and fields[-1] == 'total' and len(fields) >= 5:
+            try:
+                return int(fields[3])
+            except ValueError:
+                return None
+    return None
+
+
+def _time(function, repeat):
+    """(best, median) seconds of repeat runs after one warm-up run"""
+    function()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+def _peak_memory(function):
+    """Peak Python heap use of one run in bytes (traced separately: tracing slows runs down)"""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_shape(root, repeat=DEFAULT_REPEAT, workers=DEFAULT_WORKERS, use_strace=False):
+    """Run every benchmark on one generated tree; returns {benchmark: result dict}"""
+    scanner = FolderScanner(root, workers=workers)
+    tree = scanner.scan().tree
+    stats = scanner.scan_stats()
+    entries = stats['dirs'] + stats['files']
+    index = SizeTreeIndex()
+    index.add(tree)
+    listing_path = largest_listing(tree)
+    listing = tree.descendant(os.path.relpath(listing_path, root)).folder_data()
+
+    def walk():
+        FolderScanner(root, workers=1, keep_files=False).get_folder_size(root)
+
+    def scan():
+        FolderScanner(root, workers=workers).scan()
+
+    def serve_listing():
+        index.lookup(listing_path).folder_data()
+
+    def sort():
+        for key in ("name", "size", "files"):
+            sort_items(listing, key)
+        listing.top_rows(PAGE_ROWS)
+
+    results = {}
+    for name, function, count in (('walk', walk, entries), ('scan', scan, entries),
+                                  ('listing', serve_listing, len(listing)),
+                                  ('sort', sort, len(listing))):
+        best, median = _time(function, repeat)
+        results[name] = {
+            'entries': count,
+            'best': round(best, 5),
+            'median': round(median, 5),
+            'entries_per_second': round(count / best) if best else None,
+            'peak_memory': _peak_memory(function),
+        }
+    results['walk']['syscalls_per_entry'] = syscall_model(stats)
+    if use_strace:
+        measured = strace_syscalls(root)
+        if measured is not None and entries:
+            results['walk']['strace_syscalls_per_entry'] = round(measured / entries, 2)
+    results['scan']['bytes'] = stats['bytes']
+    results['scan']['errors'] = stats['errors']
+    return results
+
+
+def run(shapes=SHAPES, scale=1.0, seed=DEFAULT_SEED, repeat=DEFAULT_REPEAT,
+        workers=DEFAULT_WORKERS, base_dir=None, use_strace=False, out=sys.stdout):
+    """Generate and benchmark each shape in turn; returns the JSON-ready report"""
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'seed': seed,
+        'repeat': repeat,
+        'workers': workers,
+        'results': {},
+    }
+    for shape in shapes:
+        try:
+            with tempfile.TemporaryDirectory(prefix=f'yofiles-bench-{shape}-',
+                                             dir=base_dir) as root:
+                try:
+                    start = time.perf_counter()
+                    build_tree(root, shape, scale, seed)
+                    out.write(f"{shape}: generated in {time.perf_counter() - start:.1f}s\n")
+                    out.flush()
+                    report['results'][shape] = bench_shape(root, repeat, workers, use_strace)
+                finally:
+                    # TemporaryDirectory's own cleanup recurses per level
+                    remove_tree(root)
+        except (OSError, RecursionError) as e:
+            # One shape the filesystem cannot hold should not cost the others
+            out.write(f"{shape}: skipped - {e}\n")
+            out.flush()
+            report.setdefault('skipped', {})[shape] = str(e)
+    return report
+
+
+def print_report(report, baseline=None, out=sys.stdout):
+    """Table of a report, with the ratio to a baseline report's best times if given"""
+    header = (f"{'shape':<8} {'benchmark':<9} {'entries':>9} {'best':>9} {'median':>9} "
+              f"{'entries/s':>11} {'peak mem':>10} {'sys/entry':>9}")
+    if baseline is not None:
+        header += f" {'vs base':>8}"
+    out.write(header + "\n")
+    regressions = 0
+    for shape, benchmarks in report['results'].items():
+        for name, result in benchmarks.items():
+            syscalls = result.get('strace_syscalls_per_entry', result.get('syscalls_per_entry'))
+            line = (f"{shape:<8} {name:<9} {result['entries']:>9,} {result['best']:>8.4f}s "
+                    f"{result['median']:>8.4f}s {result['entries_per_second'] or 0:>11,} "
+                    f"{format_size(result['peak_memory']):>10} "
+                    f"{syscalls if syscalls is not None else '':>9}")
+            if baseline is not None:
+                old = baseline.get('results', {}).get(shape, {}).get(name)
+                if old and old['best']:
+                    ratio = result['best'] / old['best']
+                    line += f" {ratio:>7.2f}x"
+                    if ratio > REGRESSION_THRESHOLD:
+                        line += " slower"
+                        regressions += 1
+            out.write(line + "\n")
+    if baseline is not None:
+        if baseline.get('scale') != report['scale'] or baseline.get('seed') != report['seed']:
+            out.write("Note: the baseline used a different --scale or --seed\n")
+        out.write(f"{regressions} benchmark(s) more than "
+                  f"{(REGRESSION_THRESHOLD - 1) * 100:.0f}% slower than the baseline\n")
+    return regressions
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog="benchmark.py",
+        description="Benchmark the scan engine on generated directory trees.")
+    parser.add_argument("--shapes", nargs="+", choices=SHAPES, default=list(SHAPES),
+                        help="tree shapes to generate (default: all)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="multiply every shape's entry counts (default: 1.0, about 100k "
+                             "entries for wide and tiny)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED,
+                        help=f"generator seed (default: {DEFAULT_SEED})")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help=f"timed runs per benchmark (default: {DEFAULT_REPEAT})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"scan workers for the scan benchmark (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--dir", metavar="DIR",
+                        help="generate the trees below DIR (default: the system temp directory)")
+    parser.add_argument("--strace", action="store_true",
+                        help="also count the walk's syscalls with strace -c, if installed")
+    parser.add_argument("--save", metavar="FILE", help="write the results to FILE as JSON")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="compare with results saved by an earlier --save")
+    return parser
+
+
+def main(argv=None):
+    """Command line entry point; returns 1 if any benchmark regressed against --baseline"""
+    args = build_arg_parser().parse_args(argv)
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline, encoding='utf-8') as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            sys.stderr.write(f"Error: cannot read baseline - {e}\n")
+            return 2
+
+    report = run(args.shapes, args.scale, args.seed, max(1, args.repeat), args.workers,
+                 args.dir, args.strace)
+    regressions = print_report(report, baseline)
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""Duplicate file finder for YoFiles.
+
+Works from the file sizes a scan already collected in its DirNode tree,
+so only files sharing a size are ever opened. Candidates are narrowed in
+stages: same size, then the same hash of their first and last blocks,
+then the same hash of their whole contents. Hashing runs in a process
+pool so several files are read and hashed at once.
+"""
+import os
+import stat
+import hashlib
+import multiprocessing
+from collections import namedtuple, defaultdict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+# Bytes read from each end of a file for the partial hash; files up to
+# twice this size are hashed completely by that stage already
+EDGE_BYTES = 64 * 1024
+
+# Read size for full-content hashes
+READ_BUFFER = 1024 * 1024
+
+# Hashing processes (1 hashes on the calling thread)
+DEFAULT_PROCESSES = min(4, os.cpu_count() or 1)
+
+# Work handed to a process at a time; small enough that a stop request
+# only waits for the batches already running
+BATCH_FILES = 64
+BATCH_BYTES = 256 * 1024 * 1024
+
+# Seconds between stop checks while waiting for hashes
+POLL_INTERVAL = 0.1
+
+
+class DuplicateGroup(namedtuple('DuplicateGroup', 'size paths')):
+    """Files with identical contents; all copies but one could be reclaimed"""
+
+    __slots__ = ()
+
+    @property
+    def reclaimable(self):
+        return self.size * (len(self.paths) - 1)
+
+
+def edge_hash(path, size):
+    """Hash of the first and last EDGE_BYTES of a file"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(EDGE_BYTES))
+        if size > EDGE_BYTES:
+            f.seek(max(EDGE_BYTES, size - EDGE_BYTES))
+            digest.update(f.read(EDGE_BYTES))
+    return digest.digest()
+
+
+def full_hash(path):
+    """Hash of a file's whole contents, read in READ_BUFFER chunks"""
+    digest = hashlib.blake2b(digest_size=32)
+    buffer = bytearray(READ_BUFFER)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])
+    return digest.digest()
+
+
+def hash_batch(stage, items):
+    """Hash (path, size) items for one stage; unreadable files get None
+
+    Module level so process pool workers can import it.
+    """
+    results = []
+    for path, size in items:
+        try:
+            digest = edge_hash(path, size) if stage == 'edge' else full_hash(path)
+        except OSError:
+            digest = None
+        results.append((path, size, digest))
+    return results
+
+
+def _batches(items):
+    batch = []
+    batch_bytes = 0
+    for path, size in items:
+        batch.append((path, size))
+        batch_bytes += size
+        if len(batch) >= BATCH_FILES or batch_bytes >= BATCH_BYTES:
+            yield batch
+            batch = []
+            batch_bytes = 0
+    if batch:
+        yield batch
+
+
+class DuplicateFinder:
+    """Finds files with identical contents below a scanned DirNode.
+
+    Follows FolderScanner's shape: iter_find() yields the same
+    ('update_progress', ...) and ('update_status', text) events the GUI
+    queue already understands, find() runs it to completion. Either
+    leaves the groups, largest reclaimable first, in self.groups. Symlinks
+    and other non-regular files are skipped, and hard links to one inode
+    count as a single file since deleting a link frees nothing.
+    """
+
+    def __init__(self, should_stop=None, processes=DEFAULT_PROCESSES, min_size=1):
+        self.should_stop = should_stop
+        self.processes = max(1, processes)
+        self.min_size = max(1, min_size)
+        self.groups = []
+        self.stats = None
+        self._stop_requested = False
+
+    def stop(self):
+        """Ask a running search to finish as soon as possible"""
+        self._stop_requested = True
+
+    @property
+    def stopped(self):
+        if self._stop_requested:
+            return True
+        return bool(self.should_stop and self.should_stop())
+
+    def find(self, node):
+        for _ in self.iter_find(node):
+            pass
+        return self.groups
+
+    def iter_find(self, node):
+        self.groups = []
+        self.stats = {'files': 0, 'same_size': 0, 'edge_hashed': 0, 'full_hashed': 0}
+
+        # Stage 1: sizes straight from the scan, no I/O
+        by_size = defaultdict(list)
+        for dir_path, current in node.iter_nodes():
+            for name, size in zip(current.file_names, current.file_sizes):
+                if size >= self.min_size:
+                    by_size[size].append(os.path.join(dir_path, name))
+        self.stats['files'] = sum(len(paths) for paths in by_size.values())
+        candidates = [paths for paths in by_size.values() if len(paths) > 1]
+        del by_size
+        if self.stopped:
+            return
+
+        # Re-check the candidates now: the scan may be old, and it counts
+        # symlinks and hard links as files of their own
+        yield ('update_status', f"Checking {sum(map(len, candidates)):,} files of equal size...")
+        by_size = defaultdict(list)
+        seen = set()
+        for paths in candidates:
+            # Sorted so the link kept for a hard-linked file is predictable
+            for path in sorted(paths):
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(st.st_mode) or st.st_size < self.min_size:
+                    continue
+                if st.st_ino and (st.st_dev, st.st_ino) in seen:
+                    continue
+                seen.add((st.st_dev, st.st_ino))
+                by_size[st.st_size].append(path)
+            if self.stopped:
+                return
+        groups = [(size, paths) for size, paths in by_size.items() if len(paths) > 1]
+        del seen, by_size, candidates
+        self.stats['same_size'] = sum(len(paths) for _, paths in groups)
+
+        executor = None
+        try:
+            if self.processes > 1 and groups:
+                # The GUI forks from a process with live threads (Tk, scans,
+                # the watcher), which can leave a child holding their locks
+                try:
+                    executor = ProcessPoolExecutor(max_workers=self.processes,
+                                                   mp_context=multiprocessing.get_context('spawn'))
+                except (OSError, NotImplementedError, ImportError):
+                    executor = None
+
+            # Stage 2: first and last blocks
+            items = [(path, size) for size, paths in groups for path in paths]
+            yield ('update_status', f"Comparing the first and last blocks of {len(items):,} files...")
+            digests = yield from self._hash_stage('edge', items, executor)
+            if digests is None:
+                return
+            self.stats['edge_hashed'] = len(items)
+            complete, partial = self._split(digests, lambda size: size <= 2 * EDGE_BYTES)
+
+            # Stage 3: whole contents, only for the big files still tied
+            items = [(path, size) for size, paths in partial for path in paths]
+            if items:
+                yield ('update_status', f"Hashing {len(items):,} files in full...")
+                digests = yield from self._hash_stage('full', items, executor)
+                if digests is None:
+                    return
+                self.stats['full_hashed'] = len(items)
+                complete.extend(self._split(digests, lambda size: True)[0])
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=not self.stopped)
+
+        self.groups = sorted((DuplicateGroup(size, sorted(paths)) for size, paths in complete),
+                             key=lambda group: (-group.reclaimable, group.paths[0]))
+
+    def _split(self, digests, is_final):
+        """Group hashed paths by (size, digest) into (final, undecided) lists of (size, paths)"""
+        final = []
+        undecided = []
+        for (size, _), paths in digests.items():
+            if len(paths) > 1:
+                (final if is_final(size) else undecided).append((size, paths))
+        return final, undecided
+
+    def _hash_stage(self, stage, items, executor):
+        """Hash items, yielding progress; returns {(size, digest): [paths]} or None once stopped"""
+        digests = defaultdict(list)
+        done = 0
+        for results in self._run_batches(stage, items, executor):
+            if results is None:
+                return None
+            for path, size, digest in results:
+                if digest is not None:
+                    digests[size, digest].append(path)
+            done += len(results)
+            yield ('update_progress', done, len(items), os.path.basename(results[-1][0]))
+        return digests
+
+    def _run_batches(self, stage, items, executor):
+        """Yield each batch's results as it finishes; yields None and stops if cancelled"""
+        if executor is None:
+            for batch in _batches(items):
+                if self.stopped:
+                    yield None
+                    return
+                yield hash_batch(stage, batch)
+            return
+
+        batches = {executor.submit(hash_batch, stage, batch): batch for batch in _batches(items)}
+        pending = set(batches)
+        try:
+            while pending:
+                if self.stopped:
+                    yield None
+                    return
+                done, pending = wait(pending, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        results = future.result()
+                    except BrokenProcessPool:
+                        # A worker died (killed, out of memory); hash its share here
+                        results = hash_batch(stage, batches[future])
+                    yield results
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,1914 @@
+"""Headless scan engine for YoFiles.
+
+Everything here runs without Tk so the same code can size trees from the
+GUI, from cron on a server, or under a profiler.
+"""
+import os
+import sys
+import json
+import time
+import errno
+import queue
+import argparse
+import heapq
+import threading
+import mimetypes
+from array import array
+from collections import namedtuple
+from operator import itemgetter
+from itertools import repeat
+
+from scan_cache import LRUCache, tree_bytes
+from mounts import read_mountinfo, PSEUDO_FILESYSTEMS
+from duplicates import DuplicateFinder
+from scan_export import EXPORT_FORMATS, export_records, format_for_path, open_export
+
+# Threads used to size child folders; 1 selects the sequential walker
+DEFAULT_WORKERS = 4
+
+# st_blocks counts 512-byte units wherever it exists (not on Windows)
+HAS_BLOCKS = hasattr(os.stat_result, 'st_blocks')
+
+# Rows per ('add_items', rows) event while streaming a directory's files
+ADD_BATCH_SIZE = 500
+
+# Finished folders per ('add_items', rows) event while sizing, and the
+# longest in seconds the first of a batch waits for the rest
+FOLDER_BATCH_SIZE = 50
+FOLDER_BATCH_INTERVAL = 0.1
+
+# Files kept in each subtree's largest-files list
+LARGEST_FILES = 100
+
+# Longer "extensions" are really parts of a name ("report.final draft")
+MAX_EXTENSION_LENGTH = 12
+
+# Seconds between ('scan_progress', ...) events during a scan
+PROGRESS_INTERVAL = 0.25
+
+# Directories walked between progress checks of the sequential walker
+PROGRESS_DIRS = 64
+
+# Incremental refresh re-stats files modified this close to the previous
+# scan (seconds); older files are assumed not to be growing in place
+DEFAULT_RESTAT_WINDOW = 7 * 24 * 3600
+
+
+def format_size(size_bytes):
+    """Format bytes to human readable size"""
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if size_bytes < 1024.0:
+            return f"{size_bytes:.2f} {unit}"
+        size_bytes /= 1024.0
+    return f"{size_bytes:.2f} PB"
+
+
+# Expected size of a scan, from an earlier scan of the same path: entries
+# (files, folders and mount points below the root) and bytes
+ScanEstimate = namedtuple('ScanEstimate', 'entries size')
+
+
+class ScanError(Exception):
+    """Raised when the scan root itself cannot be read"""
+
+
+def file_type(name):
+    """Type key of a file for the breakdown: its lower-cased extension, '' if it has none"""
+    dot = name.rfind('.')
+    return suffix_type(name[dot:]) if dot > 0 else ''
+
+
+def suffix_type(suffix):
+    """Type key for a raw '.ext' suffix"""
+    if len(suffix) < 2 or len(suffix) > MAX_EXTENSION_LENGTH + 1:
+        return ''
+    return suffix.lower()
+
+
+def type_family(ext):
+    """Broad kind of a file type from its MIME type ('image', 'video', 'text', ...)"""
+    mime = mimetypes.guess_type('file' + ext)[0] if ext else None
+    return mime.split('/')[0] if mime else 'other'
+
+
+def type_breakdown(totals, by_family=False):
+    """(label, bytes, files) rows from DirNode.type_totals(), largest first"""
+    if by_family:
+        families = {}
+        for ext, (size, count) in totals.items():
+            family = families.setdefault(type_family(ext), [0, 0])
+            family[0] += size
+            family[1] += count
+        totals = families
+    rows = [(label or "(no extension)", size, count) for label, (size, count) in totals.items()]
+    rows.sort(key=lambda row: (-row[1], row[0]))
+    return rows
+
+
+def add_type_totals(totals, delta, sign=1):
+    """Add {type: [bytes, files]} delta into totals in place (sign=-1 takes it out)"""
+    for ext, (size, count) in delta.items():
+        entry = totals.setdefault(ext, [0, 0])
+        entry[0] += sign * size
+        entry[1] += sign * count
+        if not entry[0] and not entry[1]:
+            del totals[ext]
+
+
+def allocated_size(st):
+    """Bytes a file actually occupies on disk (apparent size where unknown)"""
+    if HAS_BLOCKS:
+        return st.st_blocks * 512
+    return st.st_size
+
+
+class InodeSet:
+    """Compact set of (st_dev, st_ino) pairs for counting hard links once.
+
+    Inode numbers are kept as bits in 512-inode bytearray pages keyed by
+    device and page number. Filesystems hand out inode numbers in dense
+    runs, so tens of millions of inodes cost a few bytes each instead of
+    the ~70 bytes of a Python set entry. Only files with st_nlink > 1 ever
+    need to go in. Safe to share between scan worker threads.
+    """
+
+    PAGE_BITS = 9
+
+    def __init__(self):
+        self.pages = {}
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, dev, ino):
+        """Record an inode; returns False if it was already in the set"""
+        key = (dev << 64) | (ino >> self.PAGE_BITS)
+        low = ino & ((1 << self.PAGE_BITS) - 1)
+        byte, bit = low >> 3, 1 << (low & 7)
+        with self.lock:
+            page = self.pages.get(key)
+            if page is None:
+                page = self.pages[key] = bytearray(1 << (self.PAGE_BITS - 3))
+            elif page[byte] & bit:
+                return False
+            page[byte] |= bit
+            self.count += 1
+            return True
+
+    def __len__(self):
+        return self.count
+
+
+# One row of a directory listing; type is 'File', 'Folder' or 'Mount' (a
+# mount point the scan did not enter), alloc is the allocated (on-disk)
+# size next to the apparent size
+# mtime is whole seconds as the scanner saw it, 0 when unknown
+Entry = namedtuple('Entry', 'size files folders type alloc mtime', defaults=(0,))
+
+FILE = 'File'
+FOLDER = 'Folder'
+MOUNT = 'Mount'
+
+# One entry of a streamed walk (FolderScanner.iter_records); files and
+# mounts leave files/folders at 0
+Record = namedtuple('Record', 'type path size alloc files folders mtime')
+
+# EntryTable.kinds codes
+ENTRY_TYPES = (FILE, FOLDER, MOUNT)
+ENTRY_KINDS = {FILE: 0, FOLDER: 1, MOUNT: 2}
+
+
+class EntryTable:
+    """Entries of one directory listing, stored column-wise.
+
+    A dict of per-entry dicts costs several hundred bytes an entry; here
+    sizes, allocated sizes, counts and mtimes live in array('q') columns and
+    the type in a bytearray. The names are the same str objects the size tree holds, so
+    nothing is duplicated, and the name -> row index is only built on the
+    first lookup by name. Rows are read back as Entry tuples built on
+    demand. Tables are shared, not copied, between the view and
+    directory_cache, so replace a listing with a new table rather than
+    mutating one that may be cached.
+
+    append() is the only call a scan thread makes while the UI thread
+    reads the table; it stores the name last, so every row below
+    len(names) is complete, and the index catches up on its next use.
+    """
+
+    __slots__ = ('names', 'rows', 'sizes', 'allocs', 'files', 'folders', 'mtimes', 'kinds')
+
+    def __init__(self):
+        self.names = []
+        self.rows = None
+        self.sizes = array('q')
+        self.allocs = array('q')
+        self.files = array('q')
+        self.folders = array('q')
+        self.mtimes = array('q')
+        self.kinds = bytearray()
+
+    @classmethod
+    def from_node(cls, node):
+        """Listing of a size tree node's files and child folders"""
+        table = cls()
+        count = len(node.file_names)
+        table.names.extend(node.file_names)
+        table.sizes.extend(node.file_sizes)
+        table.allocs.extend(node.file_allocs)
+        table.files.extend(array('q', [1]) * count)
+        table.folders.extend(array('q', [0]) * count)
+        if len(node.file_mtimes) == count:
+            table.mtimes.extend(node.file_mtimes)
+        else:
+            table.mtimes.extend(array('q', [0]) * count)
+        table.kinds.extend(bytes(count))
+        for name, child in node.children.items():
+            table.names.append(name)
+            table.sizes.append(child.size)
+            table.allocs.append(child.alloc)
+            table.files.append(child.files)
+            table.folders.append(child.folders)
+            table.mtimes.append(child.mtime // 1000000000)
+            table.kinds.append(1)
+        for name in node.mounts or ():
+            table.names.append(name)
+            table.sizes.append(0)
+            table.allocs.append(0)
+            table.files.append(0)
+            table.folders.append(0)
+            table.mtimes.append(0)
+            table.kinds.append(2)
+        return table
+
+    def copy(self):
+        """A table with the same rows that can be changed without touching this one"""
+        table = EntryTable()
+        table.names = self.names[:]
+        if self.rows is not None:
+            table.rows = dict(self.rows)
+        table.sizes = self.sizes[:]
+        table.allocs = self.allocs[:]
+        table.files = self.files[:]
+        table.folders = self.folders[:]
+        table.mtimes = self.mtimes[:]
+        table.kinds = self.kinds[:]
+        return table
+
+    def index(self):
+        """name -> row dict, built on first use and extended over rows appended since"""
+        rows = self.rows
+        if rows is None:
+            rows = self.rows = {}
+        names = self.names
+        for row in range(len(rows), len(names)):
+            rows[names[row]] = row
+        return rows
+
+    def append(self, name, entry):
+        """Add an entry whose name is known not to be in the table yet"""
+        self.sizes.append(entry.size)
+        self.allocs.append(entry.alloc)
+        self.files.append(entry.files)
+        self.folders.append(entry.folders)
+        self.mtimes.append(entry.mtime)
+        self.kinds.append(ENTRY_KINDS[entry.type])
+        self.names.append(name)
+
+    def top_rows(self, count):
+        """Row numbers of the count largest entries, largest first"""
+        rows = range(len(self.names))
+        if count >= len(rows):
+            return sorted(rows, key=self.sizes.__getitem__, reverse=True)
+        return heapq.nlargest(count, rows, key=self.sizes.__getitem__)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index()
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __getitem__(self, name):
+        return self.entry(self.index()[name])
+
+    def __setitem__(self, name, entry):
+        row = self.index().get(name)
+        if row is None:
+            self.append(name, entry)
+        else:
+            self.sizes[row] = entry.size
+            self.allocs[row] = entry.alloc
+            self.files[row] = entry.files
+            self.folders[row] = entry.folders
+            self.mtimes[row] = entry.mtime
+            self.kinds[row] = ENTRY_KINDS[entry.type]
+
+    def __delitem__(self, name):
+        # Move the last row into the hole; listing order is not meaningful
+        rows = self.index()
+        row = rows.pop(name)
+        last = len(self.names) - 1
+        if row != last:
+            moved = self.names[last]
+            self.names[row] = moved
+            self.sizes[row] = self.sizes[last]
+            self.allocs[row] = self.allocs[last]
+            self.files[row] = self.files[last]
+            self.folders[row] = self.folders[last]
+            self.mtimes[row] = self.mtimes[last]
+            self.kinds[row] = self.kinds[last]
+            rows[moved] = row
+        self.names.pop()
+        self.sizes.pop()
+        self.allocs.pop()
+        self.files.pop()
+        self.folders.pop()
+        self.mtimes.pop()
+        self.kinds.pop()
+
+    def get(self, name, default=None):
+        row = self.index().get(name)
+        return default if row is None else self.entry(row)
+
+    def entry(self, row):
+        return Entry(self.sizes[row], self.files[row], self.folders[row],
+                     ENTRY_TYPES[self.kinds[row]], self.allocs[row], self.mtimes[row])
+
+    def items(self):
+        for row, name in enumerate(self.names):
+            yield name, self.entry(row)
+
+    def values(self):
+        for row in range(len(self.names)):
+            yield self.entry(row)
+
+    @property
+    def total_size(self):
+        return sum(self.sizes)
+
+    @property
+    def total_alloc(self):
+        return sum(self.allocs)
+
+    @property
+    def total_files(self):
+        return sum(self.files)
+
+    @property
+    def total_folders(self):
+        return sum(self.folders)
+
+
+class ScanResult:
+    """Outcome of a complete (or cancelled) scan of one directory
+
+    tree is the scanned DirNode tree, or None if the scan was cancelled.
+    """
+
+    def __init__(self, path, folder_data, elapsed, cancelled, tree=None):
+        self.path = path
+        self.folder_data = folder_data
+        self.elapsed = elapsed
+        self.cancelled = cancelled
+        self.tree = tree
+
+    @property
+    def total_size(self):
+        return self.folder_data.total_size
+
+    @property
+    def total_alloc(self):
+        return self.folder_data.total_alloc
+
+    @property
+    def total_files(self):
+        return self.folder_data.total_files
+
+    @property
+    def total_folders(self):
+        return self.folder_data.total_folders
+
+    def to_dict(self, sort_key="size"):
+        """Plain dict suitable for json.dump"""
+        return {
+            'path': self.path,
+            'total_size': self.total_size,
+            'total_alloc': self.total_alloc,
+            'total_files': self.total_files,
+            'total_folders': self.total_folders,
+            'elapsed': round(self.elapsed, 3),
+            'cancelled': self.cancelled,
+            'items': [dict(data._asdict(), name=name)
+                      for name, data in sort_items(self.folder_data, sort_key)],
+        }
+
+
+class DirNode:
+    """One directory in the in-memory size tree.
+
+    size/alloc/files/folders are totals for the whole subtree (the
+    directory itself is not counted in folders), matching get_folder_size;
+    alloc is the allocated size from st_blocks. Files directly inside the
+    directory are kept in file_names/file_sizes/file_allocs (and their
+    whole-second mtimes in file_mtimes) when the scanner was asked to keep
+    them, so any scanned descendant can be listed again without touching
+    the disk. mounts names subdirectories that are mount points the scan
+    did not enter (None when there are none). own_types totals the
+    directory's own files by extension as {type: [bytes, files]} (None
+    when it has no files); it is collected in the walk even when file
+    names are not kept. largest caches largest_files() for subtrees with
+    more than LARGEST_FILES files (None until built and after any change
+    below the node). The root node of a tree is
+    named by its full path; every other node by its basename. mtime/ino/dev
+    come from the directory's own stat and let persisted trees be checked
+    against the disk later.
+    """
+
+    __slots__ = ('name', 'parent', 'children', 'file_names', 'file_sizes', 'file_allocs',
+                 'file_mtimes', 'own_size', 'own_alloc', 'own_files', 'size', 'alloc',
+                 'files', 'folders', 'mtime', 'ino', 'dev', 'mounts', 'own_types', 'largest')
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.children = {}
+        self.file_names = []
+        self.file_sizes = array('q')
+        self.file_allocs = array('q')
+        self.file_mtimes = array('q')
+        self.own_size = 0
+        self.own_alloc = 0
+        self.own_files = 0
+        self.size = 0
+        self.alloc = 0
+        self.files = 0
+        self.folders = 0
+        self.mtime = 0
+        self.ino = 0
+        self.dev = 0
+        self.mounts = None
+        self.own_types = None
+        self.largest = None
+
+    def set_stat(self, stat_result):
+        self.mtime = stat_result.st_mtime_ns
+        self.ino = stat_result.st_ino
+        self.dev = stat_result.st_dev
+
+    def add_mount(self, name):
+        if self.mounts is None:
+            self.mounts = []
+        self.mounts.append(name)
+
+    def add_type(self, name, size, count=1):
+        """Charge size bytes and count files to the type of file name in own_types"""
+        ext = file_type(name)
+        if self.own_types is None:
+            self.own_types = {}
+        totals = self.own_types.get(ext)
+        if totals is None:
+            self.own_types[ext] = [size, count]
+            return
+        totals[0] += size
+        totals[1] += count
+        if totals[1] <= 0:
+            del self.own_types[ext]
+
+    def merge_types(self, suffixes):
+        """Add {raw suffix: [bytes, files]} totals from a directory listing to own_types"""
+        if self.own_types is None and all(suffix_type(suffix) == suffix for suffix in suffixes):
+            self.own_types = suffixes
+            return
+        if self.own_types is None:
+            self.own_types = {}
+        for suffix, (size, count) in suffixes.items():
+            totals = self.own_types.setdefault(suffix_type(suffix), [0, 0])
+            totals[0] += size
+            totals[1] += count
+
+    def recount_types(self):
+        """Rebuild own_types from the kept file lists"""
+        self.own_types = None
+        for name, size in zip(self.file_names, self.file_sizes):
+            self.add_type(name, size)
+
+    def type_totals(self):
+        """{type: [bytes, files]} for the whole subtree, merged from every own_types"""
+        merged = {}
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            stack.extend(node.children.values())
+            if node.own_types is None:
+                continue
+            for ext, (size, count) in node.own_types.items():
+                totals = merged.get(ext)
+                if totals is None:
+                    merged[ext] = [size, count]
+                else:
+                    totals[0] += size
+                    totals[1] += count
+        return merged
+
+    def largest_files(self):
+        """(size, name, node) for the LARGEST_FILES biggest files in the subtree, largest first
+
+        Each list is the top of the directory's own files merged with its
+        children's lists, so building one touches every file only once
+        and then only LARGEST_FILES entries per directory. Lists of small
+        subtrees are not kept; their parent just gathers them again.
+        """
+        if self.largest is not None:
+            return self.largest
+
+        order = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(child for child in node.children.values() if child.largest is None)
+
+        small = {}
+        size_key = itemgetter(0)
+        for node in reversed(order):
+            sizes = node.file_sizes
+            names = node.file_names
+            if len(names) > LARGEST_FILES:
+                candidates = [(sizes[index], names[index], node) for index in
+                              sorted(range(len(names)), key=sizes.__getitem__,
+                                     reverse=True)[:LARGEST_FILES]]
+            else:
+                candidates = list(zip(sizes, names, repeat(node)))
+            for child in node.children.values():
+                child_list = child.largest
+                candidates.extend(child_list if child_list is not None else small.pop(child))
+            if node.files > LARGEST_FILES:
+                # Children's lists are sorted runs already, which sort() merges cheaply
+                candidates.sort(key=size_key, reverse=True)
+                del candidates[LARGEST_FILES:]
+                node.largest = candidates
+            else:
+                # Everything in a small subtree is a candidate; order only when asked
+                small[node] = candidates
+        if self.largest is not None:
+            return self.largest
+        return sorted(small[self], key=size_key, reverse=True)
+
+    def iter_nodes(self):
+        """Yield (path, node) for this node and every descendant, parents first"""
+        stack = [(self.path, self)]
+        while stack:
+            path, node = stack.pop()
+            yield path, node
+            for name, child in node.children.items():
+                stack.append((os.path.join(path, name), child))
+
+    def copy(self, name=None):
+        """A detached copy of this subtree whose root is named name (default: this node's name)
+
+        Lets a background thread change a stored tree without touching
+        the nodes other threads read; largest lists are rebuilt on demand.
+        """
+        root = None
+        stack = [(self, None)]
+        while stack:
+            node, parent = stack.pop()
+            twin = DirNode(node.name, parent)
+            twin.file_names = node.file_names[:]
+            twin.file_sizes = node.file_sizes[:]
+            twin.file_allocs = node.file_allocs[:]
+            twin.file_mtimes = node.file_mtimes[:]
+            twin.own_size = node.own_size
+            twin.own_alloc = node.own_alloc
+            twin.own_files = node.own_files
+            twin.size = node.size
+            twin.alloc = node.alloc
+            twin.files = node.files
+            twin.folders = node.folders
+            twin.mtime = node.mtime
+            twin.ino = node.ino
+            twin.dev = node.dev
+            if node.mounts is not None:
+                twin.mounts = node.mounts[:]
+            if node.own_types is not None:
+                twin.own_types = {key: totals[:] for key, totals in node.own_types.items()}
+            if parent is None:
+                root = twin
+                if name is not None:
+                    twin.name = name
+            else:
+                parent.children[twin.name] = twin
+            # Reversed so children are added in their original order
+            stack.extend((child, twin) for child in reversed(list(node.children.values())))
+        return root
+
+    @property
+    def path(self):
+        parts = []
+        node = self
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        return os.path.join(node.name, *reversed(parts))
+
+    def update_totals(self):
+        """Recompute this node's totals from its own files and its children's totals"""
+        size = self.own_size
+        alloc = self.own_alloc
+        files = self.own_files
+        folders = len(self.children)
+        for child in self.children.values():
+            size += child.size
+            alloc += child.alloc
+            files += child.files
+            folders += child.folders
+        self.size = size
+        self.alloc = alloc
+        self.files = files
+        self.folders = folders
+        self.largest = None
+
+    def finalize(self):
+        """Recompute totals for the whole subtree, children before parents"""
+        order = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(node.children.values())
+        for node in reversed(order):
+            node.update_totals()
+
+    def remove(self, name):
+        """Take file or directory name out of this node, correcting totals; returns the removed DirNode if any"""
+        child = self.children.pop(name, None)
+        if child is not None:
+            self.propagate(-child.size, -child.files, -(child.folders + 1), -child.alloc)
+            return child
+        try:
+            index = self.file_names.index(name)
+        except ValueError:
+            return None
+        size = self.file_sizes[index]
+        alloc = self.file_allocs[index]
+        del self.file_names[index]
+        del self.file_sizes[index]
+        del self.file_allocs[index]
+        del self.file_mtimes[index]
+        self.own_size -= size
+        self.own_alloc -= alloc
+        self.own_files -= 1
+        self.add_type(name, -size, -1)
+        self.propagate(-size, -1, 0, -alloc)
+        return None
+
+    def propagate(self, size, files, folders, alloc=0):
+        """Add a delta to this node and every ancestor"""
+        node = self
+        while node is not None:
+            node.size += size
+            node.alloc += alloc
+            node.files += files
+            node.folders += folders
+            node.largest = None
+            node = node.parent
+
+    def descendant(self, rel_path):
+        """Return the node at rel_path below this one, or None if it was never scanned"""
+        node = self
+        for part in rel_path.split(os.sep):
+            if part in ('', '.'):
+                continue
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def entry(self):
+        """This directory as a row of its parent's listing"""
+        return Entry(self.size, self.files, self.folders, FOLDER, self.alloc,
+                     self.mtime // 1000000000)
+
+    def folder_data(self):
+        """Entries of this directory as an EntryTable"""
+        return EntryTable.from_node(self)
+
+
+class SizeTreeIndex:
+    """Scanned directory trees keyed by the path each scan started from.
+
+    A scan of a path inside an existing tree is grafted into it (replacing
+    the stale subtree and correcting every ancestor's totals), and trees
+    for paths below a newly added root are absorbed, so each directory
+    lives in exactly one tree. With max_bytes set, whole trees are evicted
+    least recently used first once their estimated size exceeds it;
+    on_evict(path, node) is told about each one.
+    """
+
+    def __init__(self, max_bytes=None, on_evict=None):
+        self.on_evict = on_evict
+        self.roots = LRUCache(max_bytes=max_bytes, sizeof=tree_bytes, on_evict=self._evicted)
+        self.scanned_at = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _evicted(self, path, node):
+        self.scanned_at.pop(path, None)
+        if self.on_evict:
+            self.on_evict(path, node)
+
+    def _root_for(self, path):
+        """Return (root_path, root_node) of the tree containing path, or (None, None)"""
+        probe = path
+        while True:
+            node = self.roots.peek(probe)
+            if node is not None:
+                return probe, node
+            parent = os.path.dirname(probe)
+            if parent == probe:
+                return None, None
+            probe = parent
+
+    def find(self, path):
+        """Return the DirNode for path if any stored tree covers it"""
+        root_path, root = self._root_for(os.path.normpath(path))
+        if root is None:
+            return None
+        return root.descendant(os.path.relpath(path, root_path))
+
+    def lookup(self, path):
+        """find() for navigation: counts hits/misses and marks the tree as recently used"""
+        root_path, root = self._root_for(os.path.normpath(path))
+        node = None
+        if root is not None:
+            node = root.descendant(os.path.relpath(path, root_path))
+        if node is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.roots.touch(root_path)
+        # Watcher and refresh deltas change a tree's size in place
+        self.roots.update_cost(root_path)
+        return node
+
+    def scan_time(self, path):
+        """When the tree covering path was scanned, or None"""
+        root_path, _ = self._root_for(os.path.normpath(path))
+        return self.scanned_at.get(root_path)
+
+    def add(self, node, scanned_at=None):
+        """Store a freshly scanned tree whose root node is named by its full path"""
+        path = os.path.normpath(node.name)
+        old = self.find(path)
+        if old is not None and old.parent is not None:
+            # Graft into the enclosing tree and fix the ancestors' totals
+            parent = old.parent
+            node.name = old.name
+            node.parent = parent
+            parent.children[old.name] = node
+            parent.propagate(node.size - old.size, node.files - old.files,
+                             node.folders - old.folders, node.alloc - old.alloc)
+            self._grew(path)
+            return
+
+        parent = self.find(os.path.dirname(path)) if old is None else None
+        if (parent is not None and os.path.dirname(path) != path
+                and os.path.basename(path) not in (parent.mounts or ())):
+            # A directory that did not exist when the enclosing tree was scanned
+            node.name = os.path.basename(path)
+            node.parent = parent
+            parent.children[node.name] = node
+            parent.propagate(node.size, node.files, node.folders + 1, node.alloc)
+            self._grew(path)
+            return
+
+        node.name = path
+        self.scanned_at[path] = scanned_at if scanned_at is not None else time.time()
+        prefix = os.path.join(path, '')
+        for root_path in [p for p in self.roots if p != path and p.startswith(prefix)]:
+            # Trees for mount points the new scan did not enter stay separate
+            if node.descendant(os.path.relpath(root_path, path)) is None:
+                continue
+            del self.roots[root_path]
+            del self.scanned_at[root_path]
+        self.roots[path] = node
+
+    def _grew(self, path):
+        """Re-estimate the memory of the tree holding path after a graft"""
+        root_path, _ = self._root_for(path)
+        if root_path is not None:
+            self.roots.touch(root_path)
+            self.roots.update_cost(root_path)
+
+    def discard(self, path):
+        path = os.path.normpath(path)
+        self.roots.pop(path, None)
+        self.scanned_at.pop(path, None)
+
+    def remove(self, path):
+        """Take a deleted file or directory out of the tree holding it
+
+        The enclosing directories' totals are corrected in place; trees
+        rooted at or below path are dropped.
+        """
+        path = os.path.normpath(path)
+        prefix = os.path.join(path, '')
+        for root_path in [p for p in self.roots if p == path or p.startswith(prefix)]:
+            self.discard(root_path)
+        parent_path = os.path.dirname(path)
+        parent = self.find(parent_path)
+        if parent is not None:
+            parent.remove(os.path.basename(path))
+            self._grew(parent_path)
+
+
+class FolderScanner:
+    """Sizes the immediate children of one directory.
+
+    The scanner has no knowledge of any UI. Results are streamed from
+    iter_scan() as ('add_items', [(name, entry), ...]) and
+    ('update_progress', processed, total, name) events, or collected in one
+    go with scan(). should_stop is an optional callable polled alongside
+    the scanner's own stop() flag so callers can keep their existing
+    cancellation state. With workers > 1 the child folders are sized
+    concurrently by iter_folder_sizes_parallel().
+
+    Every scan also builds a DirNode tree (self.tree) holding the totals
+    of every directory below the root. keep_files=False skips recording
+    individual file names, which keeps memory small for one-off command
+    line scans that never browse the tree.
+
+    With count_links_once, a file with several hard links is charged
+    (apparent and allocated bytes) only at the first link the walk meets;
+    later links still count as files but add 0 bytes, like du. The seen
+    inodes are kept in an InodeSet (pass one in to share it between
+    scanners). Windows DirEntry stats carry no inode numbers, so there
+    every link is charged.
+
+    While subtrees are walked, iter_scan() also yields ('scan_progress',
+    entries, size, estimate) every PROGRESS_INTERVAL seconds: entries and
+    bytes seen so far (entries_done/bytes_done) and the estimate passed
+    in (a ScanEstimate from an earlier scan, or None) to measure them
+    against, since the top-level counts of 'update_progress' say little
+    when one child holds most of the tree.
+
+    Mount points of pseudo filesystems (/proc, /sys, ...) are never
+    entered unless prune_pseudo=False, and with one_filesystem no other
+    mount is either: neither mount points from /proc/self/mountinfo nor
+    directories whose st_dev differs from the scan root's. They are
+    recorded in the parent's DirNode.mounts and listed as 'Mount' rows.
+    """
+
+    check_interval = 100  # Check stop flag every N files
+
+    def __init__(self, root_path, should_stop=None, workers=DEFAULT_WORKERS, keep_files=True,
+                 count_links_once=False, inodes=None, one_filesystem=False, prune_pseudo=True,
+                 estimate=None):
+        self.root_path = root_path
+        self.should_stop = should_stop
+        self.workers = max(1, workers)
+        self.keep_files = keep_files
+        self.inodes = None
+        if count_links_once:
+            self.inodes = inodes if inodes is not None else InodeSet()
+        self.one_filesystem = one_filesystem
+        self.mount_types = read_mountinfo() if one_filesystem or prune_pseudo else {}
+        if not one_filesystem:
+            self.mount_types = {path: fstype for path, fstype in self.mount_types.items()
+                                if fstype in PSEUDO_FILESYSTEMS}
+        self.root_dev = 0
+        self.tree = None
+        self.refresh_stats = None
+        self.estimate = estimate
+        self.entries_done = 0
+        self.bytes_done = 0
+        # Instrumentation, see scan_stats()
+        self.files_done = 0
+        self.dirs_done = 0
+        self.timings = {'listing': 0.0, 'top_level_stat': 0.0, 'sizing': 0.0}
+        self.errors = {}
+        self._errors_lock = threading.Lock()
+        self._sizing_start = None
+        self._stop_requested = False
+
+    def stop(self):
+        """Ask a running scan to finish as soon as possible"""
+        self._stop_requested = True
+
+    @property
+    def stopped(self):
+        if self._stop_requested:
+            return True
+        return bool(self.should_stop and self.should_stop())
+
+    def _count_error(self, error):
+        """Tally a swallowed OSError by errno name (EACCES, ENOENT, ...)"""
+        name = errno.errorcode.get(error.errno, type(error).__name__)
+        with self._errors_lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def scan_stats(self):
+        """Instrumentation of the scan so far as a JSON-ready dict
+
+        Phase timings in seconds (listing the root, the stat calls within
+        it, sizing the subtrees), directories and files read and their
+        rates over the sizing phase, and swallowed errors by errno.
+        """
+        timings = dict(self.timings)
+        if not timings['sizing'] and self._sizing_start is not None:
+            # Still running, or stopped before it finished
+            timings['sizing'] = time.perf_counter() - self._sizing_start
+        sizing = timings['sizing']
+        return {
+            'path': os.fspath(self.root_path),
+            'workers': self.workers,
+            'timings': {phase: round(seconds, 4) for phase, seconds in timings.items()},
+            'dirs': self.dirs_done,
+            'files': self.files_done,
+            'bytes': self.bytes_done,
+            'dirs_per_second': round(self.dirs_done / sizing) if sizing else None,
+            'files_per_second': round(self.files_done / sizing) if sizing else None,
+            'errors': dict(sorted(self.errors.items())),
+        }
+
+    def _charge(self, st):
+        """(apparent, allocated) bytes a file adds to the totals"""
+        if self.inodes is not None and st.st_nlink > 1 and not self.inodes.add(st.st_dev, st.st_ino):
+            return 0, 0
+        return st.st_size, allocated_size(st)
+
+    def _skips_mount(self, path, dev):
+        """True for a mount point this scan lists but does not enter (dev 0 = unknown)"""
+        if self.mount_types and os.path.abspath(path) in self.mount_types:
+            return True
+        return (self.one_filesystem and dev != 0 and self.root_dev != 0
+                and dev != self.root_dev)
+
+    def _read_dir(self, path, node, subdirs):
+        """List one directory into node, appending (entry, child_node) for each subdirectory
+
+        One os.scandir pass per directory: DirEntry already knows whether it
+        is a directory and caches its stat, so no extra isdir/getsize calls
+        or path joins are needed. Symlinks are counted as files and never
+        followed. Unreadable directories simply contribute nothing (but
+        are counted in the scan's errors). Returns (files, directories,
+        bytes) read, for progress reporting.
+        """
+        total_size = 0
+        total_alloc = 0
+        file_count = 0
+        dir_count = 0
+        check_interval = self.check_interval
+        charge = self._charge
+        check_mounts = self.one_filesystem or bool(self.mount_types)
+        children = node.children
+        types = {}
+        if self.keep_files:
+            file_names = node.file_names
+            file_sizes = node.file_sizes
+            file_allocs = node.file_allocs
+            file_mtimes = node.file_mtimes
+        else:
+            file_names = file_sizes = file_allocs = file_mtimes = None
+
+        try:
+            dir_iter = os.scandir(path)
+        except OSError as e:
+            self._count_error(e)
+            return 0, 0, 0
+
+        with dir_iter:
+            try:
+                for entry in dir_iter:
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError as e:
+                        self._count_error(e)
+                        continue
+
+                    if is_dir:
+                        dir_count += 1
+                        child = DirNode(entry.name, node)
+                        try:
+                            child.set_stat(entry.stat(follow_symlinks=False))
+                        except OSError as e:
+                            self._count_error(e)
+                        if check_mounts and self._skips_mount(entry.path, child.dev):
+                            node.add_mount(entry.name)
+                            continue
+                        children[entry.name] = child
+                        subdirs.append((entry, child))
+                        continue
+
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                        size, alloc = charge(st)
+                        mtime = int(st.st_mtime)
+                    except OSError as e:
+                        self._count_error(e)
+                        size = alloc = mtime = 0
+                    file_count += 1
+                    total_size += size
+                    total_alloc += alloc
+                    # Raw suffix here; file_type() normalises once per suffix below
+                    name = entry.name
+                    dot = name.rfind('.')
+                    suffix = name[dot:] if dot > 0 else ''
+                    type_totals = types.get(suffix)
+                    if type_totals is None:
+                        types[suffix] = [size, 1]
+                    else:
+                        type_totals[0] += size
+                        type_totals[1] += 1
+                    if file_names is not None:
+                        file_names.append(name)
+                        file_sizes.append(size)
+                        file_allocs.append(alloc)
+                        file_mtimes.append(mtime)
+
+                    # Frequent stop checks for large directories
+                    if file_count % check_interval == 0 and self.stopped:
+                        break
+            except OSError as e:
+                self._count_error(e)
+
+        node.own_size += total_size
+        node.own_alloc += total_alloc
+        node.own_files += file_count
+        if types:
+            node.merge_types(types)
+        return file_count, dir_count, total_size
+
+    def iter_records(self, folder_path=None):
+        """Walk a whole tree yielding a Record for every file, directory and skipped mount
+
+        Nothing is kept once yielded: a directory's record follows all of
+        its contents (depth first, post-order) and only the stack of
+        directories being walked is held, so memory does not grow with the
+        size of the tree. Raises ScanError if the root cannot be read.
+        """
+        root_path = os.fspath(folder_path if folder_path is not None else self.root_path)
+        try:
+            root_stat = os.stat(root_path)
+        except OSError as e:
+            raise ScanError(f"Cannot access directory - {str(e)}")
+        if not self.root_dev:
+            self.root_dev = root_stat.st_dev
+        check_mounts = self.one_filesystem or bool(self.mount_types)
+        # Frame: [path, subdirectories left to walk, size, alloc, files, folders, mtime]
+        stack = [[root_path, [], 0, 0, 0, 0, int(root_stat.st_mtime)]]
+        fresh = True
+
+        while stack:
+            if self.stopped:
+                return
+            frame = stack[-1]
+
+            if fresh:
+                # First visit: files go out at once, subdirectories are queued
+                fresh = False
+                try:
+                    dir_iter = os.scandir(frame[0])
+                except OSError:
+                    dir_iter = None
+                if dir_iter is not None:
+                    with dir_iter:
+                        try:
+                            for entry in dir_iter:
+                                try:
+                                    is_dir = entry.is_dir(follow_symlinks=False)
+                                except OSError:
+                                    continue
+                                if is_dir:
+                                    try:
+                                        st = entry.stat(follow_symlinks=False)
+                                        dev, mtime = st.st_dev, int(st.st_mtime)
+                                    except OSError:
+                                        dev = mtime = 0
+                                    if check_mounts and self._skips_mount(entry.path, dev):
+                                        yield Record(MOUNT, entry.path, 0, 0, 0, 0, 0)
+                                        continue
+                                    frame[1].append((entry.path, mtime))
+                                    continue
+                                try:
+                                    st = entry.stat(follow_symlinks=False)
+                                    size, alloc = self._charge(st)
+                                    mtime = int(st.st_mtime)
+                                except OSError:
+                                    size = alloc = mtime = 0
+                                frame[2] += size
+                                frame[3] += alloc
+                                frame[4] += 1
+                                yield Record(FILE, entry.path, size, alloc, 0, 0, mtime)
+                                if frame[4] % self.check_interval == 0 and self.stopped:
+                                    return
+                        except OSError:
+                            pass
+
+            if frame[1]:
+                path, mtime = frame[1].pop()
+                stack.append([path, [], 0, 0, 0, 0, mtime])
+                fresh = True
+                continue
+
+            stack.pop()
+            yield Record(FOLDER, frame[0], frame[2], frame[3], frame[4], frame[5], frame[6])
+            if stack:
+                parent = stack[-1]
+                parent[2] += frame[2]
+                parent[3] += frame[3]
+                parent[4] += frame[4]
+                parent[5] += frame[5] + 1
+
+    def walk(self, folder_path, node=None):
+        """Walk a whole subtree into a DirNode (created if not given) and return it
+
+        Directories are walked with an explicit stack of DirEntry objects
+        rather than nested generators. Totals are filled in afterwards in
+        one bottom-up pass; a stopped walk leaves them partial.
+        """
+        if node is None:
+            node = DirNode(os.fspath(folder_path))
+            try:
+                node.set_stat(os.stat(folder_path))
+            except OSError:
+                pass
+        for _ in self.iter_walk(folder_path, node):
+            pass
+        return node
+
+    def iter_walk(self, folder_path, node):
+        """walk() as a generator that yields every PROGRESS_DIRS directories
+
+        Lets iter_scan() report progress from inside one large subtree;
+        entries_done and bytes_done grow as directories are read.
+        """
+        if not self.root_dev:
+            self.root_dev = node.dev
+        stack = [(folder_path, node)]
+        count = 0
+
+        while stack:
+            # Check if scan should stop at directory level
+            if self.stopped:
+                break
+
+            path, current = stack.pop()
+            files, dirs, size = self._read_dir(path, current, stack)
+            self.entries_done += files + dirs
+            self.bytes_done += size
+            self.files_done += files
+            self.dirs_done += 1
+            count += 1
+            if count % PROGRESS_DIRS == 0:
+                yield
+
+        node.finalize()
+        if self.keep_files:
+            node.largest_files()
+
+    def get_folder_size(self, folder_path):
+        """Calculate folder size with file and folder counts - optimized with frequent stop checks"""
+        node = self.walk(folder_path)
+        return node.size, node.files, node.folders
+
+    def _relist(self, path, node, st):
+        """Re-read a directory whose mtime changed, keeping the nodes of surviving subdirectories
+
+        Returns (entry, node) pairs for subdirectories that are new and
+        still need a full walk.
+        """
+        fresh = DirNode(node.name)
+        subdirs = []
+        self._read_dir(path, fresh, subdirs)
+
+        old_children = node.children
+        node.children = {}
+        new_dirs = []
+        for entry, child in subdirs:
+            old = old_children.get(child.name)
+            if old is not None:
+                # Keeps its old mtime so it is checked on its own
+                node.children[child.name] = old
+            else:
+                child.parent = node
+                node.children[child.name] = child
+                new_dirs.append((entry, child))
+
+        node.file_names = fresh.file_names
+        node.file_sizes = fresh.file_sizes
+        node.file_allocs = fresh.file_allocs
+        node.file_mtimes = fresh.file_mtimes
+        node.own_size = fresh.own_size
+        node.own_alloc = fresh.own_alloc
+        node.own_files = fresh.own_files
+        node.mounts = fresh.mounts
+        node.own_types = fresh.own_types
+        node.set_stat(st)
+        return new_dirs
+
+    def _restat_files(self, path, node, threshold):
+        """Re-stat files of an unchanged directory modified at or after threshold
+
+        Returns (files re-stat'ed, files whose size changed).
+        """
+        file_names = node.file_names
+        file_sizes = node.file_sizes
+        file_allocs = node.file_allocs
+        file_mtimes = node.file_mtimes
+        restatted = resized = 0
+        for index, mtime in enumerate(file_mtimes):
+            if mtime < threshold:
+                continue
+            try:
+                st = os.lstat(os.path.join(path, file_names[index]))
+            except OSError:
+                continue
+            restatted += 1
+            if st.st_size != file_sizes[index]:
+                resized += 1
+                alloc = allocated_size(st)
+                node.own_size += st.st_size - file_sizes[index]
+                node.own_alloc += alloc - file_allocs[index]
+                node.add_type(file_names[index], st.st_size - file_sizes[index], 0)
+                file_sizes[index] = st.st_size
+                file_allocs[index] = alloc
+            file_mtimes[index] = int(st.st_mtime)
+        return restatted, resized
+
+    def iter_refresh(self, node, scanned_at, restat_window=DEFAULT_RESTAT_WINDOW):
+        """Bring an existing tree up to date, touching only what may have changed.
+
+        Every directory is stat'ed; only those whose mtime or inode differs
+        from the tree are listed again (adding or removing an entry always
+        updates the parent's mtime). New subdirectories are walked in full.
+        In unchanged directories, files modified within restat_window
+        seconds before scanned_at are re-stat'ed to catch files that grew
+        in place; restat_window=None re-stats every file and 0 none.
+        Totals are then recomputed and the size delta is propagated to the
+        node's ancestors. Yields ('update_progress', checked, total, path)
+        events; counters are left in self.refresh_stats.
+        """
+        if restat_window is None:
+            threshold = float('-inf')
+        elif restat_window == 0:
+            threshold = float('inf')
+        else:
+            threshold = scanned_at - restat_window
+
+        old_totals = (node.size, node.files, node.folders, node.alloc)
+        total_dirs = node.folders + 1
+        stats = {'checked': 0, 'relisted': 0, 'new_dirs': 0, 'removed': 0,
+                 'restatted': 0, 'resized': 0}
+        self.refresh_stats = stats
+        stack = [(node.path, node)]
+        if not self.root_dev:
+            self.root_dev = node.dev
+
+        while stack:
+            # A stopped refresh still leaves consistent (partly updated) totals
+            if self.stopped:
+                break
+
+            path, current = stack.pop()
+            stats['checked'] += 1
+            if stats['checked'] % 200 == 0:
+                yield ('update_progress', stats['checked'], total_dirs, path)
+
+            try:
+                st = os.stat(path)
+            except OSError:
+                # Gone (or unreadable) - drop it from the tree
+                if current is not node:
+                    current.parent.children.pop(current.name, None)
+                    stats['removed'] += 1
+                continue
+
+            fresh = ()
+            if st.st_mtime_ns != current.mtime or (current.ino and st.st_ino != current.ino):
+                before = len(current.children)
+                new_dirs = self._relist(path, current, st)
+                for entry, child in new_dirs:
+                    self.walk(entry, child)
+                fresh = {child.name for _, child in new_dirs}
+                stats['relisted'] += 1
+                stats['new_dirs'] += len(new_dirs)
+                stats['removed'] += before - (len(current.children) - len(new_dirs))
+            else:
+                restatted, resized = self._restat_files(path, current, threshold)
+                stats['restatted'] += restatted
+                stats['resized'] += resized
+
+            for name, child in current.children.items():
+                if name not in fresh:
+                    stack.append((os.path.join(path, name), child))
+
+        node.finalize()
+        if node.parent is not None:
+            node.parent.propagate(node.size - old_totals[0], node.files - old_totals[1],
+                                  node.folders - old_totals[2], node.alloc - old_totals[3])
+        if self.keep_files:
+            node.largest_files()
+        yield ('update_progress', total_dirs, total_dirs, "")
+
+    def refresh(self, node, scanned_at, restat_window=DEFAULT_RESTAT_WINDOW):
+        """Run iter_refresh to completion and return its counters"""
+        for _ in self.iter_refresh(node, scanned_at, restat_window):
+            pass
+        return self.refresh_stats
+
+    def iter_folder_sizes_parallel(self, folder_items):
+        """Size many subtrees at once, yielding the index of each folder item as it finishes
+
+        While waiting it also yields None about every 0.1 s so the caller
+        can report progress.
+
+        A pool of self.workers threads pulls individual directories off one
+        shared LIFO work queue, so a single huge subtree is spread over every
+        worker instead of pinning one of them. os.scandir releases the GIL
+        while it waits on the filesystem, which is where the time goes on
+        SSD/NVMe arrays and network shares. Each directory is read into its
+        own DirNode; a child is finalized and reported once it has no
+        outstanding directories left.
+        """
+        count = len(folder_items)
+        pending = [1] * count
+        # Seed in reverse so the first child is popped (and finished) first
+        work = [(index, entry, node)
+                for index, (_, entry, node) in reversed(list(enumerate(folder_items)))]
+        lock = threading.Condition()
+        finished = queue.Queue()
+        state = {'outstanding': count, 'abort': False}
+
+        def worker():
+            while True:
+                with lock:
+                    while not work and state['outstanding'] and not state['abort']:
+                        lock.wait(0.1)
+                    if not work or state['abort']:
+                        return
+                    index, directory, node = work.pop()
+
+                if self.stopped:
+                    with lock:
+                        state['abort'] = True
+                        lock.notify_all()
+                    return
+
+                subdirs = []
+                files, dirs, size = self._read_dir(directory, node, subdirs)
+
+                with lock:
+                    self.entries_done += files + dirs
+                    self.bytes_done += size
+                    self.files_done += files
+                    self.dirs_done += 1
+                    work.extend((index, entry, child) for entry, child in subdirs)
+                    pending[index] += len(subdirs) - 1
+                    state['outstanding'] += len(subdirs) - 1
+                    if pending[index] == 0:
+                        finished.put(index)
+                    if subdirs or not state['outstanding']:
+                        lock.notify_all()
+
+        # Subdirectories go to whichever worker is free, so even a root with
+        # a single child folder keeps every worker busy
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            reported = 0
+            while reported < count:
+                if self.stopped:
+                    return
+                try:
+                    index = finished.get(timeout=0.1)
+                except queue.Empty:
+                    yield None
+                    continue
+                if self.stopped:
+                    return
+                reported += 1
+                # No worker touches this subtree any more
+                folder_items[index][2].finalize()
+                if self.keep_files:
+                    folder_items[index][2].largest_files()
+                yield index
+        finally:
+            with lock:
+                state['abort'] = True
+                lock.notify_all()
+            for thread in threads:
+                thread.join()
+
+    def list_top_level(self, root):
+        """Read the root directory into root and split it into (file_items, folder_items).
+
+        Uses the same single scandir pass as the subtree walk. Folder items
+        carry their DirEntry and DirNode so the subtree walk can start from
+        them directly. Raises ScanError if the root cannot be listed.
+        Returns None if the scan was stopped while listing.
+        """
+        file_items = []
+        folder_items = []
+        start = time.perf_counter()
+        stat_time = 0.0
+        try:
+            root.set_stat(os.stat(self.root_path))
+            self.root_dev = root.dev
+            with os.scandir(self.root_path) as dir_iter:
+                for entry in dir_iter:
+                    if self.stopped:
+                        return None
+
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError as e:
+                        self._count_error(e)
+                        continue
+                    self.entries_done += 1
+
+                    if is_dir:
+                        child = DirNode(entry.name, root)
+                        stat_start = time.perf_counter()
+                        try:
+                            child.set_stat(entry.stat(follow_symlinks=False))
+                        except OSError as e:
+                            self._count_error(e)
+                        stat_time += time.perf_counter() - stat_start
+                        if self._skips_mount(entry.path, child.dev):
+                            root.add_mount(entry.name)
+                            continue
+                        root.children[entry.name] = child
+                        folder_items.append((entry.name, entry, child))
+                        continue
+
+                    stat_start = time.perf_counter()
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                        size, alloc = self._charge(st)
+                        mtime = int(st.st_mtime)
+                    except OSError as e:
+                        self._count_error(e)
+                        size = alloc = mtime = 0
+                    stat_time += time.perf_counter() - stat_start
+                    self.bytes_done += size
+                    self.files_done += 1
+                    root.own_size += size
+                    root.own_alloc += alloc
+                    root.own_files += 1
+                    root.add_type(entry.name, size)
+                    if self.keep_files:
+                        root.file_names.append(entry.name)
+                        root.file_sizes.append(size)
+                        root.file_allocs.append(alloc)
+                        root.file_mtimes.append(mtime)
+                    file_items.append((entry.name, size, alloc, mtime))
+        except OSError as e:
+            raise ScanError(f"Cannot access directory - {str(e)}")
+
+        self.dirs_done += 1
+        self.timings['listing'] = time.perf_counter() - start
+        self.timings['top_level_stat'] = stat_time
+        return file_items, folder_items
+
+    def iter_scan(self):
+        """Stream scan events for the root directory.
+
+        Files are reported first (instant) and folders afterwards, as each
+        subtree finishes sizing. The generator simply ends early when the
+        scan is stopped; check `stopped` afterwards to tell the difference.
+        The finished DirNode tree is left in self.tree.
+        """
+        root = DirNode(self.root_path)
+        listing = self.list_top_level(root)
+        if listing is None:
+            return
+        file_items, folder_items = listing
+
+        total_items = len(file_items) + len(folder_items)
+        processed = 0
+
+        # Files are all known already, so they go out in large batches
+        for start in range(0, len(file_items), ADD_BATCH_SIZE):
+            if self.stopped:
+                return
+
+            # A file counts itself
+            rows = [(name, Entry(size, 1, 0, FILE, alloc, mtime))
+                    for name, size, alloc, mtime in file_items[start:start + ADD_BATCH_SIZE]]
+            yield ('add_items', rows)
+            processed += len(rows)
+            yield ('update_progress', processed, total_items, rows[-1][0])
+
+        # Mount points that were not entered are listed, not sized
+        if root.mounts:
+            yield ('add_items', [(name, Entry(0, 0, 0, MOUNT, 0)) for name in root.mounts])
+
+        next_progress = time.monotonic() + PROGRESS_INTERVAL
+        # Includes time the consumer spends between events
+        sizing_start = self._sizing_start = time.perf_counter()
+
+        if self.workers > 1 and folder_items:
+            finished = self.iter_folder_sizes_parallel(folder_items)
+        else:
+            finished = self.iter_folder_sizes_sequential(folder_items)
+
+        # Many small folders finish within moments of each other, so rows
+        # go out in batches rather than an event pair per folder
+        rows = []
+        flush_at = None
+        for index in finished:
+            now = time.monotonic()
+            if now >= next_progress:
+                next_progress = now + PROGRESS_INTERVAL
+                yield self.progress_event()
+            if index is not None:
+                name, _, node = folder_items[index]
+                rows.append((name, node.entry()))
+                processed += 1
+                if flush_at is None:
+                    flush_at = now + FOLDER_BATCH_INTERVAL
+            if rows and (len(rows) >= FOLDER_BATCH_SIZE or now >= flush_at):
+                yield ('add_items', rows)
+                yield ('update_progress', processed, total_items, rows[-1][0])
+                rows = []
+                flush_at = None
+
+        # Folders finished before a stop are still listed
+        if rows:
+            yield ('add_items', rows)
+            yield ('update_progress', processed, total_items, rows[-1][0])
+        if self.stopped:
+            return
+
+        self.timings['sizing'] = time.perf_counter() - sizing_start
+        root.update_totals()
+        if self.keep_files:
+            root.largest_files()
+        self.tree = root
+        yield self.progress_event()
+        yield ('update_progress', total_items, total_items, "")
+
+    def iter_folder_sizes_sequential(self, folder_items):
+        """Size folder items one at a time, like iter_folder_sizes_parallel
+
+        Yields the index of each folder item as it finishes and None every
+        PROGRESS_DIRS directories in between.
+        """
+        for index, (_, entry, node) in enumerate(folder_items):
+            if self.stopped:
+                return
+            for _ in self.iter_walk(entry, node):
+                yield None
+            if self.stopped:
+                return
+            yield index
+
+    def progress_event(self):
+        """('scan_progress', entries, bytes, estimate) for the walk so far"""
+        return ('scan_progress', self.entries_done, self.bytes_done, self.estimate)
+
+    def scan(self):
+        """Run a whole scan and return a ScanResult"""
+        start = time.time()
+        folder_data = EntryTable()
+        for event in self.iter_scan():
+            if event[0] == 'add_items':
+                for name, data in event[1]:
+                    folder_data.append(name, data)
+        return ScanResult(self.root_path, folder_data, time.time() - start, self.stopped,
+                          self.tree)
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        prog="folder_size_viewer.py",
+        description="Size the children of a directory without starting the GUI.")
+    parser.add_argument("--scan", metavar="PATH",
+                        help="directory to scan (required unless working on snapshots)")
+    parser.add_argument("--json", action="store_true",
+                        help="print results as JSON instead of a table")
+    parser.add_argument("--sort", choices=["size", "alloc", "name", "files", "folders"], default="size",
+                        help="ordering of the printed items (default: size)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"threads sizing child folders, 1 = sequential (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--cache", action="store_true",
+                        help="reuse (and update) the GUI's persistent disk cache")
+    parser.add_argument("--count-links-once", action="store_true",
+                        help="charge hard-linked files only once, like du")
+    parser.add_argument("-x", "--one-file-system", action="store_true",
+                        help="do not enter other mounted filesystems; list their mount points")
+    parser.add_argument("--types", action="store_true",
+                        help="also print the size breakdown by file extension")
+    parser.add_argument("--largest", action="store_true",
+                        help=f"also list the {LARGEST_FILES} largest files anywhere below PATH")
+    parser.add_argument("--duplicates", action="store_true",
+                        help="also list groups of identical files and the space they waste")
+    parser.add_argument("--export", metavar="FILE",
+                        help="stream every file and directory to FILE ('-' for stdout) instead of "
+                             "printing a summary; memory use does not grow with the tree")
+    parser.add_argument("--format", choices=EXPORT_FORMATS,
+                        help="export format (default: csv for *.csv, else jsonl)")
+    parser.add_argument("--snapshot", metavar="NAME",
+                        help="save the scanned tree's directory totals as snapshot NAME")
+    parser.add_argument("--snapshots", action="store_true",
+                        help="list saved snapshots")
+    parser.add_argument("--diff", nargs=2, metavar=("OLD", "NEW"),
+                        help="show what grew or shrank between two snapshots")
+    parser.add_argument("--stats", action="store_true",
+                        help="print scan diagnostics (phase timings, rates, errors by errno) "
+                             "as JSON to stderr")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="profile the scan with cProfile and write the stats to FILE "
+                             "(read with python -m pstats FILE)")
+    parser.add_argument("--compare", action="store_true",
+                        help="also time the sequential walker and report the parallel speedup")
+    return parser
+
+
+def scan_with_cache(path, workers):
+    """Scan through the persistent cache: refresh a stored tree incrementally or store a fresh one"""
+    # Imported here because scan_store itself builds on this module
+    import sqlite3
+    from scan_store import ScanStore
+
+    def save(tree):
+        # The scan itself succeeded; a cache that cannot be written only costs the next run
+        try:
+            store.save_tree(tree)
+        except (sqlite3.Error, UnicodeError) as e:
+            sys.stderr.write(f"Warning: could not write disk cache: {e}\n")
+
+    start = time.time()
+    store = ScanStore()
+    try:
+        loaded = store.load_tree(path, validate=False)
+        if loaded is not None:
+            root, scanned_at, _ = loaded
+            stats = FolderScanner(path, workers=workers).refresh(root, scanned_at)
+            if stats['relisted'] or stats['resized']:
+                save(root)
+            return ScanResult(path, root.folder_data(), time.time() - start, False, root)
+
+        scanner = FolderScanner(path, workers=workers)
+        result = scanner.scan()
+        if not result.cancelled:
+            save(scanner.tree)
+        return result
+    finally:
+        store.close()
+
+
+def compare_modes(path, workers):
+    """Time a sequential and a parallel scan of path, returning (sequential, parallel) seconds
+
+    A discarded warm-up scan runs first so both timed runs see the same
+    (warm) directory cache.
+    """
+    FolderScanner(path, workers=1, keep_files=False).scan()
+    sequential = FolderScanner(path, workers=1, keep_files=False).scan().elapsed
+    parallel = FolderScanner(path, workers=workers, keep_files=False).scan().elapsed
+    return sequential, parallel
+
+
+def sort_items(folder_data, key):
+    """Return (name, data) pairs ordered the same way the GUI sorts columns"""
+    if key == "name":
+        return sorted(folder_data.items())
+    return sorted(folder_data.items(), key=lambda item: getattr(item[1], key), reverse=True)
+
+
+def print_table(result, sort_key, out=sys.stdout):
+    for name, data in sort_items(result.folder_data, sort_key):
+        if data.type == MOUNT:
+            out.write(f"{'(mount)':>12} {'':>12} {'':>10} {'':>8}  {name}\n")
+            continue
+        if data.type == FOLDER:
+            counts = f"{data.files:>10,} {data.folders:>8,}"
+        else:
+            counts = f"{'':>10} {'':>8}"
+        out.write(f"{format_size(data.size):>12} {format_size(data.alloc):>12} {counts}  {name}\n")
+
+    mins, secs = divmod(int(result.elapsed), 60)
+    out.write(f"Total: {format_size(result.total_size)} "
+              f"({format_size(result.total_alloc)} on disk) | "
+              f"{result.total_files:,} files | {result.total_folders:,} folders | "
+              f"Scanned in {mins:02d}:{secs:02d}\n")
+
+
+def print_types(types, out=sys.stdout):
+    for label, size, count in types:
+        out.write(f"{format_size(size):>12} {count:>10,}  {label}\n")
+
+
+def print_duplicates(groups, out=sys.stdout):
+    for group in groups:
+        out.write(f"{format_size(group.size):>12} x{len(group.paths):<4} "
+                  f"{format_size(group.reclaimable):>12} reclaimable\n")
+        for path in group.paths:
+            out.write(f"{'':>14}{path}\n")
+    reclaimable = sum(group.reclaimable for group in groups)
+    out.write(f"Duplicates: {len(groups):,} groups | "
+              f"{sum(len(group.paths) for group in groups):,} files | "
+              f"{format_size(reclaimable)} reclaimable\n")
+
+
+def format_delta(delta):
+    """format_size for a signed change"""
+    return ('+' if delta >= 0 else '-') + format_size(abs(delta))
+
+
+def snapshot_command(args):
+    """--snapshots and --diff: work on saved snapshots without scanning"""
+    # Imported here because snapshots builds on scan_store, which builds on this module
+    from snapshots import SnapshotStore, SnapshotError
+
+    store = SnapshotStore()
+    try:
+        if args.diff:
+            diff = store.diff(*args.diff)
+        else:
+            infos = store.list()
+    except SnapshotError as e:
+        sys.stderr.write(f"Error: {e}\n")
+        return 1
+    finally:
+        store.close()
+
+    if not args.diff:
+        if args.json:
+            json.dump([info._asdict() for info in infos], sys.stdout, indent=2)
+            sys.stdout.write("\n")
+            return 0
+        for info in infos:
+            created = time.strftime('%Y-%m-%d %H:%M', time.localtime(info.created_at))
+            sys.stdout.write(f"{created}  {format_size(info.size):>12} {info.files:>12,}  "
+                             f"{info.name}  ({info.root})\n")
+        return 0
+
+    if args.json:
+        def rows(changes):
+            return [dict(change._asdict(), path=diff.full_path(change), per_day=diff.rate(change))
+                    for change in changes]
+        json.dump({'old': diff.old._asdict(), 'new': diff.new._asdict(),
+                   'size_delta': diff.size_delta, 'files_delta': diff.files_delta,
+                   'changed': len(diff.changes), 'added': diff.added, 'removed': diff.removed,
+                   'growing': rows(diff.growing()), 'shrinking': rows(diff.shrinking())},
+                  sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return 0
+
+    days = diff.interval / 86400
+    sys.stdout.write(f"{diff.old.name} -> {diff.new.name} ({days:.1f} days) | "
+                     f"Total: {format_delta(diff.size_delta)} ({diff.files_delta:+,} files) | "
+                     f"{len(diff.changes):,} folders changed, {diff.added:,} new, "
+                     f"{diff.removed:,} removed\n")
+    for title, changes in (("Growing", diff.growing()), ("Shrinking", diff.shrinking())):
+        if not changes:
+            continue
+        sys.stdout.write(f"{title}:\n")
+        for change in changes:
+            rate = diff.rate(change)
+            per_day = f"{format_delta(rate)}/day" if rate is not None else ""
+            sys.stdout.write(f"{format_delta(change.size_delta):>13} {per_day:>16} "
+                             f"{change.files_delta:>+10,} files  {diff.full_path(change)}\n")
+    return 0
+
+
+def export_scan(args):
+    """--export: stream the walk straight to a file without building a tree"""
+    fmt = args.format or format_for_path(args.export)
+    scanner = FolderScanner(args.scan, count_links_once=args.count_links_once,
+                            one_filesystem=args.one_file_system)
+    start = time.time()
+    try:
+        if args.export == '-':
+            count = export_records(scanner.iter_records(), sys.stdout, fmt)
+        else:
+            with open_export(args.export) as out:
+                count = export_records(scanner.iter_records(), out, fmt)
+    except ScanError as e:
+        sys.stderr.write(f"Error: {e}\n")
+        return 1
+    except OSError as e:
+        sys.stderr.write(f"Error writing export: {e}\n")
+        return 1
+    except KeyboardInterrupt:
+        return 130
+
+    if args.export != '-':
+        mins, secs = divmod(int(time.time() - start), 60)
+        sys.stdout.write(f"Exported {count:,} entries to {args.export} in {mins:02d}:{secs:02d}\n")
+    return 0
+
+
+def main(argv=None):
+    """Command line entry point; returns a process exit code"""
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if args.diff or args.snapshots:
+        return snapshot_command(args)
+    if args.scan is None:
+        parser.error("--scan is required")
+    if args.cache and args.stats:
+        parser.error("--stats cannot be combined with --cache")
+    if args.cache and (args.count_links_once or args.one_file_system):
+        # Stored trees charge every link and cross mounts; mixing would be wrong
+        parser.error("--cache cannot be combined with --count-links-once or --one-file-system")
+    if args.export is not None:
+        others = [flag for flag, used in (("--json", args.json), ("--cache", args.cache),
+                                          ("--types", args.types), ("--largest", args.largest),
+                                          ("--duplicates", args.duplicates),
+                                          ("--compare", args.compare)) if used]
+        if others:
+            parser.error(f"--export cannot be combined with {', '.join(others)}")
+        return export_scan(args)
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        result = scan_with_cache(args.scan, args.workers) if args.cache else None
+        scanner = None
+        if result is None:
+            scanner = FolderScanner(args.scan, workers=args.workers,
+                                    keep_files=args.duplicates or args.largest,
+                                    count_links_once=args.count_links_once,
+                                    one_filesystem=args.one_file_system)
+            result = scanner.scan()
+        if profiler is not None:
+            profiler.disable()
+            # Worker threads are not profiled; --workers 1 shows the whole walk
+            profiler.dump_stats(args.profile)
+        if args.stats and scanner is not None:
+            json.dump(scanner.scan_stats(), sys.stderr, indent=2)
+            sys.stderr.write("\n")
+        types = None
+        if args.types and result.tree is not None:
+            types = type_breakdown(result.tree.type_totals())
+        largest = None
+        if args.largest and result.tree is not None:
+            largest = [(size, os.path.join(node.path, name))
+                       for size, name, node in result.tree.largest_files()]
+        groups = None
+        if args.duplicates and result.tree is not None:
+            groups = DuplicateFinder().find(result.tree)
+        if args.snapshot and result.tree is not None:
+            from snapshots import SnapshotStore
+            store = SnapshotStore()
+            try:
+                store.save(args.snapshot, result.tree)
+            finally:
+                store.close()
+        comparison = compare_modes(args.scan, args.workers) if args.compare else None
+    except ScanError as e:
+        sys.stderr.write(f"Error: {e}\n")
+        return 1
+    except KeyboardInterrupt:
+        return 130
+
+    if args.json:
+        data = result.to_dict(args.sort)
+        if types is not None:
+            data['types'] = [{'type': label, 'size': size, 'files': count}
+                             for label, size, count in types]
+        if largest is not None:
+            data['largest'] = [{'size': size, 'path': path} for size, path in largest]
+        if groups is not None:
+            data['duplicates'] = [dict(group._asdict(), reclaimable=group.reclaimable)
+                                  for group in groups]
+        if comparison:
+            sequential, parallel = comparison
+            data['comparison'] = {
+                'workers': args.workers,
+                'sequential': round(sequential, 3),
+                'parallel': round(parallel, 3),
+                'speedup': round(sequential / parallel, 2) if parallel else None,
+            }
+        json.dump(data, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    else:
+        print_table(result, args.sort)
+        if types is not None:
+            print_types(types)
+        if largest is not None:
+            for size, path in largest:
+                sys.stdout.write(f"{format_size(size):>12}  {path}\n")
+        if groups is not None:
+            print_duplicates(groups)
+        if comparison:
+            sequential, parallel = comparison
+            speedup = f"{sequential / parallel:.2f}x" if parallel else "n/a"
+            sys.stdout.write(f"Sequential: {sequential:.3f}s | Parallel ({args.workers} workers): "
+                             f"{parallel:.3f}s | Speedup: {speedup}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,109 @@
-import tkinter as tk
-from tkinter import ttk, messagebox
 import os
+import sys
 import threading
 from pathlib import Path
 import string
 import time
 from collections import defaultdict
 import shutil
-import send2trash
 import stat
 import queue
+import multiprocessing
+import heapq
+import bisect
+import json
+import cProfile
+import pstats
+from collections import deque
 from datetime import datetime
 
+# Tk and send2trash are only needed by the GUI; the --scan command line
+# mode has to keep working on headless servers that lack them.
+try:
+    import tkinter as tk
+    from tkinter import ttk, messagebox, filedialog, simpledialog
+except ImportError:
+    tk = ttk = messagebox = filedialog = simpledialog = None
+
+try:
+    import send2trash
+except ImportError:
+    send2trash = None
+
+import sqlite3
+
+import folder_scanner
+import fs_watcher
+from folder_scanner import (FolderScanner, ScanError, ScanEstimate, SizeTreeIndex, EntryTable,
+                            type_breakdown, format_delta, add_type_totals, file_type)
+from scan_store import ScanStore, default_cache_dir, ancestor_totals
+from snapshots import SnapshotStore, SnapshotError
+from scan_cache import LRUCache, DEFAULT_BUDGET, format_bytes, listing_bytes
+from duplicates import DuplicateFinder
+from scan_export import export_records, format_for_path, open_export
+
+# Rows shown per page of a large listing (largest entries first)
+ROW_PAGE_SIZE = 1000
+
+# Seconds the UI thread may spend inserting rows per queue tick
+INSERT_BUDGET = 0.02
+
+# Milliseconds between runs of the UI queue processor
+QUEUE_INTERVAL = 50
+
+# Functions listed from a scan profile in the diagnostics
+PROFILE_ROWS = 15
+
+# Rows shown in the file type breakdown
+TYPE_ROWS = 200
+
+# Largest child folders of the current view prefetched while idle
+PREFETCH_FOLDERS = 5
+
+# Milliseconds a selection has to stay put before its metadata is read
+DETAILS_DELAY = 150
+
+# Details panel fields the scan does not record, read in the background
+LOOKUP_FIELDS = ('created', 'accessed', 'attributes', 'permissions')
+
+# Tree view icons by entry type (mount points of unscanned filesystems get their own)
+ROW_ICONS = {'File': "📄", 'Folder': "📁", 'Mount': "💽"}
+
+class ScanContext:
+    """One background job (scan, refresh, duplicate search, export) and what it owns
+
+    A job gets its own stop flag, its own listing buffer and a generation
+    number. Its thread sends everything through post(), which tags the
+    message with that generation, so once a newer job has started
+    process_queue drops the old job's messages unread: navigation never
+    has to wait for an old thread, and a slow one cannot reach the view.
+    """
+
+    def __init__(self, generation, path, update_queue):
+        self.generation = generation
+        self.path = path
+        self.update_queue = update_queue
+        self.cancelled = False
+        self.folder_data = EntryTable()
+        self.start_time = time.time()
+        # Scan options, fixed on the UI thread when the job starts
+        self.workers = folder_scanner.DEFAULT_WORKERS
+        self.count_links_once = False
+        self.one_filesystem = False
+        self.persist = False
+        self.use_disk_cache = False
+        self.incremental = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def should_stop(self):
+        return self.cancelled
+
+    def post(self, event):
+        self.update_queue.put(('job', self.generation, event))
+
+
 class FolderSizeViewer:
     def __init__(self, root):
         self.root = root
@@ -19,24 +111,93 @@ class FolderSizeViewer:
         self.root.geometry("1200x750")
 
         # Store folder sizes for sorting
-        self.folder_data = {}
+        self.folder_data = EntryTable()
         self.current_path = ""
-        self.scan_thread = None
-        self.stop_scan = False
+        # The running background job (a ScanContext) and the generation
+        # whose queue messages are still wanted
+        self.job = None
+        self.job_generation = 0
         self.is_scanning = False
 
-        # Session cache for scanned directories
-        self.directory_cache = {}
+        # Session cache for scanned directories, bounded by a memory budget
+        # (listings get a quarter of it, the size trees the rest)
+        self.cache_budget = DEFAULT_BUDGET
+        self.directory_cache = LRUCache(max_bytes=self.cache_budget // 4, sizeof=listing_bytes,
+                                        on_evict=self.on_listing_evicted)
         self.cache_timestamps = {}
 
+        # Every directory below a scanned path, so drilling down needs no rescan
+        self.size_trees = SizeTreeIndex(max_bytes=self.cache_budget - self.cache_budget // 4,
+                                        on_evict=self.on_tree_evicted)
+        self.last_cache_stats = None
+
+        # Optional on-disk cache that survives restarts (opened on first use)
+        self.scan_store = None
+        # Named snapshots for comparing scans over time (opened on first use)
+        self.snapshot_store = None
+        self.disk_cache_enabled = False
+
+        # Charge hard-linked files once (du style); needs full scans
+        self.count_links_once = False
+        # Do not descend into other mounted filesystems (du -x style)
+        self.one_filesystem = False
+
+        # inotify watcher keeping cached sizes live (Linux, opt-in)
+        self.watcher = None
+
+        # Size tree nodes are only changed on this thread, and never while a
+        # background thread (a job, a prefetch, a snapshot) may be reading
+        # them: changes that arrive meanwhile wait in deferred_changes until
+        # the last reader has ended (see change_trees)
+        self.tree_readers = 0
+        self.deferred_changes = []
+
+        # Idle prefetch of likely-next folders; bumping the generation
+        # stops the running prefetch and drops its late results
+        self.prefetch_generation = 0
+
+        # Details panel: the path it shows, the pending debounce timer and
+        # the generation whose background metadata lookup is still wanted
+        self.details_path = None
+        self.details_after = None
+        self.details_generation = 0
+
         # Progress tracking
         self.scan_start_time = None
         self.items_processed = 0
-        self.total_items = 0
+        # Once the walk reports progress, the time label shows its rate; with
+        # an earlier scan's totals the bar follows entries and bytes too
+        # instead of top-level items
+        self.walk_reported = False
+        self.walk_estimate = None
 
         # Queue for thread-safe UI updates
         self.update_queue = queue.Queue()
 
+        # Instrumentation of the last scan (see diagnostics_report); the
+        # UI thread adds its own numbers while a scan is being collected
+        self.diagnostics = None
+        self.collecting = None
+        self.last_tick = None
+        self.profile_scans = False
+
+        # The visible page of the listing: Treeview item per shown name (and
+        # back), a min-heap of (size, name) to find the smallest shown row,
+        # and rows received from the scan thread still to be inserted
+        self.row_limit = ROW_PAGE_SIZE
+        self.row_items = {}
+        self.item_names = {}
+        self.shown_heap = []
+        self.pending_rows = deque()
+        self.more_item = None
+
+        # Sorted model of the shown rows: sort_keys is in display order and
+        # row_keys holds each name's key, so new rows go straight to their
+        # place while a scan streams in. None keeps arrival order.
+        self.sort_column = None
+        self.sort_keys = []
+        self.row_keys = {}
+
         self.setup_ui()
         self.load_drives()
 
@@ -44,6 +205,65 @@ class FolderSizeViewer:
         self.process_queue()
 
     def setup_ui(self):
+        # Menu bar with scan options
+        self.menubar = tk.Menu(self.root)
+        self.root.config(menu=self.menubar)
+
+        self.options_menu = tk.Menu(self.menubar, tearoff=0)
+        self.menubar.add_cascade(label="Options", menu=self.options_menu)
+
+        # Parallel scan workers (1 = sequential walker)
+        self.workers_var = tk.IntVar(value=folder_scanner.DEFAULT_WORKERS)
+        workers_menu = tk.Menu(self.options_menu, tearoff=0)
+        for count in (1, 2, 4, 8, 16):
+            label = "1 (sequential)" if count == 1 else str(count)
+            workers_menu.add_radiobutton(label=label, variable=self.workers_var, value=count)
+        self.options_menu.add_cascade(label="Scan Workers", menu=workers_menu)
+
+        self.disk_cache_var = tk.BooleanVar(value=True)
+        self.options_menu.add_checkbutton(label="Persistent Disk Cache", variable=self.disk_cache_var)
+
+        self.live_updates_var = tk.BooleanVar(value=False)
+        if fs_watcher.is_supported():
+            self.options_menu.add_checkbutton(label="Live Updates (inotify)",
+                                              variable=self.live_updates_var,
+                                              command=self.toggle_live_updates)
+
+        self.links_once_var = tk.BooleanVar(value=False)
+        self.options_menu.add_checkbutton(label="Count Hard Links Once", variable=self.links_once_var,
+                                          command=self.on_scan_option_change)
+        self.one_fs_var = tk.BooleanVar(value=False)
+        self.options_menu.add_checkbutton(label="Stay on One Filesystem", variable=self.one_fs_var,
+                                          command=self.on_scan_option_change)
+        self.prefetch_var = tk.BooleanVar(value=True)
+        self.options_menu.add_checkbutton(label="Prefetch Subfolders When Idle",
+                                          variable=self.prefetch_var, command=self.cancel_prefetch)
+
+        self.budget_var = tk.IntVar(value=DEFAULT_BUDGET // (1024 * 1024))
+        budget_menu = tk.Menu(self.options_menu, tearoff=0)
+        for megabytes in (128, 256, 512, 1024, 2048, 4096):
+            label = f"{megabytes // 1024} GB" if megabytes >= 1024 else f"{megabytes} MB"
+            budget_menu.add_radiobutton(label=label, variable=self.budget_var, value=megabytes,
+                                        command=self.on_budget_change)
+        self.options_menu.add_cascade(label="Cache Memory Budget", menu=budget_menu)
+
+        self.profile_var = tk.BooleanVar(value=False)
+        self.options_menu.add_checkbutton(label="Profile Scans (cProfile)", variable=self.profile_var)
+
+        self.options_menu.add_separator()
+        self.options_menu.add_command(label="Full Rescan", command=self.full_rescan)
+
+        self.tools_menu = tk.Menu(self.menubar, tearoff=0)
+        self.menubar.add_cascade(label="Tools", menu=self.tools_menu)
+        self.tools_menu.add_command(label="Largest Files...", command=self.show_largest_files)
+        self.tools_menu.add_command(label="Find Duplicates...", command=self.find_duplicates)
+        self.tools_menu.add_separator()
+        self.tools_menu.add_command(label="Save Snapshot...", command=self.save_snapshot)
+        self.tools_menu.add_command(label="Compare Snapshots...", command=self.compare_snapshots)
+        self.tools_menu.add_separator()
+        self.tools_menu.add_command(label="Export Scan...", command=self.export_scan)
+        self.tools_menu.add_command(label="Scan Diagnostics...", command=self.show_diagnostics)
+
         # Top frame for controls
         control_frame = ttk.Frame(self.root, padding="5")
         control_frame.pack(fill=tk.X)
@@ -118,7 +338,7 @@ class FolderSizeViewer:
         hsb = ttk.Scrollbar(tree_frame, orient="horizontal")
 
         # Treeview
-        self.tree = ttk.Treeview(tree_frame, columns=("Size", "Type", "Files", "Folders"),
+        self.tree = ttk.Treeview(tree_frame, columns=("Size", "On Disk", "Type", "Files", "Folders"),
                                  yscrollcommand=vsb.set, xscrollcommand=hsb.set)
 
         vsb.config(command=self.tree.yview)
@@ -127,12 +347,14 @@ class FolderSizeViewer:
         # Configure columns
         self.tree.heading("#0", text="Name", command=lambda: self.sort_tree("name"))
         self.tree.heading("Size", text="Size", command=lambda: self.sort_tree("size"))
+        self.tree.heading("On Disk", text="On Disk", command=lambda: self.sort_tree("alloc"))
         self.tree.heading("Type", text="Type")
         self.tree.heading("Files", text="Files", command=lambda: self.sort_tree("files"))
         self.tree.heading("Folders", text="Folders", command=lambda: self.sort_tree("folders"))
 
         self.tree.column("#0", width=350)
         self.tree.column("Size", width=120)
+        self.tree.column("On Disk", width=120)
         self.tree.column("Type", width=80)
         self.tree.column("Files", width=80)
         self.tree.column("Folders", width=80)
@@ -159,16 +381,27 @@ class FolderSizeViewer:
         self.context_menu.add_separator()
         self.context_menu.add_command(label="Properties", command=self.show_properties_dialog)
 
-        # Right panel - Metadata details
-        self.details_frame = ttk.LabelFrame(self.main_pane, text="Details", padding="10")
-        self.main_pane.add(self.details_frame, weight=1)
+        # Right panel - Metadata details above the file type breakdown
+        self.side_pane = ttk.PanedWindow(self.main_pane, orient=tk.VERTICAL)
+        self.main_pane.add(self.side_pane, weight=1)
+
+        self.details_frame = ttk.LabelFrame(self.side_pane, text="Details", padding="10")
+        self.side_pane.add(self.details_frame, weight=2)
 
         self.setup_details_panel()
 
+        self.types_frame = ttk.LabelFrame(self.side_pane, text="File Types", padding="5")
+        self.side_pane.add(self.types_frame, weight=1)
+
+        self.setup_types_panel()
+
         # Status bar
         self.status_frame = ttk.Frame(self.root)
         self.status_frame.pack(fill=tk.X, side=tk.BOTTOM)
 
+        self.cache_label = ttk.Label(self.status_frame, text="", relief=tk.SUNKEN)
+        self.cache_label.pack(side=tk.RIGHT, padx=2, pady=2)
+
         self.status_label = ttk.Label(self.status_frame, text="Ready", relief=tk.SUNKEN)
         self.status_label.pack(fill=tk.X, padx=2, pady=2)
 
@@ -195,6 +428,7 @@ class FolderSizeViewer:
             ("type", "Type:"),
             ("size", "Size:"),
             ("size_bytes", "Size (bytes):"),
+            ("alloc", "On disk:"),
             ("files", "Files:"),
             ("folders", "Folders:"),
             ("path", "Path:"),
@@ -218,109 +452,203 @@ class FolderSizeViewer:
         # Initially hide all detail rows
         self.clear_details()
 
+    def setup_types_panel(self):
+        """Setup the per-type size breakdown of the current folder"""
+        mode_frame = ttk.Frame(self.types_frame)
+        mode_frame.pack(fill=tk.X)
+        self.types_mode_var = tk.StringVar(value="extension")
+        ttk.Radiobutton(mode_frame, text="Extension", variable=self.types_mode_var, value="extension",
+                        command=self.show_type_breakdown).pack(side=tk.LEFT)
+        ttk.Radiobutton(mode_frame, text="Kind", variable=self.types_mode_var, value="family",
+                        command=self.show_type_breakdown).pack(side=tk.LEFT, padx=(10, 0))
+
+        types_tree_frame = ttk.Frame(self.types_frame)
+        types_tree_frame.pack(fill=tk.BOTH, expand=True, pady=(5, 0))
+        self.types_tree = ttk.Treeview(types_tree_frame, columns=("Size", "Files", "Share"), height=8)
+        self.types_tree.heading("#0", text="Type")
+        self.types_tree.heading("Size", text="Size")
+        self.types_tree.heading("Files", text="Files")
+        self.types_tree.heading("Share", text="Share")
+        self.types_tree.column("#0", width=110)
+        self.types_tree.column("Size", width=80)
+        self.types_tree.column("Files", width=70)
+        self.types_tree.column("Share", width=50)
+        types_vsb = ttk.Scrollbar(types_tree_frame, orient="vertical", command=self.types_tree.yview)
+        self.types_tree.configure(yscrollcommand=types_vsb.set)
+        self.types_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        types_vsb.pack(side=tk.RIGHT, fill=tk.Y)
+
+    def show_type_breakdown(self):
+        """Fill the file type panel from the size tree's per-directory type totals"""
+        self.types_tree.delete(*self.types_tree.get_children())
+        node = self.size_trees.find(self.current_path)
+        if node is None:
+            return
+
+        # Merged once per listing; changes to it carry the totals forward
+        cached_data = self.directory_cache.peek(self.current_path)
+        totals = cached_data.get('types') if cached_data is not None else None
+        if totals is None:
+            totals = node.type_totals()
+            if cached_data is not None:
+                cached_data['types'] = totals
+
+        rows = type_breakdown(totals, by_family=self.types_mode_var.get() == "family")
+        total_size = node.size or 1
+        for label, size, count in rows[:TYPE_ROWS]:
+            self.types_tree.insert("", "end", text=label,
+                                   values=(self.format_size(size), f"{count:,}",
+                                           f"{size * 100 / total_size:.1f}%"))
+
     def clear_details(self):
         """Clear the details panel"""
+        self.details_path = None
         self.detail_icon_label.config(text="")
         self.detail_name_label.config(text="Select an item to view details")
         for key, label in self.detail_labels.items():
             label.config(text="-")
 
     def update_details(self, item_name, item_path):
-        """Update the details panel with metadata for the selected item"""
-        try:
-            # Get basic info from folder_data
-            if item_name in self.folder_data:
-                data = self.folder_data[item_name]
-                is_folder = data['type'] == 'Folder'
+        """Fill the details panel from the listing; no filesystem access
 
-                # Update icon and name
-                self.detail_icon_label.config(text="📁" if is_folder else "📄")
-                self.detail_name_label.config(text=item_name)
+        Sizes, counts and the modification time come from the scan. The
+        rest is left to lookup_details on a background thread.
+        """
+        data = self.folder_data.get(item_name)
+        if data is None:
+            self.clear_details()
+            return
+        self.details_path = item_path
+        is_folder = data.type == 'Folder'
 
-                # Type
-                self.detail_labels['type'].config(text=data['type'])
+        # Update icon and name
+        self.detail_icon_label.config(text=ROW_ICONS.get(data.type, "📄"))
+        self.detail_name_label.config(text=item_name)
 
-                # Size
-                self.detail_labels['size'].config(text=self.format_size(data['size']))
-                self.detail_labels['size_bytes'].config(text=f"{data['size']:,} bytes")
+        # Type
+        self.detail_labels['type'].config(text=data.type)
 
-                # Files and folders (for directories)
-                if is_folder:
-                    self.detail_labels['files'].config(text=f"{data['files']:,}")
-                    self.detail_labels['folders'].config(text=f"{data['folders']:,}")
-                else:
-                    self.detail_labels['files'].config(text="-")
-                    self.detail_labels['folders'].config(text="-")
+        # Size
+        if data.type == 'Mount':
+            # Mount points are listed but not scanned
+            for key in ('size', 'size_bytes', 'alloc'):
+                self.detail_labels[key].config(text="Not scanned (other filesystem)")
+        else:
+            self.detail_labels['size'].config(text=self.format_size(data.size))
+            self.detail_labels['size_bytes'].config(text=f"{data.size:,} bytes")
+            self.detail_labels['alloc'].config(
+                text=f"{self.format_size(data.alloc)} ({data.alloc:,} bytes)")
+
+        # Files and folders (for directories)
+        if is_folder:
+            self.detail_labels['files'].config(text=f"{data.files:,}")
+            self.detail_labels['folders'].config(text=f"{data.folders:,}")
+        else:
+            self.detail_labels['files'].config(text="-")
+            self.detail_labels['folders'].config(text="-")
 
-                # Path
-                self.detail_labels['path'].config(text=item_path)
+        # Path
+        self.detail_labels['path'].config(text=item_path)
 
-            # Get filesystem metadata
-            if os.path.exists(item_path):
-                stat_info = os.stat(item_path)
+        # Modified time as the scan saw it
+        self.detail_labels['modified'].config(
+            text=self.format_timestamp(data.mtime) if data.mtime else "-")
 
-                # Dates
-                created = datetime.fromtimestamp(stat_info.st_ctime)
-                modified = datetime.fromtimestamp(stat_info.st_mtime)
-                accessed = datetime.fromtimestamp(stat_info.st_atime)
+        # Extension (for files)
+        if data.type == 'File':
+            ext = os.path.splitext(item_name)[1]
+            self.detail_labels['extension'].config(text=ext if ext else "(none)")
+        else:
+            self.detail_labels['extension'].config(text="-")
 
-                self.detail_labels['created'].config(text=created.strftime("%Y-%m-%d %H:%M:%S"))
-                self.detail_labels['modified'].config(text=modified.strftime("%Y-%m-%d %H:%M:%S"))
-                self.detail_labels['accessed'].config(text=accessed.strftime("%Y-%m-%d %H:%M:%S"))
+        for key in LOOKUP_FIELDS:
+            self.detail_labels[key].config(text="...")
 
-                # Extension (for files)
-                if os.path.isfile(item_path):
-                    ext = os.path.splitext(item_name)[1]
-                    self.detail_labels['extension'].config(text=ext if ext else "(none)")
-                else:
-                    self.detail_labels['extension'].config(text="-")
-
-                # Attributes (Windows-specific)
-                attributes = []
-                try:
-                    if os.name == 'nt':
-                        import ctypes
-                        attrs = ctypes.windll.kernel32.GetFileAttributesW(item_path)
-                        if attrs != -1:
-                            if attrs & 0x1: attributes.append("Read-only")
-                            if attrs & 0x2: attributes.append("Hidden")
-                            if attrs & 0x4: attributes.append("System")
-                            if attrs & 0x10: attributes.append("Directory")
-                            if attrs & 0x20: attributes.append("Archive")
-                            if attrs & 0x80: attributes.append("Normal")
-                            if attrs & 0x400: attributes.append("Reparse Point")
-                            if attrs & 0x800: attributes.append("Compressed")
-                            if attrs & 0x4000: attributes.append("Encrypted")
-                except Exception:
-                    pass
-
-                self.detail_labels['attributes'].config(
-                    text=", ".join(attributes) if attributes else "-"
-                )
-
-                # Permissions (simplified)
-                perms = []
-                if os.access(item_path, os.R_OK): perms.append("Read")
-                if os.access(item_path, os.W_OK): perms.append("Write")
-                if os.access(item_path, os.X_OK): perms.append("Execute")
-
-                self.detail_labels['permissions'].config(
-                    text=", ".join(perms) if perms else "-"
-                )
+    def format_timestamp(self, timestamp):
+        return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
 
-        except Exception as e:
-            self.detail_name_label.config(text=f"Error: {str(e)}")
+    def lookup_details(self, generation, item_path):
+        """Read what the scan does not keep about one item; runs on its own thread"""
+        try:
+            stat_info = os.stat(item_path)
+        except OSError as e:
+            self.update_queue.put(('item_details', generation, item_path, None, str(e)))
+            return
+
+        # Attributes (Windows-specific)
+        attributes = []
+        try:
+            if os.name == 'nt':
+                import ctypes
+                attrs = ctypes.windll.kernel32.GetFileAttributesW(item_path)
+                if attrs != -1:
+                    if attrs & 0x1: attributes.append("Read-only")
+                    if attrs & 0x2: attributes.append("Hidden")
+                    if attrs & 0x4: attributes.append("System")
+                    if attrs & 0x10: attributes.append("Directory")
+                    if attrs & 0x20: attributes.append("Archive")
+                    if attrs & 0x80: attributes.append("Normal")
+                    if attrs & 0x400: attributes.append("Reparse Point")
+                    if attrs & 0x800: attributes.append("Compressed")
+                    if attrs & 0x4000: attributes.append("Encrypted")
+        except Exception:
+            pass
+
+        # Permissions (simplified)
+        perms = []
+        if os.access(item_path, os.R_OK): perms.append("Read")
+        if os.access(item_path, os.W_OK): perms.append("Write")
+        if os.access(item_path, os.X_OK): perms.append("Execute")
+
+        self.update_queue.put(('item_details', generation, item_path, {
+            'created': self.format_timestamp(stat_info.st_ctime),
+            'modified': self.format_timestamp(stat_info.st_mtime),
+            'accessed': self.format_timestamp(stat_info.st_atime),
+            'attributes': ", ".join(attributes) if attributes else "-",
+            'permissions': ", ".join(perms) if perms else "-",
+        }, None))
+
+    def show_item_details(self, generation, item_path, fields, error):
+        """Fill in a finished lookup if its item is still the one shown"""
+        if generation != self.details_generation or item_path != self.details_path:
+            return
+        if fields is None:
+            for key in LOOKUP_FIELDS:
+                self.detail_labels[key].config(text="-")
+            self.detail_name_label.config(text=f"Error: {error}")
+            return
+        for key, text in fields.items():
+            self.detail_labels[key].config(text=text)
+
+    def start_details_lookup(self, generation, item_path):
+        self.details_after = None
+        if generation == self.details_generation:
+            threading.Thread(target=self.lookup_details, args=(generation, item_path),
+                             daemon=True).start()
 
     def on_item_select(self, event):
-        """Handle item selection to update details panel"""
+        """Handle item selection to update details panel
+
+        The panel is filled from the listing at once. The filesystem is
+        only asked for the rest once the selection has settled for
+        DETAILS_DELAY, so holding an arrow key does not queue a lookup per
+        row, and never on this thread, so a slow or hung share cannot
+        freeze the window.
+        """
+        if self.details_after is not None:
+            self.root.after_cancel(self.details_after)
+            self.details_after = None
+        self.details_generation += 1
+
         selection = self.tree.selection()
-        if selection:
-            item = self.tree.item(selection[0])
-            item_text = item['text']
-            item_name = item_text.replace("📁 ", "").replace("📄 ", "")
+        if selection and selection[0] in self.item_names:
+            item_name = self.item_names[selection[0]]
             item_path = os.path.join(self.current_path, item_name)
 
             self.update_details(item_name, item_path)
+            if self.details_path is not None:
+                self.details_after = self.root.after(
+                    DETAILS_DELAY, self.start_details_lookup, self.details_generation, item_path)
         else:
             self.clear_details()
 
@@ -344,110 +672,164 @@ class FolderSizeViewer:
 
     def format_size(self, size_bytes):
         """Format bytes to human readable size"""
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size_bytes < 1024.0:
-                return f"{size_bytes:.2f} {unit}"
-            size_bytes /= 1024.0
-        return f"{size_bytes:.2f} PB"
-
-    def get_folder_size(self, folder_path):
-        """Calculate folder size with file and folder counts - optimized with frequent stop checks"""
-        total_size = 0
-        file_count = 0
-        folder_count = 0
-        check_interval = 100  # Check stop flag every N files
-        files_checked = 0
-
-        try:
-            for dirpath, dirnames, filenames in os.walk(folder_path):
-                # Check if scan should stop at directory level
-                if self.stop_scan:
-                    return total_size, file_count, folder_count
-
-                folder_count += len(dirnames)
-
-                for filename in filenames:
-                    files_checked += 1
-
-                    # Frequent stop checks for large directories
-                    if files_checked % check_interval == 0:
-                        if self.stop_scan:
-                            return total_size, file_count, folder_count
-
-                    file_count += 1
-                    filepath = os.path.join(dirpath, filename)
-                    try:
-                        total_size += os.path.getsize(filepath)
-                    except (OSError, PermissionError):
-                        pass
-
-        except (OSError, PermissionError):
-            pass
-
-        return total_size, file_count, folder_count
+        return folder_scanner.format_size(size_bytes)
 
     def load_from_cache(self, path):
         """Load directory data from cache if available"""
-        if path in self.directory_cache:
-            # Clear tree
-            for item in self.tree.get_children():
-                self.tree.delete(item)
-
-            # Load cached data
+        cached_data = self.directory_cache.get(path)
+        if cached_data is None:
+            # Any directory inside an earlier scan is already sized
+            node = self.size_trees.lookup(path)
+            if node is None:
+                return False
+            self.folder_data = node.folder_data()
+            self.save_to_cache(path, self.size_trees.scan_time(path))
             cached_data = self.directory_cache[path]
-            self.folder_data = cached_data['folder_data'].copy()
-
-            # Populate tree from cache
-            for name, data in self.folder_data.items():
-                if data['type'] == 'Folder':
-                    self.tree.insert("", "end", text=f"📁 {name}",
-                                   values=(self.format_size(data['size']), data['type'],
-                                          data['files'], data['folders']))
-                else:
-                    self.tree.insert("", "end", text=f"📄 {name}",
-                                   values=(self.format_size(data['size']), data['type'], "", ""))
-
-            # Update status
-            total_size = cached_data['total_size']
-            total_files = cached_data['total_files']
-            total_folders = cached_data['total_folders']
-            cache_time = time.strftime('%H:%M:%S', time.localtime(self.cache_timestamps[path]))
-
-            self.status_label.config(text=f"Total: {self.format_size(total_size)} | "
-                                        f"{total_files:,} files | {total_folders:,} folders | "
-                                        f"Cached at {cache_time}")
-            return True
-        return False
-
-    def save_to_cache(self, path):
-        """Save current directory data to cache"""
-        total_size = sum(data['size'] for data in self.folder_data.values())
-        total_files = sum(data['files'] for data in self.folder_data.values())
-        total_folders = sum(data['folders'] for data in self.folder_data.values())
-
-        self.directory_cache[path] = {
-            'folder_data': self.folder_data.copy(),
-            'total_size': total_size,
-            'total_files': total_files,
-            'total_folders': total_folders
+
+        # Load cached data (shared with the cache, not copied)
+        self.folder_data = cached_data['folder_data']
+        self.show_listing(self.folder_data)
+        self.show_type_breakdown()
+
+        # Update status
+        cache_time = time.strftime('%H:%M:%S', time.localtime(self.cache_timestamps[path]))
+        self.status_label.config(text=self.totals_text(path) + f" | Cached at {cache_time}")
+        return True
+
+    def save_to_cache(self, path, timestamp=None, listing=None, types=None):
+        """Save current directory data (or another listing for path) to cache
+
+        types carries the path's type totals forward, if they are known.
+        """
+        if listing is None:
+            listing = self.folder_data
+        cached_data = {
+            'folder_data': listing,
+            'total_size': listing.total_size,
+            'total_alloc': listing.total_alloc,
+            'total_files': listing.total_files,
+            'total_folders': listing.total_folders
         }
-        self.cache_timestamps[path] = time.time()
+        if types is not None:
+            cached_data['types'] = types
+        self.directory_cache[path] = cached_data
+        self.cache_timestamps[path] = timestamp if timestamp is not None else time.time()
+
+    def carry_types(self, cached_data, delta, sign=1):
+        """cached_data's type totals moved by delta, or None when they must be merged again"""
+        types = cached_data.get('types') if cached_data is not None else None
+        if types is None or delta is None:
+            return None
+        add_type_totals(types, delta, sign)
+        return types
+
+    def on_listing_evicted(self, path, cached_data):
+        self.cache_timestamps.pop(path, None)
+
+    def on_tree_evicted(self, path, node):
+        if self.watcher is not None:
+            self.watcher.unwatch_tree(path)
+
+    def on_budget_change(self):
+        """Apply a new cache memory budget, evicting at once if it shrank"""
+        self.cache_budget = self.budget_var.get() * 1024 * 1024
+        self.directory_cache.set_budget(max_bytes=self.cache_budget // 4)
+        self.size_trees.roots.set_budget(max_bytes=self.cache_budget - self.cache_budget // 4)
+        self.update_cache_stats()
+
+    def update_cache_stats(self):
+        """Show cache occupancy and hit/miss/eviction counters in the status bar"""
+        listings = self.directory_cache
+        trees = self.size_trees
+        # A listing miss served from a size tree still needed no I/O
+        hits = listings.hits + trees.hits
+        misses = trees.misses
+        stats = (len(listings), len(trees.roots), listings.total_bytes + trees.roots.total_bytes,
+                 self.cache_budget, hits, misses, listings.evictions + trees.roots.evictions)
+        if stats == self.last_cache_stats:
+            return
+        self.last_cache_stats = stats
+        count, tree_count, used, budget, hits, misses, evictions = stats
+        self.cache_label.config(
+            text=f"Cache: {count} listings, {tree_count} trees, ~{format_bytes(used)} of "
+                 f"{format_bytes(budget)} | {hits:,} hits, {misses:,} misses, "
+                 f"{evictions:,} evicted")
+
+    def save_tree(self, tree, scanned_at=None):
+        """Keep a finished scan's size tree for instant navigation into its subfolders"""
+        self.size_trees.add(tree, scanned_at)
+        self.forget_listings(tree.path)
+        if self.watcher is not None:
+            self.watcher.watch_tree(tree)
+
+    def forget_listings(self, path):
+        """Drop cached listings that may show stale totals after path's subtree changed
+
+        Ancestors and descendants of path are rebuilt from the size tree on
+        their next visit; path's own listing is left to the caller.
+        """
+        path = os.path.normpath(path)
+        child, parent = path, os.path.dirname(path)
+        while parent != child:
+            self.directory_cache.pop(parent, None)
+            child, parent = parent, os.path.dirname(parent)
+
+        prefix = os.path.join(path, '')
+        for cached_path in [p for p in self.directory_cache if p.startswith(prefix)]:
+            del self.directory_cache[cached_path]
 
     def process_queue(self):
         """Process UI update queue - runs on main thread"""
+        tick_start = time.perf_counter()
+        collecting = self.collecting
+        if collecting is not None:
+            # How late this tick is, and how much work was waiting for it
+            if self.last_tick is not None:
+                latency = max(tick_start - self.last_tick - QUEUE_INTERVAL / 1000, 0)
+                collecting['ticks'] += 1
+                collecting['tick_latency'] += latency
+                collecting['max_tick_latency'] = max(collecting['max_tick_latency'], latency)
+            collecting['peak_queue_depth'] = max(collecting['peak_queue_depth'],
+                                                 self.update_queue.qsize())
         try:
             while True:
                 task = self.update_queue.get_nowait()
                 task_type = task[0]
 
-                if task_type == 'add_item':
-                    _, name, size, item_type, files, folders = task
-                    self.add_tree_item(name, size, item_type, files, folders)
+                if task_type == 'job':
+                    if task[1] != self.job_generation:
+                        # Left over from a cancelled or replaced job
+                        continue
+                    task = task[2]
+                    task_type = task[0]
+
+                if task_type == 'add_items':
+                    self.pending_rows.extend(task[1])
+
+                elif task_type == 'show_listing':
+                    self.folder_data = task[1]
+                    self.show_listing(task[1])
 
                 elif task_type == 'update_progress':
                     _, current, total, item_name = task
                     self.update_progress(current, total, item_name)
 
+                elif task_type == 'scan_progress':
+                    _, entries, size, estimate = task
+                    self.update_walk_progress(entries, size, estimate)
+
+                elif task_type == 'scan_stats':
+                    if self.diagnostics is not None:
+                        self.diagnostics['scan'] = task[1]
+
+                elif task_type == 'scan_profile':
+                    _, path, top = task
+                    if self.diagnostics is not None:
+                        self.diagnostics['profile'] = {'file': path, 'top': top}
+
+                elif task_type == 'scan_result':
+                    self.store_scan_result(*task[1:])
+
                 elif task_type == 'scan_complete':
                     _, cancelled = task
                     self.scan_complete(cancelled)
@@ -456,15 +838,44 @@ class FolderSizeViewer:
                     _, text = task
                     self.status_label.config(text=text)
 
+                elif task_type == 'watch_changes':
+                    _, ops = task
+                    self.change_trees(('watch', ops))
+
+                elif task_type == 'trees_released':
+                    self.release_trees()
+
+                elif task_type == 'item_details':
+                    _, generation, path, fields, error = task
+                    self.show_item_details(generation, path, fields, error)
+
+                elif task_type == 'prefetched':
+                    _, generation, path, listing, tree, scanned_at = task
+                    self.store_prefetched(generation, path, listing, tree, scanned_at)
+
+                elif task_type == 'snapshot_diff':
+                    _, view, summary, diff = task
+                    self.show_snapshot_diff(view, summary, diff)
+
+                elif task_type == 'duplicates_found':
+                    _, path, groups = task
+                    self.show_duplicates(path, groups)
+
         except queue.Empty:
             pass
 
+        self.insert_pending_rows()
+        self.update_cache_stats()
+        if collecting is not None:
+            collecting['drain'] += time.perf_counter() - tick_start
+
         # Schedule next queue check
-        self.root.after(50, self.process_queue)
+        self.last_tick = time.perf_counter()
+        self.root.after(QUEUE_INTERVAL, self.process_queue)
 
     def update_progress(self, current, total, item_name=""):
         """Update progress indicators"""
-        if total > 0:
+        if total > 0 and self.walk_estimate is None:
             percent = int((current / total) * 100)
             self.progress_bar['value'] = percent
             self.progress_percent.config(text=f"{percent}%")
@@ -475,129 +886,272 @@ class FolderSizeViewer:
             self.progress_label.config(text=f"Scanning: {display_name}")
 
         # Update elapsed time
-        if self.scan_start_time:
+        if self.scan_start_time and not self.walk_reported:
             elapsed = time.time() - self.scan_start_time
             mins, secs = divmod(int(elapsed), 60)
             self.time_label.config(text=f"Elapsed: {mins:02d}:{secs:02d}")
 
-    def scan_folder_thread(self):
-        """Scan folder in a separate thread - optimized for large folders"""
-        self.scan_start_time = time.time()
-
-        try:
-            # Get all items in current directory first (quick operation)
-            items = []
+    def update_walk_progress(self, entries, size, estimate):
+        """Show entries and bytes walked with their rate, and an ETA if an earlier scan is known
 
+        The fraction done averages the entry and byte fractions of the
+        earlier scan's totals; it is held below 100% until the scan
+        finishes, since the tree may have grown since.
+        """
+        if not self.scan_start_time:
+            return
+        self.walk_reported = True
+        elapsed = max(time.time() - self.scan_start_time, 0.001)
+        mins, secs = divmod(int(elapsed), 60)
+        text = (f"Elapsed: {mins:02d}:{secs:02d} | {entries:,} items "
+                f"({self.format_size(size)}) at {entries / elapsed:,.0f}/s")
+
+        if estimate is not None and estimate.entries > 0:
+            self.walk_estimate = estimate
+            done = entries / estimate.entries
+            if estimate.size > 0:
+                done = (done + size / estimate.size) / 2
+            done = min(done, 0.99)
+            self.progress_bar['value'] = int(done * 100)
+            self.progress_percent.config(text=f"{int(done * 100)}%")
+            if done > 0:
+                mins, secs = divmod(int(elapsed * (1 - done) / done), 60)
+                text += f" | ETA {mins:02d}:{secs:02d}"
+        self.time_label.config(text=text)
+
+    def get_scan_store(self):
+        """Open the persistent cache on first use; None if it is unavailable"""
+        if self.scan_store is None:
             try:
-                dir_contents = os.listdir(self.current_path)
-            except (OSError, PermissionError) as e:
-                self.update_queue.put(('update_status', f"Error: Cannot access directory - {str(e)}"))
-                self.update_queue.put(('scan_complete', False))
-                return
+                self.scan_store = ScanStore()
+            except (OSError, sqlite3.Error) as e:
+                self.update_queue.put(('update_status', f"Disk cache unavailable: {str(e)}"))
+                self.disk_cache_enabled = False
+                return None
+        return self.scan_store
+
+    def load_from_disk_cache(self, context):
+        """Serve a scan from the persistent cache if every stored directory is still unchanged"""
+        path = context.path
+        store = self.get_scan_store()
+        if store is None:
+            return False
 
-            # Quick first pass - separate files and folders
-            for item_name in dir_contents:
-                if self.stop_scan:
-                    self.update_queue.put(('scan_complete', True))
-                    return
-
-                item_path = os.path.join(self.current_path, item_name)
-
-                try:
-                    if os.path.isdir(item_path):
-                        items.append((item_name, item_path, "folder"))
-                    else:
-                        try:
-                            size = os.path.getsize(item_path)
-                        except (OSError, PermissionError):
-                            size = 0
-                        items.append((item_name, item_path, "file", size))
-                except (OSError, PermissionError):
-                    pass
-
-            total_items = len(items)
-            self.total_items = total_items
-
-            # Process files first (quick) then folders (slow)
-            # This gives the user something to see quickly
-            file_items = [i for i in items if len(i) == 4]
-            folder_items = [i for i in items if len(i) == 3]
-
-            processed = 0
-
-            # Process files first (instant)
-            for item_data in file_items:
-                if self.stop_scan:
-                    self.update_queue.put(('scan_complete', True))
-                    return
-
-                name, path, item_type, size = item_data
-
-                self.folder_data[name] = {
-                    'size': size,
-                    'files': 1,  # Count the file itself
-                    'folders': 0,
-                    'type': 'File'
-                }
-
-                self.update_queue.put(('add_item', name, size, "File", 0, 0))
-                processed += 1
-
-                # Update progress every 10 files for performance
-                if processed % 10 == 0:
-                    self.update_queue.put(('update_progress', processed, total_items, name))
-
-            # Now process folders (slower due to recursive size calculation)
-            for item_data in folder_items:
-                if self.stop_scan:
-                    self.update_queue.put(('scan_complete', True))
-                    return
-
-                name, path, item_type = item_data
+        try:
+            # Validation happens in the incremental refresh below
+            loaded = store.load_tree(path, validate=False)
+        except sqlite3.Error:
+            return False
+        if loaded is None:
+            return False
+        root, scanned_at, _ = loaded
+
+        # Re-list only the directories that changed since the stored scan
+        scanner = FolderScanner(path, should_stop=context.should_stop,
+                                one_filesystem=context.one_filesystem)
+        for event in scanner.iter_refresh(root, scanned_at):
+            context.post(event)
+        if scanner.stopped:
+            context.post(('scan_complete', True))
+            return True
 
-                self.update_queue.put(('update_progress', processed, total_items, name))
+        # The tree is still this thread's own, so it is written before it is handed over
+        if scanner.refresh_stats['relisted'] or scanner.refresh_stats['resized']:
+            self.persist_tree(root)
+        self.show_tree_listing(context, root)
+
+        cache_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(scanned_at))
+        context.post(('scan_result', path, context.folder_data, root, scanned_at,
+                      f" | From disk cache (scanned {cache_time})", True))
+        self.report_scan_stats(context, scanner)
+        context.post(('scan_complete', False))
+        return True
+
+    def show_tree_listing(self, context, node):
+        """Show a size tree node's listing as the scanned path's listing (scan thread)"""
+        context.folder_data = node.folder_data()
+        context.post(('show_listing', context.folder_data))
+
+    def store_scan_result(self, path, listing, tree, scanned_at, note, persisted):
+        """Take over a finished job's listing and size tree (UI thread)
+
+        The scan thread no longer touches either, so this is where they
+        join directory_cache and size_trees.
+        """
+        self.save_to_cache(path, scanned_at, listing)
+        self.change_trees(('tree', tree, scanned_at, persisted))
+        self.status_label.config(text=self.totals_text(path) + note)
+
+    def totals_text(self, path):
+        """Status bar totals for a cached listing"""
+        cached_data = self.directory_cache[path]
+        return (f"Total: {self.format_size(cached_data['total_size'])} "
+                f"({self.format_size(cached_data['total_alloc'])} on disk) | "
+                f"{cached_data['total_files']:,} files | "
+                f"{cached_data['total_folders']:,} folders")
+
+    def incremental_refresh(self, context, node):
+        """Bring the size tree for the scanned path up to date without a full rescan (scan thread)
+
+        The refresh works on a copy of node's subtree, so the stored tree
+        never holds a half-refreshed state; the finished copy replaces
+        node on the UI thread, and a stopped or failed refresh is simply
+        dropped.
+        """
+        path = context.path
+        scanned_at = self.size_trees.scan_time(path) or self.cache_timestamps.get(path, 0)
+        scanner = FolderScanner(path, should_stop=context.should_stop,
+                                one_filesystem=context.one_filesystem)
+
+        tree = node.copy(os.path.normpath(path))
+        for event in scanner.iter_refresh(tree, scanned_at):
+            context.post(event)
+        self.report_scan_stats(context, scanner)
+        if scanner.stopped:
+            context.post(('scan_complete', True))
+            return
 
-                # Calculate folder size
-                size, files, folders = self.get_folder_size(path)
+        if context.persist:
+            self.persist_tree(tree)
+        self.show_tree_listing(context, tree)
+
+        stats = scanner.refresh_stats
+        elapsed = time.time() - context.start_time
+        mins, secs = divmod(int(elapsed), 60)
+        # Everything changed before the refresh started has now been seen
+        context.post(('scan_result', path, context.folder_data, tree, context.start_time,
+                      f" | Refreshed in {mins:02d}:{secs:02d} "
+                      f"({stats['checked']:,} folders checked, {stats['relisted']:,} changed)",
+                      context.persist))
+        context.post(('scan_complete', False))
+
+    def persist_tree(self, tree):
+        """Write a finished scan to the persistent cache"""
+        store = self.get_scan_store()
+        if store is None:
+            return
+        try:
+            store.save_tree(tree)
+        except (sqlite3.Error, UnicodeError) as e:
+            self.update_queue.put(('update_status', f"Could not write disk cache: {str(e)}"))
+
+    def persist_totals(self, rows):
+        """Write new ancestor totals to the persistent cache in the background"""
+        store = self.scan_store
+        if store is None:
+            return
 
-                if self.stop_scan:
-                    self.update_queue.put(('scan_complete', True))
+        def write():
+            try:
+                store.update_totals(rows)
+            except sqlite3.Error as e:
+                self.update_queue.put(('update_status', f"Could not write disk cache: {str(e)}"))
+
+        threading.Thread(target=write, daemon=True).start()
+
+    def scan_estimate(self, path, use_store):
+        """Totals of an earlier scan of path, in memory or in the disk cache, or None (scan thread)"""
+        node = self.size_trees.find(path)
+        if node is not None:
+            return ScanEstimate(node.files + node.folders, node.size)
+        store = self.get_scan_store() if use_store else self.scan_store
+        if store is None:
+            return None
+        try:
+            return store.estimate(path)
+        except sqlite3.Error:
+            return None
+
+    def report_scan_stats(self, context, scanner):
+        """Send a scanner's instrumentation to the diagnostics (scan thread)"""
+        stats = scanner.scan_stats()
+        if scanner.refresh_stats is not None:
+            stats['refresh'] = dict(scanner.refresh_stats)
+        context.post(('scan_stats', stats))
+
+    def profile_scan_thread(self, context):
+        """scan_folder_thread under cProfile, saving the stats next to the disk cache
+
+        Only this thread is profiled; with one scan worker that includes
+        the whole walk.
+        """
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            self.scan_folder_thread(context)
+        finally:
+            profiler.disable()
+            directory = os.path.join(default_cache_dir(), 'profiles')
+            path = os.path.join(directory, time.strftime('scan-%Y%m%d-%H%M%S.prof'))
+            try:
+                os.makedirs(directory, exist_ok=True)
+                profiler.dump_stats(path)
+            except OSError as e:
+                context.post(('update_status', f"Could not save profile: {str(e)}"))
+                path = None
+            # Heaviest functions by cumulative time, for the diagnostics view
+            entries = sorted(pstats.Stats(profiler).stats.items(), key=lambda item: -item[1][3])
+            top = [{'function': f"{os.path.basename(file)}:{line}({function})", 'calls': calls,
+                    'own': round(own, 4), 'cumulative': round(cumulative, 4)}
+                   for (file, line, function), (_, calls, own, cumulative, _)
+                   in entries[:PROFILE_ROWS]]
+            context.post(('scan_profile', path, top))
+
+    def scan_folder_thread(self, context):
+        """Scan folder in a separate thread - the engine does the work, we relay to the UI
+
+        Everything goes through context: its path and options, its own
+        listing buffer, its stop flag and its tagged queue messages, so a
+        scan that was replaced by a newer one cannot reach the view.
+        """
+        path = context.path
+        folder_data = context.folder_data
+
+        # Every way out of here ends the job with a scan_complete
+        try:
+            if context.incremental:
+                node = self.size_trees.find(path)
+                if node is not None:
+                    self.incremental_refresh(context, node)
                     return
 
-                self.folder_data[name] = {
-                    'size': size,
-                    'files': files,
-                    'folders': folders,
-                    'type': 'Folder'
-                }
-
-                self.update_queue.put(('add_item', name, size, "Folder", files, folders))
-                processed += 1
-
-            # Final progress update
-            self.update_queue.put(('update_progress', total_items, total_items, ""))
+            if context.use_disk_cache and self.load_from_disk_cache(context):
+                return
 
-            # Calculate totals
-            total_size = sum(data['size'] for data in self.folder_data.values())
-            total_files = sum(data['files'] for data in self.folder_data.values())
-            total_folders = sum(data['folders'] for data in self.folder_data.values())
+            scanner = FolderScanner(path, should_stop=context.should_stop,
+                                    workers=context.workers,
+                                    count_links_once=context.count_links_once,
+                                    one_filesystem=context.one_filesystem,
+                                    estimate=self.scan_estimate(path, context.persist))
+
+            for event in scanner.iter_scan():
+                if event[0] == 'add_items':
+                    for name, data in event[1]:
+                        folder_data.append(name, data)
+                context.post(event)
+
+            self.report_scan_stats(context, scanner)
+            if scanner.stopped:
+                context.post(('scan_complete', True))
+                return
 
-            # Save to cache
-            self.save_to_cache(self.current_path)
+            # The tree is still this thread's own, so it is written before
+            # it is handed over; the UI thread caches it and the listing
+            if context.persist:
+                self.persist_tree(scanner.tree)
 
-            elapsed = time.time() - self.scan_start_time
+            elapsed = time.time() - context.start_time
             mins, secs = divmod(int(elapsed), 60)
+            context.post(('scan_result', path, folder_data, scanner.tree, None,
+                          f" | Scanned in {mins:02d}:{secs:02d}", context.persist))
+            context.post(('scan_complete', False))
 
-            self.update_queue.put(('update_status',
-                f"Total: {self.format_size(total_size)} | "
-                f"{total_files:,} files | {total_folders:,} folders | "
-                f"Scanned in {mins:02d}:{secs:02d}"))
-
-            self.update_queue.put(('scan_complete', False))
-
+        except ScanError as e:
+            context.post(('update_status', f"Error: {str(e)}"))
+            context.post(('scan_complete', False))
         except Exception as e:
-            self.update_queue.put(('update_status', f"Error scanning folder: {str(e)}"))
-            self.update_queue.put(('scan_complete', False))
+            context.post(('update_status', f"Error scanning folder: {str(e)}"))
+            context.post(('scan_complete', False))
 
     def scan_complete(self, cancelled=False):
         """Called when scan is complete"""
@@ -615,48 +1169,514 @@ class FolderSizeViewer:
         self.refresh_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
         self.is_scanning = False
-        self.stop_scan = False
+        self.job = None
+        if self.collecting is not None:
+            self.diagnostics['elapsed'] = round(time.time() - self.scan_start_time, 3)
+            self.diagnostics['cancelled'] = cancelled
+            self.collecting = None
+        self.show_type_breakdown()
+        if not cancelled:
+            self.start_prefetch()
+
+    def start_prefetch(self):
+        """Get the largest child folders of the current view ready in the background
+
+        Folders inside a size tree only need their listing built; folders
+        no tree covers yet are scanned with one low-priority worker. Any
+        foreground scan cancels the prefetch.
+        """
+        self.cancel_prefetch()
+        if not self.prefetch_var.get() or self.is_scanning:
+            return
+        listing = self.folder_data
+        folders = [row for row in range(len(listing)) if listing.kinds[row] == 1]
+        targets = []
+        for row in heapq.nlargest(PREFETCH_FOLDERS, folders, key=listing.sizes.__getitem__):
+            path = os.path.join(self.current_path, listing.names[row])
+            if path not in self.directory_cache:
+                targets.append(path)
+        if not targets:
+            return
+
+        generation = self.prefetch_generation
+        self.start_tree_reader(self.prefetch_thread, generation, targets, self.count_links_once,
+                               self.one_filesystem)
+
+    def cancel_prefetch(self):
+        self.prefetch_generation += 1
+
+    def prefetch_thread(self, generation, targets, count_links_once, one_filesystem):
+        """Build listings or scan targets in turn; results go to the UI thread via the queue"""
+        def should_stop():
+            return self.prefetch_generation != generation or self.is_scanning
+
+        if (hasattr(os, 'setpriority') and hasattr(threading, 'get_native_id')
+                and sys.platform.startswith('linux')):
+            try:
+                # On Linux a thread id lowers the priority of just this thread
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+            except OSError:
+                pass
+
+        for path in targets:
+            if should_stop():
+                return
+            node = self.size_trees.find(path)
+            tree = scanned_at = None
+            try:
+                if node is None:
+                    scanned_at = time.time()
+                    scanner = FolderScanner(path, should_stop=should_stop, workers=1,
+                                            count_links_once=count_links_once,
+                                            one_filesystem=one_filesystem)
+                    result = scanner.scan()
+                    if result.cancelled or result.tree is None:
+                        return
+                    tree = node = result.tree
+                listing = node.folder_data()
+            except (OSError, ScanError):
+                continue
+            self.update_queue.put(('prefetched', generation, path, listing, tree, scanned_at))
+
+    def store_prefetched(self, generation, path, listing, tree, scanned_at):
+        """Cache a prefetched listing unless a foreground scan made it stale"""
+        if generation != self.prefetch_generation or path in self.directory_cache:
+            return
+        if tree is not None:
+            if self.size_trees.find(path) is not None:
+                return
+            self.change_trees(('tree', tree, scanned_at, False))
+        self.save_to_cache(path, scanned_at or self.size_trees.scan_time(path), listing)
 
-    def add_tree_item(self, name, size, item_type, files, folders):
-        """Add item to tree view"""
-        if item_type == "Folder":
-            self.tree.insert("", "end", text=f"📁 {name}",
-                           values=(self.format_size(size), item_type, files, folders))
+    def start_tree_reader(self, target, *args):
+        """Run target(*args) on a thread that may read the size trees
+
+        Until it ends, change_trees holds every tree change back, so the
+        thread never sees a node change under it.
+        """
+        self.tree_readers += 1
+
+        def run():
+            try:
+                target(*args)
+            finally:
+                self.update_queue.put(('trees_released',))
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def release_trees(self):
+        """A tree reader ended; apply the changes held back for the last one"""
+        self.tree_readers -= 1
+        if self.tree_readers:
+            return
+        changes, self.deferred_changes = self.deferred_changes, []
+        for change in changes:
+            self.apply_tree_change(change)
+
+    def change_trees(self, change):
+        """Apply a size tree change now, or once no background thread reads the trees
+
+        change is ('watch', ops) for a watcher batch, ('tree', node,
+        scanned_at, persisted) for a finished scan to store, or ('remove',
+        path) for a deleted item.
+        """
+        if self.tree_readers:
+            self.deferred_changes.append(change)
         else:
-            self.tree.insert("", "end", text=f"📄 {name}",
-                           values=(self.format_size(size), item_type, "", ""))
+            self.apply_tree_change(change)
+
+    def apply_tree_change(self, change):
+        kind = change[0]
+        if kind == 'watch':
+            self.apply_watch_changes(change[1])
+        elif kind == 'tree':
+            _, tree, scanned_at, persisted = change
+            self.save_tree(tree, scanned_at)
+            if persisted and tree.parent is not None:
+                # Grafted into a larger tree: its stored ancestors need the new totals
+                self.persist_totals(ancestor_totals(tree))
+        elif kind == 'remove':
+            self.size_trees.remove(change[1])
+
+    def toggle_live_updates(self):
+        """Start or stop the inotify watcher for every scanned tree"""
+        if not self.live_updates_var.get():
+            if self.watcher is not None:
+                self.watcher.close()
+                self.watcher = None
+            return
 
-    def scan_folder(self, force_refresh=False):
+        try:
+            self.watcher = fs_watcher.InotifyWatcher(
+                on_change=lambda ops: self.update_queue.put(('watch_changes', ops)),
+                on_limit=lambda watched: self.update_queue.put(('update_status',
+                    f"Live updates limited to {watched:,} folders (inotify watch limit reached) - "
+                    "use Refresh for deeper folders")),
+                on_overflow=lambda: self.update_queue.put(('update_status',
+                    "Live updates missed some changes - press Refresh")))
+        except OSError as e:
+            self.live_updates_var.set(False)
+            messagebox.showerror("Error", f"Cannot start live updates: {str(e)}")
+            return
+
+        # Adding watches for big trees takes a while; keep it off the UI thread
+        watcher = self.watcher
+        trees = list(self.size_trees.roots.values())
+        self.start_tree_reader(lambda: [watcher.watch_tree(tree) for tree in trees])
+
+    def apply_watch_changes(self, ops):
+        """Fold a batch of watcher changes into the size trees and the visible listing"""
+        # Deltas keep the shown folder's type totals without merging the whole tree again
+        cached_data = self.directory_cache.peek(self.current_path)
+        type_deltas = {} if cached_data is not None and 'types' in cached_data else None
+        changed, new_nodes, removed = fs_watcher.apply_changes(self.size_trees, ops, type_deltas)
+        if self.watcher is not None:
+            for path in removed:
+                self.watcher.unwatch_tree(path)
+            for node in new_nodes:
+                self.watcher.watch_tree(node)
+
+        current = os.path.normpath(self.current_path)
+        prefix = os.path.join(current, '')
+        view_changed = False
+        types = None
+        for path in changed:
+            self.directory_cache.pop(path, None)
+            self.forget_listings(path)
+            if path == current or path.startswith(prefix):
+                view_changed = True
+                types = self.carry_types(cached_data, type_deltas and type_deltas[path])
+
+        if view_changed and not self.is_scanning:
+            self.update_view_from_tree(types)
+
+    def update_view_from_tree(self, types=None):
+        """Update the visible rows in place from the size tree, keeping selection and order"""
+        node = self.size_trees.find(self.current_path)
+        if node is None:
+            return
+        self.replace_listing(node.folder_data(), types=types)
+        self.status_label.config(text=self.totals_text(self.current_path) +
+                                 f" | Live at {time.strftime('%H:%M:%S')}")
+
+    def replace_listing(self, new_data, timestamp=None, types=None):
+        """Show a new listing of the current folder by changing only the rows that differ"""
+        for name in list(self.row_items):
+            data = new_data.get(name)
+            old = self.folder_data.get(name)
+            if data is None or old is None or data.type != old.type:
+                # Gone, or replaced by an entry of the other type (icon changes)
+                self.remove_row(name)
+
+        # Removals are done, so sort keys may change now
+        for name, child in self.row_items.items():
+            data = new_data[name]
+            if data != self.folder_data[name]:
+                self.tree.item(child, values=self.row_values(data))
+                if self.sort_column is not None:
+                    self.row_keys[name] = self.sort_key(name, data)
+
+        self.folder_data = new_data
+        self.apply_sort()
+        self.shown_heap = [(new_data[name].size, name) for name in self.row_items]
+        heapq.heapify(self.shown_heap)
+        # Only entries that could make the current page need offering
+        for row in new_data.top_rows(self.row_limit):
+            self.offer_row(new_data.names[row], new_data.entry(row))
+        self.update_more_row()
+        self.save_to_cache(self.current_path, timestamp, types=types)
+        self.show_type_breakdown()
+
+    def apply_delete(self, path):
+        """Account for a deleted item of the current folder without rescanning
+
+        Its row's totals come off the size tree, the current listing and
+        every cached ancestor listing; whatever was cached for the item
+        itself is dropped.
+        """
+        name = os.path.basename(path)
+        data = self.folder_data.get(name)
+        if data is None or self.is_scanning:
+            # The listing is still being built, so only a rescan can be trusted
+            self.directory_cache.pop(self.current_path, None)
+            self.scan_folder(force_refresh=True)
+            return
+
+        if self.watcher is not None:
+            self.watcher.unwatch_tree(path)
+        if data.type == 'Folder':
+            node = self.size_trees.find(path)
+            removed_types = node.type_totals() if node is not None else None
+        else:
+            removed_types = {file_type(name): [data.size, 1]} if data.type == 'File' else {}
+        self.change_trees(('remove', path))
+        prefix = os.path.join(path, '')
+        for cached_path in [p for p in self.directory_cache if p == path or p.startswith(prefix)]:
+            del self.directory_cache[cached_path]
+
+        # A folder counts itself in its ancestors' folder totals
+        folders = data.folders + 1 if data.type == 'Folder' else 0
+        child = os.path.normpath(self.current_path)
+        parent = os.path.dirname(child)
+        while parent != child:
+            cached_data = self.directory_cache.peek(parent)
+            row_name = os.path.basename(child)
+            if cached_data is not None and row_name in cached_data['folder_data']:
+                # Cached tables may be on screen elsewhere; change a copy
+                listing = cached_data['folder_data'].copy()
+                old = listing[row_name]
+                listing[row_name] = old._replace(size=old.size - data.size,
+                                                 alloc=old.alloc - data.alloc,
+                                                 files=old.files - data.files,
+                                                 folders=old.folders - folders)
+                self.save_to_cache(parent, self.cache_timestamps.get(parent), listing,
+                                   self.carry_types(cached_data, removed_types, -1))
+            child, parent = parent, os.path.dirname(parent)
+
+        listing = self.folder_data.copy()
+        del listing[name]
+        types = self.carry_types(self.directory_cache.peek(self.current_path), removed_types, -1)
+        self.replace_listing(listing, self.cache_timestamps.get(self.current_path), types)
+        self.status_label.config(text=self.totals_text(self.current_path) + f" | Deleted {name}")
+
+    def row_values(self, data):
+        """Treeview column values for one folder_data entry"""
+        if data.type == 'Folder':
+            return (self.format_size(data.size), self.format_size(data.alloc), data.type,
+                    data.files, data.folders)
+        if data.type == 'Mount':
+            return ("", "", data.type, "", "")
+        return (self.format_size(data.size), self.format_size(data.alloc), data.type, "", "")
+
+    def clear_rows(self):
+        """Empty the tree view and forget rows still waiting to be inserted"""
+        self.tree.delete(*self.tree.get_children())
+        self.row_items = {}
+        self.item_names = {}
+        self.shown_heap = []
+        self.sort_keys = []
+        self.row_keys = {}
+        self.pending_rows.clear()
+        self.more_item = None
+
+    def show_listing(self, listing):
+        """Replace the view with the largest row_limit entries of listing"""
+        self.clear_rows()
+        for row in listing.top_rows(self.row_limit):
+            self.pending_rows.append((listing.names[row], listing.entry(row)))
+        self.insert_pending_rows()
+
+    def show_more_rows(self):
+        """Extend the view by another page of the next largest entries"""
+        self.row_limit += ROW_PAGE_SIZE
+        listing = self.folder_data
+        for row in listing.top_rows(self.row_limit):
+            name = listing.names[row]
+            if name not in self.row_items:
+                self.pending_rows.append((name, listing.entry(row)))
+        self.insert_pending_rows()
+
+    def insert_pending_rows(self):
+        """Insert waiting rows until this tick's time budget is used up"""
+        if not self.pending_rows:
+            return
+        deadline = time.perf_counter() + INSERT_BUDGET
+        pending = self.pending_rows
+        while pending and time.perf_counter() < deadline:
+            self.offer_row(*pending.popleft())
+        self.update_more_row()
+
+    def offer_row(self, name, data):
+        """Show a row if it belongs on the current page, displacing the smallest shown row"""
+        if name in self.row_items:
+            return
+        if len(self.row_items) >= self.row_limit:
+            if not self.shown_heap or data.size <= self.shown_heap[0][0]:
+                return
+            _, smallest = heapq.heappop(self.shown_heap)
+            self.remove_row(smallest)
+
+        self.place_row(name, data)
+        heapq.heappush(self.shown_heap, (data.size, name))
+
+    def sort_key(self, name, data):
+        """Key ordering rows by the active sort column (folders first by name, else largest first)"""
+        if self.sort_column == "name":
+            return self.name_key(name, folder_scanner.ENTRY_KINDS[data.type])
+        return (-getattr(data, self.sort_column), name)
+
+    def name_key(self, name, kind):
+        """Name column key for an EntryTable kind code: folders and mount points, then files"""
+        return (kind == folder_scanner.ENTRY_KINDS[folder_scanner.FILE], name)
+
+    def place_row(self, name, data):
+        """Insert a row where the active sort puts it"""
+        if self.sort_column is None:
+            index = "end"
+        else:
+            key = self.sort_key(name, data)
+            index = bisect.bisect(self.sort_keys, key)
+            self.sort_keys.insert(index, key)
+            self.row_keys[name] = key
+
+        icon = ROW_ICONS.get(data.type, "📄")
+        item = self.tree.insert("", index, text=f"{icon} {name}", values=self.row_values(data))
+        self.row_items[name] = item
+        self.item_names[item] = name
+
+    def remove_row(self, name):
+        """Take a shown row out of the view and the sorted model"""
+        item = self.row_items.pop(name)
+        del self.item_names[item]
+        key = self.row_keys.pop(name, None)
+        if key is not None:
+            del self.sort_keys[bisect.bisect_left(self.sort_keys, key)]
+        self.tree.delete(item)
+
+    def apply_sort(self):
+        """Put the shown rows in sort order with a single Treeview call"""
+        if self.sort_column is None:
+            return
+        order = sorted(self.row_keys, key=self.row_keys.__getitem__)
+        self.sort_keys = [self.row_keys[name] for name in order]
+        children = [self.row_items[name] for name in order]
+        if self.more_item is not None:
+            children.append(self.more_item)
+        self.tree.set_children("", *children)
+
+    def update_more_row(self):
+        """Keep a 'more items' row at the end while part of the listing is hidden"""
+        hidden = len(self.folder_data) - len(self.row_items)
+        if hidden <= 0:
+            if self.more_item is not None:
+                self.tree.delete(self.more_item)
+                self.more_item = None
+            return
+
+        text = f"… {hidden:,} more items (double-click to show the next {ROW_PAGE_SIZE:,})"
+        if self.more_item is None:
+            self.more_item = self.tree.insert("", "end", text=text, values=("", "", "", "", ""))
+        else:
+            self.tree.item(self.more_item, text=text)
+            self.tree.move(self.more_item, "", "end")
+
+    def scan_folder(self, force_refresh=False, incremental=False):
         """Start scanning the current folder"""
         if self.is_scanning:
             return
 
+        self.row_limit = ROW_PAGE_SIZE
+        self.cancel_prefetch()
+
         # Try to load from cache first (unless force refresh)
         if not force_refresh and self.load_from_cache(self.current_path):
             self.progress_label.config(text="Loaded from cache")
+            self.start_prefetch()
             return
 
         # Clear UI for new scan
-        for item in self.tree.get_children():
-            self.tree.delete(item)
-        self.folder_data.clear()
+        self.clear_rows()
+        # A fresh table: the old one may still be shared with directory_cache
+        self.folder_data = EntryTable()
         self.clear_details()
+        self.types_tree.delete(*self.types_tree.get_children())
 
         # Setup UI for scanning
+        context = self.start_job("Starting scan...")
+        self.folder_data = context.folder_data
+        self.walk_reported = False
+        self.walk_estimate = None
+
+        # Tk variables must only be read on the main thread
+        context.workers = self.workers_var.get()
+        self.count_links_once = context.count_links_once = self.links_once_var.get()
+        self.one_filesystem = context.one_filesystem = self.one_fs_var.get()
+        # Stored trees and incremental refresh charge every link, so the
+        # link-counting mode always walks in full; stored trees may also
+        # reach into other filesystems
+        self.disk_cache_enabled = (self.disk_cache_var.get() and not self.count_links_once
+                                   and not self.one_filesystem)
+        context.persist = self.disk_cache_enabled
+        context.use_disk_cache = self.disk_cache_enabled and not force_refresh
+        context.incremental = incremental and not self.count_links_once
+
+        self.profile_scans = self.profile_var.get()
+        self.collecting = {'ticks': 0, 'tick_latency': 0.0, 'max_tick_latency': 0.0,
+                           'peak_queue_depth': 0, 'drain': 0.0}
+        self.diagnostics = {'path': self.current_path,
+                            'started': datetime.now().isoformat(timespec='seconds'),
+                            'ui': self.collecting}
+
+        # Start scan thread
+        target = self.profile_scan_thread if self.profile_scans else self.scan_folder_thread
+        self.start_tree_reader(target, context)
+
+    def start_job(self, label):
+        """Set the UI up for a background job and return its new ScanContext
+
+        Whatever job was running is cancelled first; its late messages
+        are dropped by process_queue.
+        """
+        self.cancel_job()
+        self.job_generation += 1
+        context = ScanContext(self.job_generation, self.current_path, self.update_queue)
+        self.job = context
         self.is_scanning = True
-        self.stop_scan = False
+        self.scan_start_time = context.start_time
         self.progress_bar['value'] = 0
-        self.progress_label.config(text="Starting scan...")
+        self.progress_label.config(text=label)
         self.scan_button.config(state=tk.DISABLED)
         self.refresh_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
+        return context
 
-        # Start scan thread
-        self.scan_thread = threading.Thread(target=self.scan_folder_thread, daemon=True)
-        self.scan_thread.start()
+    def cancel_job(self):
+        """Abandon the running job at once: its thread stops on its own, its messages are dropped"""
+        if self.job is None:
+            return
+        self.job.cancel()
+        self.job = None
+        self.job_generation += 1
+        self.scan_complete(cancelled=True)
+
+    def navigate(self, path):
+        """Show path, cancelling whatever job is running without waiting for it"""
+        self.cancel_job()
+        self.current_path = path
+        self.path_var.set(path)
+        self.clear_details()
+        self.scan_folder()
 
     def refresh_folder(self):
-        """Force refresh the current folder"""
+        """Refresh the current folder, re-walking only directories that changed"""
+        if self.is_scanning:
+            return
+
+        # Without an earlier scan there is nothing to compare against
+        if self.size_trees.find(self.current_path) is None:
+            self.full_rescan()
+            return
+
+        self.scan_folder(force_refresh=True, incremental=True)
+
+    def on_scan_option_change(self):
+        """Drop every cached total (they were counted the other way) and rescan
+
+        Used by every option that changes what a total includes (hard
+        links, other filesystems).
+        """
+        self.cancel_job()
+        self.cancel_prefetch()
+        for path in list(self.directory_cache):
+            self.directory_cache.pop(path, None)
+        for path in list(self.size_trees.roots):
+            self.on_tree_evicted(path, None)
+            self.size_trees.discard(path)
+        self.cache_timestamps.clear()
+        self.full_rescan()
+
+    def full_rescan(self):
+        """Force a complete rescan of the current folder"""
         # Clear cache for current path
         if self.current_path in self.directory_cache:
             del self.directory_cache[self.current_path]
@@ -666,41 +1686,395 @@ class FolderSizeViewer:
         # Scan with force refresh
         self.scan_folder(force_refresh=True)
 
+    def find_duplicates(self):
+        """Look for identical files below the current folder, using its scan's file sizes"""
+        if self.is_scanning:
+            return
+        node = self.size_trees.find(self.current_path)
+        if node is None:
+            messagebox.showinfo("Find Duplicates",
+                                "Scan this folder first - duplicates are found from its scan.")
+            return
+
+        # Runs like a scan, so the Stop button cancels it
+        context = self.start_job("Finding duplicates...")
+        self.start_tree_reader(self.find_duplicates_thread, context, node)
+
+    def find_duplicates_thread(self, context, node):
+        """Hash same-sized files in worker processes and report the groups (worker thread)"""
+        finder = DuplicateFinder(should_stop=context.should_stop)
+        try:
+            for event in finder.iter_find(node):
+                context.post(event)
+        except Exception as e:
+            context.post(('update_status', f"Error finding duplicates: {str(e)}"))
+            context.post(('scan_complete', False))
+            return
+
+        if finder.stopped:
+            context.post(('update_status', "Duplicate search cancelled"))
+        else:
+            reclaimable = sum(group.reclaimable for group in finder.groups)
+            context.post(('update_status',
+                f"{len(finder.groups):,} groups of duplicates | "
+                f"{self.format_size(reclaimable)} reclaimable"))
+            context.post(('duplicates_found', context.path, finder.groups))
+        context.post(('scan_complete', finder.stopped))
+
+    def show_duplicates(self, path, groups):
+        """Window listing duplicate groups, most reclaimable space first"""
+        window = tk.Toplevel(self.root)
+        window.title(f"Duplicates - {path}")
+        window.geometry("800x500")
+
+        reclaimable = sum(group.reclaimable for group in groups)
+        summary = (f"{len(groups):,} groups | {sum(len(group.paths) for group in groups):,} files | "
+                   f"{self.format_size(reclaimable)} reclaimable")
+        if len(groups) > ROW_PAGE_SIZE:
+            summary += f" (largest {ROW_PAGE_SIZE:,} groups shown)"
+        ttk.Label(window, text=summary, padding="5").pack(fill=tk.X)
+
+        frame = ttk.Frame(window)
+        frame.pack(fill=tk.BOTH, expand=True)
+        tree = ttk.Treeview(frame, columns=("Size", "Copies", "Reclaimable"), show="tree headings")
+        tree.heading("#0", text="File")
+        tree.heading("Size", text="Size")
+        tree.heading("Copies", text="Copies")
+        tree.heading("Reclaimable", text="Reclaimable")
+        tree.column("#0", width=480)
+        tree.column("Size", width=100)
+        tree.column("Copies", width=60)
+        tree.column("Reclaimable", width=100)
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        paths = {}
+        for group in groups[:ROW_PAGE_SIZE]:
+            parent = tree.insert("", "end", text=f"📄 {os.path.basename(group.paths[0])}",
+                                 values=(self.format_size(group.size), len(group.paths),
+                                         self.format_size(group.reclaimable)))
+            for file_path in group.paths:
+                paths[tree.insert(parent, "end", text=file_path)] = file_path
+
+        def show_in_folder(event):
+            # Double-clicking a copy opens its folder in the main window
+            selection = tree.selection()
+            if selection and selection[0] in paths:
+                self.show_folder(os.path.dirname(paths[selection[0]]))
+
+        tree.bind("<Double-1>", show_in_folder)
+
+    def show_largest_files(self):
+        """Window listing the biggest files anywhere below the current folder, from the size tree"""
+        node = self.size_trees.lookup(self.current_path)
+        if node is None:
+            messagebox.showinfo("Largest Files",
+                                "Scan this folder first - the largest files are found from its scan.")
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title(f"Largest Files - {self.current_path}")
+        window.geometry("800x500")
+
+        frame = ttk.Frame(window)
+        frame.pack(fill=tk.BOTH, expand=True)
+        tree = ttk.Treeview(frame, columns=("Size", "Folder"))
+        tree.heading("#0", text="File")
+        tree.heading("Size", text="Size")
+        tree.heading("Folder", text="Folder")
+        tree.column("#0", width=250)
+        tree.column("Size", width=100)
+        tree.column("Folder", width=420)
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        folders = {}
+        for size, name, parent in node.largest_files():
+            folder = parent.path
+            item = tree.insert("", "end", text=f"📄 {name}", values=(self.format_size(size), folder))
+            folders[item] = folder
+
+        def show_in_folder(event):
+            selection = tree.selection()
+            if selection and selection[0] in folders:
+                self.show_folder(folders[selection[0]])
+
+        tree.bind("<Double-1>", show_in_folder)
+
+    def diagnostics_report(self):
+        """The last scan's instrumentation as a JSON-ready dict, or None before any scan
+
+        Combines the scanner's numbers (phase timings, rates, errors by
+        errno) with the UI thread's: time spent draining the queue, peak
+        queue depth and how late the queue ticks ran.
+        """
+        if self.diagnostics is None:
+            return None
+        report = dict(self.diagnostics)
+        ui = report['ui']
+        ticks = ui['ticks']
+        report['ui'] = {
+            'drain_seconds': round(ui['drain'], 4),
+            'peak_queue_depth': ui['peak_queue_depth'],
+            'ticks': ticks,
+            'mean_tick_latency': round(ui['tick_latency'] / ticks, 4) if ticks else None,
+            'max_tick_latency': round(ui['max_tick_latency'], 4),
+        }
+        return report
+
+    def show_diagnostics(self):
+        """Window with the last scan's diagnostics, savable as JSON"""
+        report = self.diagnostics_report()
+        if report is None:
+            messagebox.showinfo("Scan Diagnostics", "Scan a folder first.")
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title(f"Scan Diagnostics - {report['path']}")
+        window.geometry("650x550")
+
+        frame = ttk.Frame(window)
+        tree = ttk.Treeview(frame, columns=("Value",))
+        tree.heading("#0", text="Metric")
+        tree.heading("Value", text="Value")
+        tree.column("#0", width=380)
+        tree.column("Value", width=230)
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+
+        def add(parent, key, value):
+            if isinstance(value, dict):
+                item = tree.insert(parent, "end", text=key, open=True)
+                for child_key, child_value in value.items():
+                    add(item, child_key, child_value)
+            elif isinstance(value, list):
+                item = tree.insert(parent, "end", text=key, open=True)
+                for row in value:
+                    tree.insert(item, "end", text=row['function'],
+                                values=(f"{row['cumulative']:.3f}s ({row['calls']:,} calls)",))
+            else:
+                if isinstance(value, int) and not isinstance(value, bool):
+                    value = f"{value:,}"
+                tree.insert(parent, "end", text=key, values=("" if value is None else value,))
+
+        for key, value in report.items():
+            add("", key, value)
+
+        def save():
+            path = filedialog.asksaveasfilename(parent=window, title="Save Diagnostics",
+                                                defaultextension=".json",
+                                                filetypes=[("JSON", "*.json")])
+            if not path:
+                return
+            try:
+                with open(path, 'w', encoding='utf-8') as f:
+                    json.dump(report, f, indent=2)
+            except OSError as e:
+                messagebox.showerror("Error", f"Cannot save diagnostics: {str(e)}", parent=window)
+
+        buttons = ttk.Frame(window, padding="5")
+        buttons.pack(side=tk.BOTTOM, fill=tk.X)
+        ttk.Button(buttons, text="Save as JSON...", command=save).pack(side=tk.RIGHT)
+        frame.pack(fill=tk.BOTH, expand=True)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+    def export_scan(self):
+        """Walk the current folder again, streaming every entry to a JSON Lines or CSV file"""
+        if self.is_scanning:
+            return
+        export_path = filedialog.asksaveasfilename(
+            title="Export Scan", defaultextension=".jsonl",
+            filetypes=[("JSON Lines", "*.jsonl"), ("CSV", "*.csv")])
+        if not export_path:
+            return
+
+        # Runs like a scan, so the Stop button cancels it
+        context = self.start_job("Exporting...")
+
+        # The export walks with the same options as a scan would
+        scanner = FolderScanner(self.current_path, should_stop=context.should_stop,
+                                count_links_once=self.links_once_var.get(),
+                                one_filesystem=self.one_fs_var.get())
+        threading.Thread(target=self.export_scan_thread, args=(context, scanner, export_path),
+                         daemon=True).start()
+
+    def export_scan_thread(self, context, scanner, export_path):
+        """Stream the walk to export_path; nothing is kept in memory (worker thread)"""
+        def progress(count):
+            context.post(('update_status', f"Exporting... {count:,} entries written"))
+
+        try:
+            with open_export(export_path) as out:
+                count = export_records(scanner.iter_records(), out, format_for_path(export_path),
+                                       progress)
+        except ScanError as e:
+            context.post(('update_status', f"Error: {str(e)}"))
+            context.post(('scan_complete', False))
+            return
+        except OSError as e:
+            context.post(('update_status', f"Could not write export: {str(e)}"))
+            context.post(('scan_complete', False))
+            return
+
+        if scanner.stopped:
+            context.post(('update_status',
+                f"Export stopped - {count:,} entries written to {export_path}"))
+        else:
+            context.post(('update_status', f"Exported {count:,} entries to {export_path}"))
+        context.post(('scan_complete', scanner.stopped))
+
+    def get_snapshot_store(self):
+        """Open the snapshot database on first use; None if it is unavailable"""
+        if self.snapshot_store is None:
+            try:
+                self.snapshot_store = SnapshotStore()
+            except (OSError, sqlite3.Error, SnapshotError) as e:
+                messagebox.showerror("Snapshots", f"Snapshots unavailable: {str(e)}")
+                return None
+        return self.snapshot_store
+
+    def save_snapshot(self):
+        """Save the current folder's scanned totals under a name for later comparison"""
+        node = self.size_trees.find(self.current_path)
+        if self.is_scanning or node is None:
+            messagebox.showinfo("Save Snapshot", "Scan this folder first - snapshots are saved "
+                                                 "from a finished scan.")
+            return
+        folder_name = os.path.basename(self.current_path.rstrip(os.sep)) or self.current_path
+        name = simpledialog.askstring("Save Snapshot", "Snapshot name:", parent=self.root,
+                                      initialvalue=f"{folder_name} {time.strftime('%Y-%m-%d %H:%M')}")
+        if not name:
+            return
+        store = self.get_snapshot_store()
+        if store is None:
+            return
+        self.status_label.config(text=f"Saving snapshot {name}...")
+        self.start_tree_reader(self.save_snapshot_thread, store, name, node)
+
+    def save_snapshot_thread(self, store, name, node):
+        try:
+            store.save(name, node)
+        except (sqlite3.Error, UnicodeError) as e:
+            self.update_queue.put(('update_status', f"Could not save snapshot: {str(e)}"))
+        else:
+            self.update_queue.put(('update_status',
+                f"Snapshot {name} saved ({node.folders + 1:,} folders)"))
+
+    def compare_snapshots(self):
+        """Window comparing two saved snapshots: overall change plus the fastest-growing folders"""
+        store = self.get_snapshot_store()
+        if store is None:
+            return
+        names = [info.name for info in store.list()]
+        if len(names) < 2:
+            messagebox.showinfo("Compare Snapshots",
+                                "Save at least two snapshots (Tools > Save Snapshot) to compare.")
+            return
+
+        window = tk.Toplevel(self.root)
+        window.title("Compare Snapshots")
+        window.geometry("900x550")
+
+        choice_frame = ttk.Frame(window, padding="5")
+        choice_frame.pack(fill=tk.X)
+        old_var = tk.StringVar(value=names[-2])
+        new_var = tk.StringVar(value=names[-1])
+        ttk.Label(choice_frame, text="Old:").pack(side=tk.LEFT)
+        ttk.Combobox(choice_frame, textvariable=old_var, values=names, state="readonly",
+                     width=30).pack(side=tk.LEFT, padx=5)
+        ttk.Label(choice_frame, text="New:").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Combobox(choice_frame, textvariable=new_var, values=names, state="readonly",
+                     width=30).pack(side=tk.LEFT, padx=5)
+        summary = ttk.Label(window, text="", padding="5")
+
+        frame = ttk.Frame(window)
+        view = ttk.Treeview(frame, columns=("Change", "Per Day", "Files", "Before", "After"))
+        view.heading("#0", text="Folder")
+        for column, width in (("Change", 100), ("Per Day", 110), ("Files", 80),
+                              ("Before", 100), ("After", 100)):
+            view.heading(column, text=column)
+            view.column(column, width=width)
+        view.column("#0", width=380)
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=view.yview)
+        view.configure(yscrollcommand=scrollbar.set)
+
+        def compare():
+            summary.config(text="Comparing...")
+            view.delete(*view.get_children())
+            threading.Thread(target=self.compare_snapshots_thread,
+                             args=(store, old_var.get(), new_var.get(), view, summary),
+                             daemon=True).start()
+
+        ttk.Button(choice_frame, text="Compare", command=compare).pack(side=tk.LEFT, padx=10)
+        summary.pack(fill=tk.X)
+        frame.pack(fill=tk.BOTH, expand=True)
+        view.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        def show_in_folder(event):
+            selection = view.selection()
+            if selection and os.path.isdir(view.item(selection[0], "text")):
+                self.show_folder(view.item(selection[0], "text"))
+
+        view.bind("<Double-1>", show_in_folder)
+        compare()
+
+    def compare_snapshots_thread(self, store, old_name, new_name, view, summary):
+        """Diff two snapshots off the UI thread"""
+        try:
+            diff = store.diff(old_name, new_name)
+        except (SnapshotError, sqlite3.Error) as e:
+            self.update_queue.put(('update_status', f"Cannot compare snapshots: {str(e)}"))
+            return
+        self.update_queue.put(('snapshot_diff', view, summary, diff))
+
+    def show_snapshot_diff(self, view, summary, diff):
+        """Fill a Compare Snapshots window with a SnapshotDiff"""
+        if not view.winfo_exists():
+            return
+        summary.config(text=f"{diff.interval / 86400:.1f} days | "
+                            f"Total: {format_delta(diff.size_delta)} ({diff.files_delta:+,} files) | "
+                            f"{len(diff.changes):,} folders changed, {diff.added:,} new, "
+                            f"{diff.removed:,} removed")
+        for title, changes in (("Growing", diff.growing()), ("Shrinking", diff.shrinking())):
+            section = view.insert("", "end", text=f"{title} ({len(changes)})", open=True)
+            for change in changes:
+                rate = diff.rate(change)
+                view.insert(section, "end", text=diff.full_path(change),
+                            values=(format_delta(change.size_delta),
+                                    f"{format_delta(rate)}/day" if rate is not None else "",
+                                    f"{change.files_delta:+,}",
+                                    self.format_size(change.old_size),
+                                    self.format_size(change.new_size)))
+
+    def show_folder(self, folder):
+        """Navigate the main window to folder (from a result window)"""
+        if self.is_scanning or not os.path.isdir(folder):
+            return
+        self.navigate(folder)
+
     def stop_scanning(self):
         """Stop the current scan immediately"""
-        self.stop_scan = True
+        if self.job is not None:
+            # The job reports what it got done before it stopped
+            self.job.cancel()
         self.progress_label.config(text="Stopping...")
         self.stop_button.config(state=tk.DISABLED)
 
     def on_drive_change(self, event):
         """Handle drive selection change"""
-        # Stop any current scan immediately
-        if self.is_scanning:
-            self.stop_scan = True
-            # Wait briefly for thread to stop (max 200ms)
-            if self.scan_thread:
-                self.scan_thread.join(timeout=0.2)
-
-        drive = self.drive_var.get()
-        self.path_var.set(drive)
-        self.current_path = drive
-        self.clear_details()
-        # Small delay to ensure previous scan is fully stopped
-        self.root.after(100, self.scan_folder)
+        self.navigate(self.drive_var.get())
 
     def on_path_change(self, event):
         """Handle manual path entry"""
         path = self.path_var.get()
         if os.path.exists(path) and os.path.isdir(path):
-            # Stop any current scan immediately
-            if self.is_scanning:
-                self.stop_scan = True
-                if self.scan_thread:
-                    self.scan_thread.join(timeout=0.2)
-
-            self.current_path = path
-            self.clear_details()
-            self.root.after(100, self.scan_folder)
+            self.navigate(path)
         else:
             messagebox.showerror("Error", "Invalid path")
             self.path_var.set(self.current_path)
@@ -708,27 +2082,16 @@ class FolderSizeViewer:
     def on_item_double_click(self, event):
         """Handle double-click on tree item"""
         selection = self.tree.selection()
-        if selection:
-            item = self.tree.item(selection[0])
-            item_text = item['text']
-            item_values = item['values']
-
-            if item_values[1] == "Folder":
-                # Stop any current scan immediately
-                if self.is_scanning:
-                    self.stop_scan = True
-                    if self.scan_thread:
-                        self.scan_thread.join(timeout=0.2)
-
-                # Remove folder icon and navigate
-                folder_name = item_text.replace("📁 ", "")
-                new_path = os.path.join(self.current_path, folder_name)
+        if selection and selection[0] == self.more_item:
+            self.show_more_rows()
+        elif selection and selection[0] in self.item_names:
+            folder_name = self.item_names[selection[0]]
+            data = self.folder_data.get(folder_name)
 
+            if data is not None and data.type in ("Folder", "Mount"):
+                new_path = os.path.join(self.current_path, folder_name)
                 if os.path.exists(new_path):
-                    self.current_path = new_path
-                    self.path_var.set(new_path)
-                    self.clear_details()
-                    self.root.after(100, self.scan_folder)
+                    self.navigate(new_path)
             else:
                 # Double-click on file - open it
                 self.open_selected()
@@ -750,55 +2113,25 @@ class FolderSizeViewer:
         """Navigate to parent directory"""
         parent = os.path.dirname(self.current_path)
         if parent and os.path.exists(parent):
-            # Stop any current scan immediately
-            if self.is_scanning:
-                self.stop_scan = True
-                if self.scan_thread:
-                    self.scan_thread.join(timeout=0.2)
-
-            self.current_path = parent
-            self.path_var.set(parent)
-            self.clear_details()
-            self.root.after(100, self.scan_folder)
+            self.navigate(parent)
 
     def sort_tree(self, col):
-        """Sort tree by column"""
-        if col == "name":
-            items = [(self.tree.item(child)['text'], child) for child in self.tree.get_children('')]
-            items.sort()
-        elif col == "size":
-            items = []
-            for child in self.tree.get_children(''):
-                item_text = self.tree.item(child)['text']
-                name = item_text.replace("📁 ", "").replace("📄 ", "")
-                if name in self.folder_data:
-                    size = self.folder_data[name]['size']
-                    items.append((size, child))
-            items.sort(reverse=True)
-        elif col == "files":
-            items = []
-            for child in self.tree.get_children(''):
-                item_text = self.tree.item(child)['text']
-                name = item_text.replace("📁 ", "").replace("📄 ", "")
-                if name in self.folder_data:
-                    files = self.folder_data[name]['files']
-                    items.append((files, child))
-            items.sort(reverse=True)
-        elif col == "folders":
-            items = []
-            for child in self.tree.get_children(''):
-                item_text = self.tree.item(child)['text']
-                name = item_text.replace("📁 ", "").replace("📄 ", "")
-                if name in self.folder_data:
-                    folders = self.folder_data[name]['folders']
-                    items.append((folders, child))
-            items.sort(reverse=True)
-        else:
+        """Sort tree by column and keep it sorted as more rows arrive"""
+        if col not in ("name", "size", "alloc", "files", "folders"):
             return
+        self.sort_column = col
 
-        # Rearrange items in sorted order
-        for index, (_, child) in enumerate(items):
-            self.tree.move(child, '', index)
+        # Keys come straight from the listing's columns, not from Treeview text
+        listing = self.folder_data
+        rows = listing.index()
+        if col == "name":
+            kinds = listing.kinds
+            self.row_keys = {name: self.name_key(name, kinds[rows[name]]) for name in self.row_items}
+        else:
+            column = {"size": listing.sizes, "alloc": listing.allocs,
+                      "files": listing.files, "folders": listing.folders}[col]
+            self.row_keys = {name: (-column[rows[name]], name) for name in self.row_items}
+        self.apply_sort()
 
     def show_context_menu(self, event):
         """Show context menu on right-click"""
@@ -811,11 +2144,8 @@ class FolderSizeViewer:
     def get_selected_path(self):
         """Get the full path of the selected item"""
         selection = self.tree.selection()
-        if selection:
-            item = self.tree.item(selection[0])
-            item_text = item['text']
-            item_name = item_text.replace("📁 ", "").replace("📄 ", "")
-            return os.path.join(self.current_path, item_name)
+        if selection and selection[0] in self.item_names:
+            return os.path.join(self.current_path, self.item_names[selection[0]])
         return None
 
     def delete_selected(self):
@@ -843,14 +2173,12 @@ class FolderSizeViewer:
 
                 messagebox.showinfo("Success", f"{item_type.capitalize()} deleted successfully.")
 
-                # Clear cache for current directory and refresh
-                if self.current_path in self.directory_cache:
-                    del self.directory_cache[self.current_path]
-                self.clear_details()
-                self.scan_folder(force_refresh=True)
-
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to delete {item_type}: {str(e)}")
+                return
+
+            self.clear_details()
+            self.apply_delete(path)
 
     def delete_to_recycle(self):
         """Delete selected file or folder to recycle bin"""
@@ -869,17 +2197,17 @@ class FolderSizeViewer:
 
         if result:
             try:
+                if send2trash is None:
+                    raise RuntimeError("send2trash is not installed (pip install send2trash)")
                 send2trash.send2trash(path)
                 messagebox.showinfo("Success", f"{item_type.capitalize()} moved to Recycle Bin.")
 
-                # Clear cache for current directory and refresh
-                if self.current_path in self.directory_cache:
-                    del self.directory_cache[self.current_path]
-                self.clear_details()
-                self.scan_folder(force_refresh=True)
-
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to move {item_type} to Recycle Bin: {str(e)}")
+                return
+
+            self.clear_details()
+            self.apply_delete(path)
 
     def show_properties_dialog(self):
         """Show detailed properties in a dialog"""
@@ -890,21 +2218,23 @@ class FolderSizeViewer:
 
         selection = self.tree.selection()
         if selection:
-            item = self.tree.item(selection[0])
-            item_text = item['text']
-            item_name = item_text.replace("📁 ", "").replace("📄 ", "")
+            item_name = self.item_names[selection[0]]
 
             if item_name in self.folder_data:
                 data = self.folder_data[item_name]
 
                 props = f"Name: {item_name}\n"
                 props += f"Path: {path}\n"
-                props += f"Type: {data['type']}\n"
-                props += f"Size: {self.format_size(data['size'])} ({data['size']:,} bytes)\n"
+                props += f"Type: {data.type}\n"
+                if data.type == 'Mount':
+                    props += "Size: not scanned (mount point of another filesystem)\n"
+                else:
+                    props += f"Size: {self.format_size(data.size)} ({data.size:,} bytes)\n"
+                    props += f"On disk: {self.format_size(data.alloc)} ({data.alloc:,} bytes)\n"
 
-                if data['type'] == 'Folder':
-                    props += f"Files: {data['files']:,}\n"
-                    props += f"Folders: {data['folders']:,}\n"
+                if data.type == 'Folder':
+                    props += f"Files: {data.files:,}\n"
+                    props += f"Folders: {data.folders:,}\n"
 
                 # Add file system metadata
                 if os.path.exists(path):
@@ -919,6 +2249,14 @@ class FolderSizeViewer:
                 messagebox.showinfo("Properties", props)
 
 if __name__ == "__main__":
+    # The duplicate finder's worker processes re-run this script in a
+    # frozen (PyInstaller) build
+    multiprocessing.freeze_support()
+
+    # Any command line arguments select the headless scanner
+    if len(sys.argv) > 1:
+        sys.exit(folder_scanner.main(sys.argv[1:]))
+
     root = tk.Tk()
     app = FolderSizeViewer(root)
     root.mainloop()
@@ -0,0 +1,331 @@
+"""Live filesystem watching for YoFiles (Linux inotify).
+
+The watcher thread reads inotify events for every directory of the
+scanned size trees, coalesces them for a short interval, does the stat
+I/O needed to resolve them and hands a batch of change operations to a
+callback. apply_changes() then splices those operations into the size
+trees on the caller's (UI) thread. The viewer holds batches back while
+any background thread reads the trees, so nodes only change on that
+thread and never under a reader.
+Uses ctypes against libc, so no extra dependency is needed.
+"""
+import os
+import sys
+import stat
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+
+from folder_scanner import FolderScanner, add_type_totals, allocated_size, file_type
+
+# inotify event masks (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+
+WATCH_MASK = (IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+# Seconds to collect events before resolving them as one batch
+COALESCE_INTERVAL = 0.5
+
+
+def is_supported():
+    return sys.platform.startswith('linux') and _load_libc() is not None
+
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            _libc = libc
+        except (OSError, AttributeError):
+            return None
+    return _libc
+
+
+class InotifyWatcher:
+    """Watches directories and reports coalesced change batches.
+
+    on_change(ops) is called from the watcher thread with a list of
+    operations for apply_changes(). on_limit(watched) is called once if
+    the kernel's watch limit (fs.inotify.max_user_watches) is reached;
+    directories beyond the limit are simply not watched. on_overflow() is
+    called if the kernel dropped events, after which only a refresh can
+    bring the trees back in sync.
+    """
+
+    def __init__(self, on_change, on_limit=None, on_overflow=None):
+        libc = _load_libc()
+        if libc is None or not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "inotify is not available on this platform")
+        self.libc = libc
+        self.on_change = on_change
+        self.on_limit = on_limit
+        self.on_overflow = on_overflow
+
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self.lock = threading.Lock()
+        self.paths = {}     # wd -> directory path
+        self.wds = {}       # directory path -> wd
+        self.limit_reached = False
+        self._wake_r, self._wake_w = os.pipe()
+        self._running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @property
+    def watch_count(self):
+        return len(self.wds)
+
+    def close(self):
+        """Stop the watcher thread and release every watch"""
+        self._running = False
+        os.write(self._wake_w, b'x')
+        self.thread.join()
+        os.close(self.fd)
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def watch_tree(self, node):
+        """Watch node's directory and every directory below it, shallowest first
+
+        Breadth-first order means that when the watch limit cuts in, the
+        directories nearest the top (where the user is looking) are the
+        ones still covered.
+        """
+        level = [(node.path, node)]
+        while level and not self.limit_reached:
+            next_level = []
+            for path, current in level:
+                if not self._add_watch(path):
+                    if self.limit_reached:
+                        return
+                    continue
+                for name, child in current.children.items():
+                    next_level.append((os.path.join(path, name), child))
+            level = next_level
+
+    def _add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                self.limit_reached = True
+                if self.on_limit:
+                    self.on_limit(self.watch_count)
+            return False
+        with self.lock:
+            old_path = self.paths.get(wd)
+            if old_path is not None and old_path != path:
+                self.wds.pop(old_path, None)
+            self.paths[wd] = path
+            self.wds[path] = wd
+        return True
+
+    def unwatch_tree(self, path):
+        """Stop watching path and everything below it"""
+        prefix = os.path.join(path, '')
+        with self.lock:
+            gone = [p for p in self.wds if p == path or p.startswith(prefix)]
+            wds = [self.wds.pop(p) for p in gone]
+            for wd in wds:
+                self.paths.pop(wd, None)
+        for wd in wds:
+            self.libc.inotify_rm_watch(self.fd, wd)
+        if wds:
+            self.limit_reached = False
+
+    def _run(self):
+        pending = {}   # directory path -> set of entry names
+        deadline = None
+        while self._running:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0.0, deadline - time.monotonic())
+            ready, _, _ = select.select([self.fd, self._wake_r], [], [], timeout)
+
+            if self.fd in ready:
+                if self._read_events(pending) and deadline is None:
+                    deadline = time.monotonic() + COALESCE_INTERVAL
+
+            if deadline is not None and time.monotonic() >= deadline:
+                batch, pending, deadline = pending, {}, None
+                ops = self._resolve(batch)
+                if ops:
+                    self.on_change(ops)
+
+    def _read_events(self, pending):
+        """Read every queued event into pending; returns True if anything relevant arrived"""
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError:
+            return False
+
+        relevant = False
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                if self.on_overflow:
+                    self.on_overflow()
+                continue
+
+            with self.lock:
+                path = self.paths.get(wd)
+                if mask & IN_IGNORED and path is not None:
+                    del self.paths[wd]
+                    if self.wds.get(path) == wd:
+                        del self.wds[path]
+            if path is None or mask & IN_IGNORED:
+                continue
+
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # Reported to the parent directory as a delete/move as well
+                continue
+            if name:
+                pending.setdefault(path, set()).add(os.fsdecode(name))
+                relevant = True
+        return relevant
+
+    def _resolve(self, batch):
+        """Turn pending (directory, name) pairs into change operations
+
+        All filesystem I/O happens here on the watcher thread: new
+        directories are walked in full, everything else is one lstat.
+        """
+        ops = []
+        scanner = FolderScanner(None)
+        for dir_path, names in batch.items():
+            try:
+                ops.append(('dirstat', dir_path, os.stat(dir_path)))
+            except OSError:
+                continue
+            for name in names:
+                full_path = os.path.join(dir_path, name)
+                try:
+                    st = os.lstat(full_path)
+                except OSError:
+                    ops.append(('gone', dir_path, name))
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    ops.append(('dir', dir_path, name, scanner.walk(full_path)))
+                else:
+                    ops.append(('file', dir_path, name, st.st_size, int(st.st_mtime),
+                                allocated_size(st)))
+        return ops
+
+
+def removed_types(parent, name):
+    """{type: [bytes, files]} that parent.remove(name) would take out"""
+    child = parent.children.get(name)
+    if child is not None:
+        return child.type_totals()
+    try:
+        position = parent.file_names.index(name)
+    except ValueError:
+        return {}
+    return {file_type(name): [parent.file_sizes[position], 1]}
+
+
+def apply_changes(index, ops, type_deltas=None):
+    """Apply an InotifyWatcher batch to the trees in a SizeTreeIndex
+
+    Returns (changed_dirs, new_nodes, removed_paths): the directories whose
+    listing changed, freshly walked directory nodes that should now be
+    watched, and paths of directories that left the tree. Given a dict as
+    type_deltas, each changed directory's path is mapped to how its
+    subtree's {type: [bytes, files]} totals moved.
+    """
+    changed = set()
+    new_nodes = []
+    removed = []
+    for op in ops:
+        kind, dir_path = op[0], op[1]
+        parent = index.find(dir_path)
+        if parent is None:
+            continue
+
+        if kind == 'dirstat':
+            parent.set_stat(op[2])
+            continue
+
+        name = op[2]
+        changed.add(dir_path)
+        delta = type_deltas.setdefault(dir_path, {}) if type_deltas is not None else None
+        if delta is not None:
+            # Whatever had this name goes out; a new file or directory comes back in
+            add_type_totals(delta, removed_types(parent, name), -1)
+        if kind == 'file':
+            _, _, _, size, mtime, alloc = op
+            if delta is not None:
+                add_type_totals(delta, {file_type(name): [size, 1]})
+            if name in parent.children:
+                parent.remove(name)
+                removed.append(os.path.join(dir_path, name))
+            try:
+                position = parent.file_names.index(name)
+            except ValueError:
+                parent.file_names.append(name)
+                parent.file_sizes.append(size)
+                parent.file_allocs.append(alloc)
+                parent.file_mtimes.append(mtime)
+                parent.own_size += size
+                parent.own_alloc += alloc
+                parent.own_files += 1
+                parent.add_type(name, size)
+                parent.propagate(size, 1, 0, alloc)
+            else:
+                delta = size - parent.file_sizes[position]
+                alloc_delta = alloc - parent.file_allocs[position]
+                parent.file_sizes[position] = size
+                parent.file_allocs[position] = alloc
+                parent.file_mtimes[position] = mtime
+                parent.own_size += delta
+                parent.own_alloc += alloc_delta
+                parent.add_type(name, delta, 0)
+                parent.propagate(delta, 0, 0, alloc_delta)
+        elif kind == 'dir':
+            node = op[3]
+            if parent.remove(name) is not None:
+                removed.append(os.path.join(dir_path, name))
+            node.name = name
+            node.parent = parent
+            parent.children[name] = node
+            if delta is not None:
+                add_type_totals(delta, node.type_totals())
+            parent.propagate(node.size, node.files, node.folders + 1, node.alloc)
+            new_nodes.append(node)
+        elif kind == 'gone':
+            if parent.remove(name) is not None:
+                removed.append(os.path.join(dir_path, name))
+    return changed, new_nodes, removed
@@ -0,0 +1,50 @@
+"""Mount table for YoFiles (Linux /proc/self/mountinfo).
+
+FolderScanner uses it to keep a scan of / out of /proc, /sys and the
+other pseudo filesystems, and in one-filesystem mode out of every other
+mount as well. Mount points it does not enter are listed as rows of
+their own instead. Where there is no mountinfo (Windows, macOS) the
+table is simply empty and only st_dev comparisons apply.
+"""
+import os
+import re
+
+MOUNTINFO_PATH = '/proc/self/mountinfo'
+
+# Filesystems whose contents are not disk usage
+PSEUDO_FILESYSTEMS = frozenset({
+    'proc', 'sysfs', 'devtmpfs', 'devpts', 'cgroup', 'cgroup2', 'debugfs', 'tracefs',
+    'securityfs', 'pstore', 'bpf', 'configfs', 'fusectl', 'mqueue', 'hugetlbfs',
+    'autofs', 'binfmt_misc', 'efivarfs', 'selinuxfs', 'rpc_pipefs', 'nsfs', 'ramfs',
+})
+
+_ESCAPE = re.compile(r'\\([0-7]{3})')
+
+
+def _unescape(field):
+    """Undo mountinfo's octal escapes (\\040 for space and so on)"""
+    return _ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), field)
+
+
+def read_mountinfo(path=MOUNTINFO_PATH):
+    """Return {mount_point: fstype} for every mount; {} if path cannot be read
+
+    Later lines win, so a mount stacked over another reports the type of
+    the one that is visible.
+    """
+    mounts = {}
+    try:
+        with open(path, encoding='utf-8', errors='surrogateescape') as f:
+            for line in f:
+                # id parent major:minor root mount_point options [optional...] - fstype source ...
+                fields = line.split()
+                try:
+                    separator = fields.index('-')
+                except ValueError:
+                    continue
+                if separator < 5 or separator + 1 >= len(fields):
+                    continue
+                mounts[os.path.normpath(_unescape(fields[4]))] = fields[separator + 1]
+    except OSError:
+        pass
+    return mounts
@@ -0,0 +1,160 @@
+"""Memory-bounded caches for YoFiles.
+
+LRUCache is a small dict-like container that evicts its least recently
+used entries once an entry-count or approximate byte budget is exceeded,
+and keeps hit/miss/eviction counters so the budget can be tuned.
+"""
+import threading
+from collections import OrderedDict
+
+# Default memory budget for cached scan data (bytes)
+DEFAULT_BUDGET = 512 * 1024 * 1024
+
+# Rough per-item costs used for budgeting, measured on CPython 3.11
+LISTING_ENTRY_BYTES = 108   # one EntryTable row including its name index (names are shared)
+TREE_DIR_BYTES = 900        # DirNode plus its children dict, name and per-type totals
+TREE_FILE_BYTES = 120       # file name, array slots and its share of the largest-files lists
+
+
+def format_bytes(size_bytes):
+    """Short human readable size for status text"""
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size_bytes < 1024.0:
+            return f"{size_bytes:.1f} {unit}"
+        size_bytes /= 1024.0
+    return f"{size_bytes:.1f} TB"
+
+
+def listing_bytes(cached_data):
+    """Approximate size of a directory_cache entry"""
+    return 200 + LISTING_ENTRY_BYTES * len(cached_data['folder_data'])
+
+
+def tree_bytes(node):
+    """Approximate size of a DirNode tree from its running totals"""
+    return TREE_DIR_BYTES * (node.folders + 1) + TREE_FILE_BYTES * node.files
+
+
+class LRUCache:
+    """Dict-like LRU cache bounded by entries and/or approximate bytes.
+
+    sizeof(value) estimates an entry's cost when it is stored (and again
+    on update_cost()). on_evict(key, value) is called for every entry
+    dropped to stay within budget. The most recently stored entry is
+    never evicted, so a single oversized entry is still usable. Only
+    get() counts hits and misses; peek() and the dict operators do not.
+    All operations are guarded by one lock because the scan and UI
+    threads share the cache.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, sizeof=None, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.lock = threading.RLock()
+        self._data = OrderedDict()
+        self._costs = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self._data:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """Look up without touching recency or counters"""
+        with self.lock:
+            return self._data.get(key, default)
+
+    def touch(self, key):
+        with self.lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self._data
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self._data[key]
+            self._data.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        cost = self.sizeof(value) if self.sizeof else 0
+        with self.lock:
+            if key in self._data:
+                self.total_bytes -= self._costs[key]
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._costs[key] = cost
+            self.total_bytes += cost
+            self._evict()
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self._data[key]
+            self.total_bytes -= self._costs.pop(key)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            if key not in self._data:
+                return default
+            self.total_bytes -= self._costs.pop(key)
+            return self._data.pop(key)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        # Snapshot, so callers may delete while iterating
+        with self.lock:
+            return iter(list(self._data))
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        with self.lock:
+            return list(self._data.values())
+
+    def update_cost(self, key):
+        """Re-estimate an entry whose value grew or shrank in place"""
+        with self.lock:
+            if key not in self._data or not self.sizeof:
+                return
+            cost = self.sizeof(self._data[key])
+            self.total_bytes += cost - self._costs[key]
+            self._costs[key] = cost
+            self._evict()
+
+    def set_budget(self, max_entries=None, max_bytes=None):
+        with self.lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _over_budget(self):
+        if self.max_entries is not None and len(self._data) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.total_bytes > self.max_bytes
+
+    def _evict(self):
+        evicted = []
+        while len(self._data) > 1 and self._over_budget():
+            key, value = self._data.popitem(last=False)
+            self.total_bytes -= self._costs.pop(key)
+            self.evictions += 1
+            evicted.append((key, value))
+        if self.on_evict:
+            for key, value in evicted:
+                self.on_evict(key, value)
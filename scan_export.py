@@ -0,0 +1,57 @@
+"""Streaming export of scan results for YoFiles.
+
+Writes the Records of FolderScanner.iter_records() to JSON Lines or CSV
+as the walk produces them, so exporting a volume of any size needs no
+folder_data, size tree or cache in memory. Every line is one file,
+directory or skipped mount point; a directory's line (with its subtree
+totals) comes after everything inside it.
+"""
+import csv
+import json
+
+EXPORT_FORMATS = ('jsonl', 'csv')
+
+CSV_FIELDS = ('type', 'path', 'size', 'alloc', 'files', 'folders', 'mtime')
+
+# Records between progress callbacks
+PROGRESS_INTERVAL = 10000
+
+
+def format_for_path(path):
+    """Export format implied by a file name (JSON Lines unless it ends in .csv)"""
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def open_export(path):
+    """Open an export file; undecodable names are written back as their original bytes"""
+    return open(path, 'w', encoding='utf-8', errors='surrogateescape', newline='')
+
+
+def export_records(records, out, fmt='jsonl', progress=None):
+    """Write records to the text stream out; returns how many were written
+
+    progress(count), if given, is called every PROGRESS_INTERVAL records.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(CSV_FIELDS)
+        write = writer.writerow
+    else:
+        dumps = json.dumps
+
+        # Only the path needs JSON escaping; the rest are fixed words and integers
+        def write(record):
+            out.write(f'{{"type": "{record.type}", "path": {dumps(record.path)}, '
+                      f'"size": {record.size}, "alloc": {record.alloc}, "files": {record.files}, '
+                      f'"folders": {record.folders}, "mtime": {record.mtime}}}\n')
+
+    for record in records:
+        write(record)
+        count += 1
+        if progress is not None and count % PROGRESS_INTERVAL == 0:
+            progress(count)
+    return count
@@ -0,0 +1,270 @@
+"""Persistent on-disk scan cache for YoFiles.
+
+Per-directory aggregates from the in-memory size tree are stored in a
+SQLite database in the user's cache directory, so a restart does not
+mean a cold rescan. Every stored directory keeps its mtime/inode and is
+checked against the disk when it is loaded back. Paths and names are
+stored as os.fsencode() bytes, so names that are not valid UTF-8 survive
+the round trip.
+"""
+import os
+import sys
+import time
+import sqlite3
+import threading
+
+from folder_scanner import DirNode, ScanEstimate
+
+SCHEMA_VERSION = 5
+
+# Rows written per executemany() call
+BATCH_SIZE = 5000
+
+
+def default_cache_dir():
+    """Per-user cache directory following each platform's convention"""
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~\\AppData\\Local')
+        return os.path.join(base, 'YoFiles')
+    if sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Caches/YoFiles')
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'yofiles')
+
+
+def _subtree_bounds(path):
+    """(low, high) so that low <= p < high selects every stored path strictly below path"""
+    prefix = os.fsencode(os.path.join(path, ''))
+    return prefix, prefix[:-1] + bytes([prefix[-1] + 1])
+
+
+def _join_names(names):
+    return b'\0'.join(map(os.fsencode, names))
+
+
+def _split_names(blob):
+    return [os.fsdecode(name) for name in blob.split(b'\0')]
+
+
+def ancestor_totals(node):
+    """(path, size, alloc, files, folders) for each ancestor of node, nearest first"""
+    rows = []
+    path = os.path.dirname(node.path)
+    ancestor = node.parent
+    while ancestor is not None:
+        rows.append((path, ancestor.size, ancestor.alloc, ancestor.files, ancestor.folders))
+        ancestor = ancestor.parent
+        path = os.path.dirname(path)
+    return rows
+
+
+class ScanStore:
+    """SQLite-backed store of scanned directory trees.
+
+    One row per directory holds its stat identity, its own files and its
+    subtree totals. Writes for a whole tree happen in one transaction with
+    batched executemany() calls, and loading reads one subtree with a
+    single range query on the primary key. The connection is shared by
+    the scan and UI threads, so every access goes through one lock.
+    """
+
+    def __init__(self, db_path=None):
+        if db_path is None:
+            cache_dir = default_cache_dir()
+            os.makedirs(cache_dir, exist_ok=True)
+            db_path = os.path.join(cache_dir, 'scan_cache.sqlite3')
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS dirs")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS dirs (
+                path BLOB PRIMARY KEY,
+                parent BLOB,
+                mtime INTEGER,
+                ino INTEGER,
+                dev INTEGER,
+                own_size INTEGER,
+                own_alloc INTEGER,
+                own_files INTEGER,
+                size INTEGER,
+                alloc INTEGER,
+                files INTEGER,
+                folders INTEGER,
+                file_names BLOB,
+                file_sizes BLOB,
+                file_allocs BLOB,
+                file_mtimes BLOB,
+                mounts BLOB,
+                scanned_at REAL
+            ) WITHOUT ROWID""")
+        self.conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def save_tree(self, node, scanned_at=None):
+        """Persist node's whole subtree, replacing anything stored below it
+
+        If node has been grafted into a larger tree, the ancestors' stored
+        totals are updated too so they stay consistent with memory. A
+        tree saved before its graft gets them from update_totals() later.
+        """
+        if scanned_at is None:
+            scanned_at = time.time()
+        path = node.path
+        low, high = _subtree_bounds(path)
+
+        with self.lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM dirs WHERE path >= ? AND path < ?", (low, high))
+
+                batch = []
+                for node_path, current in node.iter_nodes():
+                    # Stored roots name their parent too, so a later save of
+                    # an enclosing tree can link them in
+                    parent_path = os.path.dirname(node_path)
+                    batch.append((
+                        os.fsencode(node_path),
+                        os.fsencode(parent_path) if parent_path != node_path else None,
+                        current.mtime, current.ino, current.dev,
+                        current.own_size, current.own_alloc, current.own_files,
+                        current.size, current.alloc, current.files, current.folders,
+                        _join_names(current.file_names),
+                        current.file_sizes.tobytes(),
+                        current.file_allocs.tobytes(),
+                        current.file_mtimes.tobytes(),
+                        _join_names(current.mounts) if current.mounts else None,
+                        scanned_at,
+                    ))
+                    if len(batch) >= BATCH_SIZE:
+                        self._insert(batch)
+                        batch = []
+                if batch:
+                    self._insert(batch)
+
+                self._update_totals(ancestor_totals(node))
+
+    def update_totals(self, rows):
+        """Store new subtree totals from (path, size, alloc, files, folders) rows
+
+        For the ancestors of a tree that was saved on its own and grafted
+        into a larger one afterwards (see ancestor_totals).
+        """
+        with self.lock:
+            with self.conn:
+                self._update_totals(rows)
+
+    def _update_totals(self, rows):
+        self.conn.executemany(
+            "UPDATE dirs SET size = ?, alloc = ?, files = ?, folders = ? WHERE path = ?",
+            [(size, alloc, files, folders, os.fsencode(path))
+             for path, size, alloc, files, folders in rows])
+
+    def _insert(self, rows):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO dirs VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def estimate(self, path):
+        """ScanEstimate from path's stored totals (no tree is loaded), or None"""
+        with self.lock:
+            row = self.conn.execute("SELECT files, folders, size FROM dirs WHERE path = ?",
+                                    (os.fsencode(os.path.normpath(path)),)).fetchone()
+        if row is None:
+            return None
+        files, folders, size = row
+        return ScanEstimate(files + folders, size)
+
+    def discard(self, path):
+        """Forget path and everything stored below it"""
+        low, high = _subtree_bounds(path)
+        with self.lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)",
+                                  (os.fsencode(path), low, high))
+
+    def load_tree(self, path, should_stop=None, validate=True):
+        """Rebuild the stored subtree rooted at path.
+
+        Returns (root_node, scanned_at, stale) or None when path was never
+        stored. stale lists the nodes whose directory no longer matches
+        the recorded mtime/inode (or has vanished); it is left empty with
+        validate=False for callers that run FolderScanner.iter_refresh,
+        which does the same checks and fixes what it finds. The root node
+        is named by its full path, like a fresh scan's tree. should_stop
+        is polled while validating and makes the load give up (returning
+        None).
+        """
+        path = os.path.normpath(path)
+        low, high = _subtree_bounds(path)
+        with self.lock:
+            root_row = self.conn.execute(
+                "SELECT * FROM dirs WHERE path = ?", (os.fsencode(path),)).fetchone()
+            if root_row is None:
+                return None
+            rows = self.conn.execute(
+                "SELECT * FROM dirs WHERE path >= ? AND path < ?", (low, high)).fetchall()
+
+        root = self._node_from_row(root_row, path)
+        nodes = {root_row[0]: root}
+        # Sorted paths put every parent before its children
+        rows.sort()
+        for row in rows:
+            parent = nodes.get(row[1])
+            if parent is None:
+                continue
+            node = self._node_from_row(row, os.fsdecode(os.path.basename(row[0])), parent)
+            parent.children[node.name] = node
+            nodes[row[0]] = node
+
+        stale = []
+        if not validate:
+            return root, root_row[-1], stale
+
+        for count, (node_path, node) in enumerate(nodes.items()):
+            if should_stop and count % 100 == 0 and should_stop():
+                return None
+            try:
+                st = os.stat(os.fsdecode(node_path))
+            except OSError:
+                stale.append(node)
+                continue
+            if st.st_mtime_ns != node.mtime or (node.ino and st.st_ino != node.ino):
+                stale.append(node)
+
+        return root, root_row[-1], stale
+
+    @staticmethod
+    def _node_from_row(row, name, parent=None):
+        (_, _, mtime, ino, dev, own_size, own_alloc, own_files, size, alloc, files, folders,
+         file_names, file_sizes, file_allocs, file_mtimes, mounts, _) = row
+        node = DirNode(name, parent)
+        node.mtime = mtime
+        node.ino = ino
+        node.dev = dev
+        node.own_size = own_size
+        node.own_alloc = own_alloc
+        node.own_files = own_files
+        node.size = size
+        node.alloc = alloc
+        node.files = files
+        node.folders = folders
+        if file_names:
+            node.file_names = _split_names(file_names)
+            node.file_sizes.frombytes(file_sizes)
+            node.file_allocs.frombytes(file_allocs)
+            node.file_mtimes.frombytes(file_mtimes)
+            node.recount_types()
+        if mounts:
+            node.mounts = _split_names(mounts)
+        return node
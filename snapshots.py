@@ -0,0 +1,263 @@
+"""Named scan snapshots for YoFiles.
+
+A snapshot keeps the subtree totals of every directory of one scanned
+tree under a name, so a later scan can be compared with it ("what ate
+200 GB since last week?"). Snapshots live in their own SQLite database
+next to the scan cache: the cache may be dropped whenever its schema
+changes, snapshots may not.
+
+Directories are stored by their path relative to the snapshot root with
+the (snapshot, path) primary key, so both sides of a diff come back in
+path order from the index and are merged in a single pass. Paths are
+os.fsencode() bytes, so names that are not valid UTF-8 can be stored.
+"""
+import os
+import time
+import sqlite3
+import threading
+from collections import namedtuple
+
+from scan_store import default_cache_dir
+
+SNAPSHOT_SCHEMA_VERSION = 2
+
+# Rows written per executemany() call
+BATCH_SIZE = 5000
+
+# A directory is not reported as growing when one child accounts for at
+# least this share of its growth; the child (or a deeper one) is
+DOMINANT_SHARE = 0.9
+
+# Rows in a diff's growing/shrinking rankings
+DIFF_LIMIT = 50
+
+SnapshotInfo = namedtuple('SnapshotInfo', 'id name root created_at size files folders')
+
+# One directory whose totals differ between two snapshots; a directory
+# missing on one side has 0 there
+SnapshotChange = namedtuple('SnapshotChange',
+                            'path old_size new_size size_delta files_delta folders_delta')
+
+
+class SnapshotError(Exception):
+    """Raised for an unknown snapshot name or snapshots that cannot be compared"""
+
+
+class SnapshotDiff:
+    """Per-directory changes between two snapshots, from SnapshotStore.diff()"""
+
+    def __init__(self, old, new, changes, added, removed):
+        self.old = old
+        self.new = new
+        self.changes = changes
+        self.added = added
+        self.removed = removed
+
+    @property
+    def interval(self):
+        """Seconds between the two snapshots"""
+        return self.new.created_at - self.old.created_at
+
+    @property
+    def size_delta(self):
+        return self.new.size - self.old.size
+
+    @property
+    def files_delta(self):
+        return self.new.files - self.old.files
+
+    def rate(self, change):
+        """Growth of a change in bytes per day (None for snapshots taken at once)"""
+        if self.interval <= 0:
+            return None
+        return change.size_delta * 86400 / self.interval
+
+    def full_path(self, change):
+        return os.path.join(self.new.root, change.path) if change.path else self.new.root
+
+    def growing(self, limit=DIFF_LIMIT):
+        """Subtrees that grew most, skipping directories whose growth sits in one child"""
+        return self._ranked(limit, 1)
+
+    def shrinking(self, limit=DIFF_LIMIT):
+        """Subtrees that shrank most, with the same rule"""
+        return self._ranked(limit, -1)
+
+    def _ranked(self, limit, sign):
+        # Largest same-signed child delta of every changed directory
+        dominant = {}
+        for change in self.changes:
+            if change.path and change.size_delta * sign > 0:
+                parent = os.path.dirname(change.path)
+                dominant[parent] = max(dominant.get(parent, 0), change.size_delta * sign)
+        ranked = [change for change in self.changes
+                  if change.size_delta * sign > 0
+                  and dominant.get(change.path, 0) < DOMINANT_SHARE * change.size_delta * sign]
+        ranked.sort(key=lambda change: (-change.size_delta * sign, change.path))
+        return ranked[:limit]
+
+
+class SnapshotStore:
+    """SQLite-backed store of named snapshots.
+
+    Follows ScanStore: one connection shared by the UI and worker threads
+    behind one lock, whole snapshots written in one transaction with
+    batched executemany() calls.
+    """
+
+    def __init__(self, db_path=None):
+        if db_path is None:
+            data_dir = default_cache_dir()
+            os.makedirs(data_dir, exist_ok=True)
+            db_path = os.path.join(data_dir, 'snapshots.sqlite3')
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > SNAPSHOT_SCHEMA_VERSION:
+            raise SnapshotError(f"{self.db_path} was written by a newer YoFiles")
+        if version == 1:
+            # Version 1 stored paths as text; their UTF-8 bytes are what
+            # os.fsencode gives for them, and every path must be bytes for
+            # the diff merge to compare them
+            with self.conn:
+                self.conn.execute("UPDATE snapshots SET root = CAST(root AS BLOB)")
+                self.conn.execute("UPDATE snapshot_dirs SET path = CAST(path AS BLOB)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                id INTEGER PRIMARY KEY,
+                name TEXT UNIQUE,
+                root BLOB,
+                created_at REAL,
+                size INTEGER,
+                files INTEGER,
+                folders INTEGER
+            )""")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS snapshot_dirs (
+                snapshot INTEGER,
+                path BLOB,
+                size INTEGER,
+                files INTEGER,
+                folders INTEGER,
+                PRIMARY KEY (snapshot, path)
+            ) WITHOUT ROWID""")
+        self.conn.execute(f"PRAGMA user_version={SNAPSHOT_SCHEMA_VERSION}")
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def save(self, name, node, created_at=None):
+        """Store node's subtree totals as snapshot name, replacing one of the same name"""
+        if created_at is None:
+            created_at = time.time()
+        root = node.path
+        prefix = os.path.join(root, '')
+
+        with self.lock:
+            with self.conn:
+                self._delete(name)
+                cursor = self.conn.execute(
+                    "INSERT INTO snapshots (name, root, created_at, size, files, folders) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (name, os.fsencode(root), created_at, node.size, node.files, node.folders))
+                snapshot_id = cursor.lastrowid
+
+                batch = []
+                for node_path, current in node.iter_nodes():
+                    relative = node_path[len(prefix):] if current is not node else ''
+                    batch.append((snapshot_id, os.fsencode(relative), current.size, current.files,
+                                  current.folders))
+                    if len(batch) >= BATCH_SIZE:
+                        self._insert(batch)
+                        batch = []
+                if batch:
+                    self._insert(batch)
+
+    def _insert(self, rows):
+        self.conn.executemany("INSERT INTO snapshot_dirs VALUES (?, ?, ?, ?, ?)", rows)
+
+    def _delete(self, name):
+        row = self.conn.execute("SELECT id FROM snapshots WHERE name = ?", (name,)).fetchone()
+        if row is not None:
+            self.conn.execute("DELETE FROM snapshot_dirs WHERE snapshot = ?", (row[0],))
+            self.conn.execute("DELETE FROM snapshots WHERE id = ?", (row[0],))
+        return row is not None
+
+    def delete(self, name):
+        """Forget snapshot name; returns False if there was none"""
+        with self.lock:
+            with self.conn:
+                return self._delete(name)
+
+    def list(self):
+        """Every snapshot, oldest first"""
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM snapshots ORDER BY created_at").fetchall()
+        return [self._info_from_row(row) for row in rows]
+
+    def info(self, name):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM snapshots WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise SnapshotError(f"No snapshot named {name!r}")
+        return self._info_from_row(row)
+
+    @staticmethod
+    def _info_from_row(row):
+        snapshot_id, name, root = row[:3]
+        return SnapshotInfo(snapshot_id, name, os.fsdecode(root), *row[3:])
+
+    def diff(self, old_name, new_name, should_stop=None):
+        """Compare two snapshots directory by directory; returns a SnapshotDiff
+
+        Both sides are read in path order straight from the primary key
+        and merged in one pass, so only changed directories are kept.
+        Returns None if should_stop() turned true on the way.
+        """
+        old = self.info(old_name)
+        new = self.info(new_name)
+        if os.path.normcase(old.root) != os.path.normcase(new.root):
+            raise SnapshotError(f"Snapshots {old_name!r} and {new_name!r} are of different "
+                                f"folders ({old.root} and {new.root})")
+        query = "SELECT path, size, files, folders FROM snapshot_dirs WHERE snapshot = ? ORDER BY path"
+        changes = []
+        added = removed = 0
+
+        with self.lock:
+            old_rows = self.conn.execute(query, (old.id,))
+            new_rows = self.conn.execute(query, (new.id,))
+            before = next(old_rows, None)
+            after = next(new_rows, None)
+            count = 0
+            while before is not None or after is not None:
+                count += 1
+                if should_stop and count % 10000 == 0 and should_stop():
+                    return None
+                if after is None or (before is not None and before[0] < after[0]):
+                    # Gone since the old snapshot
+                    path, size, files, folders = before
+                    changes.append(SnapshotChange(os.fsdecode(path), size, 0, -size, -files, -folders))
+                    removed += 1
+                    before = next(old_rows, None)
+                elif before is None or after[0] < before[0]:
+                    path, size, files, folders = after
+                    changes.append(SnapshotChange(os.fsdecode(path), 0, size, size, files, folders))
+                    added += 1
+                    after = next(new_rows, None)
+                else:
+                    if before[1:] != after[1:]:
+                        changes.append(SnapshotChange(os.fsdecode(before[0]), before[1], after[1],
+                                                      after[1] - before[1], after[2] - before[2],
+                                                      after[3] - before[3]))
+                    before = next(old_rows, None)
+                    after = next(new_rows, None)
+
+        return SnapshotDiff(old, new, changes, added, removed)